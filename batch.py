@@ -0,0 +1,200 @@
+import argparse
+import itertools
+import json
+import time
+from check import open_library, validate_id, validate_text
+
+# Library method, required fields and optional fields of each transaction,
+# in the order of the method's arguments. Operations are named as in the journal.
+TRANSACTIONS = {
+    'add_book': ('add_book', ('title', 'author', 'isbn'), ()),
+    'update_book': ('update_book', ('isbn',), ('title', 'author')),
+    'delete_book': ('delete_book', ('isbn',), ()),
+    'add_copies': ('add_copies', ('isbn', 'barcodes'), ()),
+    'add_user': ('add_user', ('name', 'user_id'), ()),
+    'update_user': ('update_user', ('user_id',), ('name',)),
+    'delete_user': ('delete_user', ('user_id',), ()),
+    'checkout': ('checkout_book', ('user_id', 'isbn'), ()),
+    'checkin': ('checkin_book', ('user_id', 'isbn'), ()),
+    'place_hold': ('place_hold', ('user_id', 'isbn'), ()),
+    'cancel_hold': ('cancel_hold', ('user_id', 'isbn'), ()),
+}
+
+TEXT_FIELDS = {'title': "Title", 'author': "Author", 'name': "Name"}
+ID_FIELDS = {'isbn': "ISBN", 'user_id': "User ID"}
+
+
+def validate_field(field, value):
+    """
+    Check one field of a transaction with the rules of the interactive flows.
+
+    Args:
+        field (str): Name of the field.
+        value: The value to check.
+
+    Returns:
+        str: An error message, or None if the value is valid.
+    """
+    if field in TEXT_FIELDS:
+        return validate_text(value, TEXT_FIELDS[field])
+    if field in ID_FIELDS:
+        return validate_id(value, ID_FIELDS[field])
+    if not value or not isinstance(value, list):
+        return "Barcodes must be a non-empty list."
+    return next(filter(None, (validate_id(barcode, "Barcode") for barcode in value)), None)
+
+
+def validate_transaction(library, record):
+    """
+    Check a transaction before applying it.
+
+    Updates and deletions of a book or user that does not exist are
+    rejected here, as the library methods do not report them.
+
+    Args:
+        library (LibraryManagementSystem): The library.
+        record (dict): The transaction, with an 'op' key and the fields of the operation.
+
+    Returns:
+        str: An error message, or None if the transaction is valid.
+    """
+    if not isinstance(record, dict):
+        return "Transaction must be a JSON object."
+    op = record.get('op')
+    if not isinstance(op, str) or op not in TRANSACTIONS:
+        return f"Unknown operation '{op}'."
+    _, required, optional = TRANSACTIONS[op]
+    unknown = set(record) - {'op', *required, *optional}
+    if unknown:
+        return f"Unknown field '{min(unknown)}'."
+    for field in required + optional:
+        if field in optional and record.get(field) is None:
+            continue
+        error = validate_field(field, record.get(field))
+        if error:
+            return error
+    if op in ('update_book', 'delete_book', 'add_copies') and not library.book_manager.get_book_by_isbn(record['isbn']):
+        return "Book not found."
+    if op in ('update_user', 'delete_user') and not library.user_manager.get_user_by_id(record['user_id']):
+        return "User not found."
+    return None
+
+
+def apply_line(library, number, line):
+    """
+    Parse, validate and apply one line of a transaction file.
+
+    Args:
+        library (LibraryManagementSystem): The library.
+        number (int): Line number, for the result.
+        line (str): A JSON object, see validate_transaction.
+
+    Returns:
+        dict: The result, with 'line', 'op', 'status' ('ok', 'failed' or
+            'invalid') and 'message' keys. A transaction fails when the
+            library refuses it, e.g. checking out a book that is not available.
+            Refusals are reported rather than raised, so an exception from the
+            library is a bug and is not caught: it may have changed the data
+            without journaling the change, and the replay must stop there.
+    """
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError as e:
+        return {'line': number, 'op': None, 'status': 'invalid', 'message': f"Invalid JSON: {e.msg}."}
+    op = record.get('op') if isinstance(record, dict) else None
+    error = validate_transaction(library, record)
+    if error:
+        return {'line': number, 'op': op, 'status': 'invalid', 'message': error}
+    method, required, optional = TRANSACTIONS[op]
+    with library.captured() as messages:
+        done = getattr(library, method)(*(record.get(field) for field in required + optional))
+    return {'line': number, 'op': op, 'status': 'ok' if done else 'failed', 'message': " ".join(messages)}
+
+
+def run_batch(library, lines, chunk_size=None):
+    """
+    Apply the transactions of a file, committing once per chunk.
+
+    Each chunk is applied inside library.batch(), so its operations are
+    saved or synced together, see LibraryManagementSystem.batch. Blank lines
+    are skipped.
+
+    Args:
+        library (LibraryManagementSystem): The library.
+        lines (iterable): Lines of the transaction file.
+        chunk_size (int, optional): Transactions per commit. Defaults to None
+            (one commit for the whole file).
+
+    Yields:
+        dict: The result of each transaction, see apply_line. The results of a
+            chunk are yielded once it has been committed.
+    """
+    numbered = ((number, line) for number, line in enumerate(lines, 1) if line.strip())
+    while True:
+        chunk = list(itertools.islice(numbered, chunk_size))
+        if not chunk:
+            return
+        with library.batch():
+            results = [apply_line(library, number, line) for number, line in chunk]
+        yield from results
+
+
+def positive_int(value):
+    """
+    Parse a command-line argument that must be a positive integer.
+
+    Args:
+        value (str): The argument.
+
+    Returns:
+        int: Its value.
+
+    Raises:
+        argparse.ArgumentTypeError: If it is not an integer greater than 0.
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, not '{value}'")
+    return number
+
+
+def main():
+    """
+    Replay a transaction file and report the result of each line and the throughput.
+    """
+    parser = argparse.ArgumentParser(description="Apply a transaction file to the Library Management System")
+    parser.add_argument("path", help="JSON Lines file, one transaction per line, e.g. "
+                                     '{"op": "checkout", "user_id": "u1", "isbn": "123"}')
+    parser.add_argument("--chunk-size", type=positive_int, help="Transactions per commit (default: the whole file)")
+    parser.add_argument("--report", help="Write the results as JSON Lines to this file instead of printing them")
+    args = parser.parse_args()
+
+    library = open_library()
+    counts = {'ok': 0, 'failed': 0, 'invalid': 0}
+    report = open(args.report, 'w') if args.report else None
+    start = time.perf_counter()
+    try:
+        with open(args.path) as lines:
+            for result in run_batch(library, lines, args.chunk_size):
+                counts[result['status']] += 1
+                if report:
+                    report.write(json.dumps(result) + "\n")
+                else:
+                    print(f"Line {result['line']}: {result['status']}: {result['message']}")
+    finally:
+        elapsed = time.perf_counter() - start
+        library.close()
+        if report:
+            report.close()
+
+    total = sum(counts.values())
+    rate = total / elapsed if elapsed else float('inf')
+    print(f"Applied {counts['ok']} of {total} transactions ({counts['failed']} failed, {counts['invalid']} invalid) "
+          f"in {elapsed:.2f}s ({rate:.0f} transactions/s).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,953 @@
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from batch import run_batch
+from book import BookManager
+from check import LibraryManagementSystem
+from fuzzy import MAX_DISTANCE, edit_distance, words
+from holds import HoldQueues
+from ledger import DAY, LOAN_DAYS, CheckoutLedger
+from models import Book, User
+from shard import ShardedLibrary
+from storage import DURABILITY_LEVELS, Storage
+from user import UserManager
+
+WORDS = ["river", "night", "garden", "stone", "habits", "war", "peace", "alchemist", "shadow", "empire",
+         "winter", "ocean", "secret", "history", "dream", "fire", "silent", "road", "city", "light"]
+
+
+class DictBook:
+    """Book with a per-instance __dict__, as models.Book was before __slots__."""
+
+    def __init__(self, title, author, isbn, available=True):
+        self.title = title
+        self.author = author
+        self.isbn = isbn
+        self.available = available
+
+
+def make_book_manager(n):
+    """
+    Build a BookManager holding n synthetic books.
+
+    Args:
+        n (int): Number of books.
+
+    Returns:
+        BookManager: The populated manager.
+    """
+    manager = BookManager()
+    for i in range(n):
+        manager.add_book(f"Title {i}", f"Author {i % 1000}", f"isbn{i}")
+    return manager
+
+
+def make_user_manager(n):
+    """
+    Build a UserManager holding n synthetic users.
+
+    Args:
+        n (int): Number of users.
+
+    Returns:
+        UserManager: The populated manager.
+    """
+    manager = UserManager()
+    for i in range(n):
+        manager.add_user(f"User {i}", f"user{i}")
+    return manager
+
+
+def bench_lookups(sizes, repeat=100000):
+    """
+    Time get_book_by_isbn and get_user_by_id at several catalog sizes.
+
+    Args:
+        sizes (list): Catalog sizes to measure.
+        repeat (int, optional): Number of lookups per measurement. Defaults to 100000.
+    """
+    print(f"{'records':>10} {'isbn lookup (ns)':>18} {'user lookup (ns)':>18}")
+    for n in sizes:
+        books = make_book_manager(n)
+        users = make_user_manager(n)
+        keys = [str(random.randrange(n)) for _ in range(1000)]
+        isbns = [f"isbn{k}" for k in keys]
+        user_ids = [f"user{k}" for k in keys]
+        book_time = timeit.timeit(lambda: [books.get_book_by_isbn(k) for k in isbns], number=repeat // 1000)
+        user_time = timeit.timeit(lambda: [users.get_user_by_id(k) for k in user_ids], number=repeat // 1000)
+        print(f"{n:>10} {book_time / repeat * 1e9:>18.1f} {user_time / repeat * 1e9:>18.1f}")
+
+
+def bytes_per_book(book_class, n):
+    """
+    Measure the memory allocated per book when building n books.
+
+    Titles and ISBNs are created up front so that only the objects and the
+    per-book author strings are counted.
+
+    Args:
+        book_class (type): Class used to build the books.
+        n (int): Number of books.
+
+    Returns:
+        float: Allocated bytes per book.
+    """
+    titles = [f"Title {i}" for i in range(n)]
+    isbns = [f"isbn{i}" for i in range(n)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    books = [book_class(titles[i], f"Author {i % 1000}", isbns[i]) for i in range(n)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del books
+    return (after - before) / n
+
+
+def bench_memory(sizes):
+    """
+    Compare bytes per book of models.Book against a __dict__-based book.
+
+    Args:
+        sizes (list): Catalog sizes to measure.
+    """
+    print(f"{'records':>10} {'dict (B/book)':>14} {'slots (B/book)':>15}")
+    for n in sizes:
+        print(f"{n:>10} {bytes_per_book(DictBook, n):>14.1f} {bytes_per_book(Book, n):>15.1f}")
+
+
+def bench_durability(sizes, operations=500):
+    """
+    Time checkout/checkin pairs at each durability level, with and without a journal.
+
+    Args:
+        sizes (list): Catalog sizes to measure.
+        operations (int, optional): Number of operations per measurement. Defaults to 500.
+    """
+    print(f"{'records':>10} {'mode':>9} {'durability':>11} {'ops/s':>10}")
+    for n in sizes:
+        for journaled in (True, False):
+            for durability in DURABILITY_LEVELS:
+                with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+                    path = Path(directory)
+                    library = LibraryManagementSystem(path / "books.json", path / "users.json",
+                                                      path / "checkouts.json",
+                                                      journal_file=path / "journal.jsonl" if journaled else None,
+                                                      durability=durability)
+                    library.bulk_add_books({'title': f"Title {i}", 'author': f"Author {i % 1000}",
+                                            'isbn': f"isbn{i}"} for i in range(n))
+                    library.bulk_add_users([{'name': "Reader", 'user_id': "reader"}])
+                    isbns = [f"isbn{random.randrange(n)}" for _ in range(operations // 2)]
+                    start = time.perf_counter()
+                    for isbn in isbns:
+                        library.checkout_book("reader", isbn)
+                        library.checkin_book("reader", isbn)
+                    library.close()
+                    elapsed = time.perf_counter() - start
+                mode = "journal" if journaled else "snapshot"
+                print(f"{n:>10} {mode:>9} {durability:>11} {operations / elapsed:>10.0f}")
+
+
+def check_invariants(library):
+    """
+    Count inconsistencies between books, users and the checkout ledger.
+
+    Args:
+        library (LibraryManagementSystem): The library to check.
+
+    Returns:
+        int: Number of violations found; 0 means consistent.
+    """
+    violations = 0
+    for isbn, book in library.book_manager.books.items():
+        holders = library.checkouts.holders_of(isbn)
+        if len(holders) != book.total_copies - book.available_copies:
+            violations += 1
+    for entry in library.checkouts:
+        user = library.user_manager.get_user_by_id(entry['user_id'])
+        book = library.book_manager.get_book_by_isbn(entry['isbn'])
+        if book not in user.checked_out_books:
+            violations += 1
+    loans = sum(len(user.checked_out_books) for user in library.user_manager.users.values())
+    if loans != len(library.checkouts):
+        violations += 1
+    return violations
+
+
+def bench_concurrency(sizes, threads=8, operations=20000):
+    """
+    Run threads of random checkouts and checkins against one library.
+
+    A small pool of hot books makes threads compete for the same copies.
+    Invariants are checked in memory and again after reloading from disk.
+
+    Args:
+        sizes (list): Catalog sizes to measure.
+        threads (int, optional): Number of concurrent desks. Defaults to 8.
+        operations (int, optional): Total number of operations. Defaults to 20000.
+    """
+    print(f"{'records':>10} {'threads':>8} {'ops/s':>10} {'violations':>11}")
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+            path = Path(directory)
+            files = (path / "books.json", path / "users.json", path / "checkouts.json")
+            library = LibraryManagementSystem(*files, journal_file=path / "journal.jsonl", background_writer=True)
+            library.bulk_add_books({'title': f"Title {i}", 'author': f"Author {i % 1000}",
+                                    'isbn': f"isbn{i}"} for i in range(n))
+            library.bulk_add_users({'name': f"User {i}", 'user_id': f"user{i}"} for i in range(100))
+            hot = [f"isbn{i}" for i in range(min(n, 50))]
+
+            def desk():
+                for _ in range(operations // threads):
+                    user_id, isbn = f"user{random.randrange(100)}", random.choice(hot)
+                    if random.random() < 0.5:
+                        library.checkout_book(user_id, isbn)
+                    else:
+                        library.checkin_book(user_id, isbn)
+
+            library.flush()
+            workers = [threading.Thread(target=desk) for _ in range(threads)]
+            start = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            library.flush()
+            elapsed = time.perf_counter() - start
+            library.close()
+            violations = check_invariants(library)
+            violations += check_invariants(LibraryManagementSystem(*files, journal_file=path / "journal.jsonl"))
+        print(f"{n:>10} {threads:>8} {operations / elapsed:>10.0f} {violations:>11}")
+
+
+def bench_snapshots(sizes, threads=4, seconds=2.0):
+    """
+    Run checkout desks next to a reader scanning the catalog, with and without snapshots.
+
+    The locked reader holds the library lock while it counts checked out
+    books; the snapshot reader counts them in a read snapshot without the
+    lock. Each pass checks that the count equals the number of active loans.
+    The longest time the reader held the lock bounds how long it can stall
+    circulation; on a single core the desks also share the CPU with it.
+
+    Args:
+        sizes (list): Catalog sizes to measure.
+        threads (int, optional): Number of desk threads. Defaults to 4.
+        seconds (float, optional): Duration of each measurement. Defaults to 2.0.
+    """
+    print(f"{'records':>10} {'reader':>9} {'desk ops/s':>11} {'p99 (ms)':>9} {'max (ms)':>9} {'scans':>6} "
+          f"{'lock held (ms)':>15} {'violations':>11}")
+    for n in sizes:
+        for mode in ("locked", "snapshot"):
+            with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+                path = Path(directory)
+                # Compaction is pushed out of the run, so only the reader can stall the desks.
+                library = LibraryManagementSystem(path / "books.json", path / "users.json", path / "checkouts.json",
+                                                  journal_file=path / "journal.jsonl", compact_every=1 << 30,
+                                                  durability='none')
+                library.bulk_add_books({'title': f"Title {i}", 'author': f"Author {i % 1000}",
+                                        'isbn': f"isbn{i}"} for i in range(n))
+                library.bulk_add_users({'name': f"User {i}", 'user_id': f"user{i}"} for i in range(100))
+                done = threading.Event()
+                latencies, scans, violations, held = [[] for _ in range(threads)], [0], [0], [0.0]
+
+                def desk(number):
+                    while not done.is_set():
+                        user_id, isbn = f"user{random.randrange(100)}", f"isbn{random.randrange(n)}"
+                        start = time.perf_counter()
+                        library.checkout_book(user_id, isbn)
+                        library.checkin_book(user_id, isbn)
+                        latencies[number].append(time.perf_counter() - start)
+
+                def reader():
+                    while not done.is_set():
+                        if mode == "locked":
+                            with library.lock:
+                                start = time.perf_counter()
+                                out = sum(not book.available for book in library.book_manager.books.values())
+                                loans = len(library.checkouts)
+                                held[0] = max(held[0], time.perf_counter() - start)
+                        else:
+                            with library.lock:
+                                start = time.perf_counter()
+                                snapshot = library.read_snapshot()
+                                held[0] = max(held[0], time.perf_counter() - start)
+                            out = sum(not book.available for book in snapshot.books)
+                            loans = len(snapshot.checkouts)
+                        violations[0] += out != loans
+                        scans[0] += 1
+
+                workers = [threading.Thread(target=desk, args=(i,)) for i in range(threads)]
+                workers.append(threading.Thread(target=reader))
+                for worker in workers:
+                    worker.start()
+                time.sleep(seconds)
+                done.set()
+                for worker in workers:
+                    worker.join()
+                library.close()
+            pairs = sorted(itertools.chain.from_iterable(latencies))
+            p99 = pairs[int(len(pairs) * 0.99)] * 1e3
+            print(f"{n:>10} {mode:>9} {2 * len(pairs) / seconds:>11.0f} {p99:>9.2f} {pairs[-1] * 1e3:>9.2f} "
+                  f"{scans[0]:>6} {held[0] * 1e3:>15.3f} {violations[0]:>11}")
+
+
+def generate_data(directory, books, users, loans, seed=0):
+    """
+    Write synthetic books, users and active loans to data files.
+
+    Args:
+        directory (Path): Directory receiving books.json, users.json and checkouts.json.
+        books (int): Number of books.
+        users (int): Number of users.
+        loans (int): Number of active loans; at most one per book.
+        seed (int, optional): Random seed, so runs are reproducible. Defaults to 0.
+
+    Returns:
+        tuple: Paths of the books, users and checkouts files.
+    """
+    rng = random.Random(seed)
+    files = (directory / "books.json", directory / "users.json", directory / "checkouts.json")
+    book_list = [Book(" ".join(rng.choice(WORDS) for _ in range(3)).title() + f" {i}",
+                      f"Author {rng.randrange(max(books // 20, 1))}", f"isbn{i}") for i in range(books)]
+    user_list = [User(f"User {i}", f"user{i}") for i in range(users)]
+    ledger = CheckoutLedger()
+    for i in range(min(loans, books)):
+        book, user = book_list[i], user_list[i % users]
+        book.check_out()
+        user.checked_out_books.add(book)
+        ledger.open(user.user_id, book.isbn, 1704067200)
+    storage = Storage(*files, durability='none')
+    storage.save_books(book_list)
+    storage.save_users(user_list)
+    storage.save_checkouts(ledger)
+    return files
+
+
+def bench_startup(sizes):
+    """
+    Compare loading the catalog from books.json and from the binary snapshot.
+
+    Args:
+        sizes (list): Catalog sizes to measure.
+    """
+    print(f"{'records':>10} {'json (ms)':>10} {'snapshot (ms)':>14} {'first lookup (us)':>18}")
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory)
+            files = generate_data(path, n, 1, 0)
+            storage = Storage(*files, durability='none', snapshot_file=path / "books.snapshot")
+            json_time = best_of(lambda: Storage(*files).load_books())
+            storage.save_books(Storage(*files).load_books())
+            snapshot_time = best_of(storage.load_books)
+            books = storage.load_books()
+            isbns = [f"isbn{random.randrange(n)}" for _ in range(1000)]
+            lookup_time = best_of(lambda: [books[isbn] for isbn in isbns], 1) / len(isbns)
+            books.snapshot.close()
+        print(f"{n:>10} {json_time * 1e3:>10.1f} {snapshot_time * 1e3:>14.2f} {lookup_time * 1e6:>18.1f}")
+
+
+def bench_shards(sizes, shard_counts, queries=200):
+    """
+    Time bulk import and search throughput of a sharded catalog at several shard counts.
+
+    Args:
+        sizes (list): Catalog sizes to measure.
+        shard_counts (list): Numbers of shard processes to compare.
+        queries (int, optional): Number of searches per measurement. Defaults to 200.
+    """
+    print(f"{'records':>10} {'shards':>7} {'import (rec/s)':>15} {'search (q/s)':>13}")
+    for n in sizes:
+        rng = random.Random(0)
+        records = [{'title': " ".join(rng.choice(WORDS) for _ in range(3)).title() + f" {i}",
+                    'author': f"Author {rng.randrange(max(n // 20, 1))}", 'isbn': f"isbn{i}"} for i in range(n)]
+        terms = [rng.choice(WORDS)[:rng.randrange(3, 7)] for _ in range(queries)]
+        for shards in shard_counts:
+            with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+                library = ShardedLibrary(directory, shards, durability='none')
+                start = time.perf_counter()
+                library.bulk_add_books(records)
+                import_time = time.perf_counter() - start
+                library.search_books(title=terms[0], limit=20)
+                search_time = best_of(lambda: [library.search_books(title=term, limit=20) for term in terms])
+                library.close()
+            print(f"{n:>10} {shards:>7} {n / import_time:>15.0f} {queries / search_time:>13.0f}")
+
+
+def bench_inventory(sizes, checked_out=0.05):
+    """
+    Compare inventory queries answered by scanning the books and by the checked-out set.
+
+    The filtered searches rank the books of one author that are available
+    (most of them) or checked out (few of them).
+
+    Args:
+        sizes (list): Catalog sizes to measure.
+        checked_out (float, optional): Fraction of the books checked out. Defaults to 0.05.
+    """
+    print(f"{'records':>10} {'query':>22} {'scan (ms)':>10} {'index (ms)':>12}")
+    for n in sizes:
+        manager = BookManager(indexed=True)
+        manager.bulk_add_books([(f"Title {i}", f"Author {i % 1000}", f"isbn{i}") for i in range(n)])
+        manager.inventory()
+        manager.search_index()
+        for i in random.Random(0).sample(range(n), int(n * checked_out)):
+            manager.books[f"isbn{i}"].check_out()
+        books = manager.books
+        queries = [
+            ("count available", lambda: sum(1 for book in books.values() if book.available),
+             lambda: manager.count_books(available=True)),
+            ("list checked out", lambda: [book for book in books.values() if not book.available],
+             lambda: list(manager.search_books(available=False))),
+            ("available + author", lambda: [book for book in manager.search_books(author="Author 7")
+                                            if book.available],
+             lambda: list(manager.search_books(author="Author 7", available=True))),
+            ("checked out + author", lambda: [book for book in manager.search_books(author="Author 7")
+                                              if not book.available],
+             lambda: list(manager.search_books(author="Author 7", available=False))),
+        ]
+        for name, scan, indexed in queries:
+            print(f"{n:>10} {name:>22} {best_of(scan) * 1e3:>10.3f} {best_of(indexed) * 1e3:>12.3f}")
+
+
+def bench_copies(copy_counts, checked_out=0.9, operations=2000):
+    """
+    Compare a title held as copies of one Book with one Book per copy.
+
+    With one Book per copy, finding a free copy means searching the title
+    and scanning its matches. Checkouts take a free copy and check it back
+    in, so the fraction of copies out stays constant. Storage sizes are per
+    copy, in the JSON books file and the binary snapshot.
+
+    Args:
+        copy_counts (list): Numbers of copies of the title.
+        checked_out (float, optional): Fraction of the copies out. Defaults to 0.9.
+        operations (int, optional): Number of checkout and checkin pairs. Defaults to 2000.
+    """
+    print(f"{'copies':>8} {'model':>14} {'checkout+in (us)':>17} {'json (B/copy)':>14} {'snapshot (B/copy)':>18}")
+    for n in copy_counts:
+        separate = BookManager(indexed=True)
+        separate.bulk_add_books([("Dune", "Frank Herbert", f"dune{i}") for i in range(n)])
+        title = Book("Dune", "Frank Herbert", "dune")
+        title.add_copies(f"dune{i}" for i in range(1, n))
+        titles = BookManager(indexed=True)
+        titles.load([title])
+        for i in range(int(n * checked_out)):
+            separate.books[f"dune{i}"].check_out()
+            title.check_out()
+
+        def cycle_separate():
+            for _ in range(operations):
+                book = next(book for book in separate.search_books(title="Dune") if book.available)
+                book.check_out()
+                book.check_in()
+
+        def cycle_title():
+            book = titles.get_book_by_isbn("dune")
+            for _ in range(operations):
+                if book.available:
+                    book.check_in(book.check_out())
+
+        for name, manager, cycle in (("book per copy", separate, cycle_separate), ("copies", titles, cycle_title)):
+            with tempfile.TemporaryDirectory() as directory:
+                path = Path(directory)
+                storage = Storage(path / "books.json", path / "users.json", path / "checkouts.json",
+                                  durability='none')
+                storage.save_books(manager.books.values())
+                json_size = (path / "books.json").stat().st_size
+                storage.snapshot_file = path / "books.snapshot"
+                storage.save_books(manager.books.values())
+                snapshot_size = storage.snapshot_file.stat().st_size
+            print(f"{n:>8} {name:>14} {best_of(cycle, 1) / operations * 1e6:>17.2f} {json_size / n:>14.1f} "
+                  f"{snapshot_size / n:>18.1f}")
+
+
+def bench_overdue(sizes, overdue=0.01):
+    """
+    Compare overdue reports from the due date index with parsing every checkout time.
+
+    Loans are spread over 60 days of checkouts. The scan is how an overdue
+    report had to be built from ISO checkout times.
+
+    Args:
+        sizes (list): Numbers of active loans.
+        overdue (float, optional): Fraction of the loans overdue. Defaults to 0.01.
+    """
+    print(f"{'loans':>10} {'query':>14} {'results':>8} {'scan (ms)':>10} {'index (ms)':>11}")
+    for n in sizes:
+        rng = random.Random(0)
+        start = 1704067200
+        ledger = CheckoutLedger()
+        for i in range(n):
+            ledger.open(f"user{i}", f"isbn{i}", start + rng.randrange(60 * DAY))
+        legacy = [dict(entry, checkout_time=datetime.fromtimestamp(entry['checkout_time']).isoformat())
+                  for entry in ledger]
+        dues = sorted(entry['due'] for entry in ledger)
+        now = dues[int(n * overdue)]
+
+        def scan(low, high):
+            loans = []
+            for entry in legacy:
+                due = datetime.fromisoformat(entry['checkout_time']).timestamp() + LOAN_DAYS * DAY
+                if (low is None or due >= low) and due < high:
+                    loans.append((due, entry))
+            loans.sort(key=lambda loan: loan[0])
+            return loans
+
+        for name, low, high in (("overdue", None, now), ("due in 24h", now, now + DAY)):
+            results = len(list(ledger.due_between(low, high)))
+            print(f"{n:>10} {name:>14} {results:>8} {best_of(lambda: scan(low, high)) * 1e3:>10.1f} "
+                  f"{best_of(lambda: list(ledger.due_between(low, high))) * 1e3:>11.3f}")
+
+
+def bench_holds(sizes, titles=100, handoffs=1000):
+    """
+    Time hold queues with many holds on a few hot titles.
+
+    Every hot title is checked out, then the holds are placed spread evenly
+    across the titles, and each check-in hands the book to the next holder.
+    The scan is how the next holder is found without queues, by looking at
+    the holds of every user. Expiry is then compared with a sweep over every
+    ready hold, and the holds are saved and loaded back.
+
+    Args:
+        sizes (list): Numbers of holds.
+        titles (int, optional): Number of hot titles. Defaults to 100.
+        handoffs (int, optional): Number of check-ins timed. Defaults to 1000.
+    """
+    print(f"{'holds':>10} {'place (us)':>11} {'scan (us)':>10} {'hand-off (us)':>14} "
+          f"{'sweep (ms)':>11} {'timers (ms)':>12} {'reload (ms)':>12}")
+    for n in sizes:
+        users = max(n // titles, 1) + 1
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory)
+            library = LibraryManagementSystem(path / "books.json", path / "users.json", path / "checkouts.json",
+                                              journal_file=path / "journal.jsonl", durability='none',
+                                              compact_every=10 ** 9)
+            with library.captured():
+                library.bulk_add_books({'title': f"Hot {i}", 'author': "A", 'isbn': f"isbn{i}"}
+                                       for i in range(titles))
+                library.bulk_add_users({'name': f"User {u}", 'user_id': f"user{u}"} for u in range(users))
+                for i in range(titles):
+                    library.checkout_book("user0", f"isbn{i}")
+                requests = [(f"user{u}", f"isbn{i}") for u in range(1, users) for i in range(titles)][:n]
+                start = time.perf_counter()
+                for user_id, isbn in requests:
+                    library.place_hold(user_id, isbn)
+                place = (time.perf_counter() - start) / len(requests)
+
+                held = {}
+                for hold in library.holds:
+                    held.setdefault(hold['user_id'], {})[hold['isbn']] = hold['placed']
+
+                def scan(isbn):
+                    return min((holds[isbn], user_id) for user_id, holds in held.items() if isbn in holds)
+
+                isbns = [f"isbn{i % titles}" for i in range(handoffs)]
+                scan_time = best_of(lambda: [scan(isbn) for isbn in isbns[:100]]) / 100
+
+                # Each holder picks up and returns the book, handing it to the next one.
+                holders = {f"isbn{i}": "user0" for i in range(titles)}
+                elapsed = 0.0
+                for isbn in isbns:
+                    start = time.perf_counter()
+                    library.checkin_book(holders[isbn], isbn)
+                    elapsed += time.perf_counter() - start
+                    holders[isbn] = library.holds.holders_of(isbn)[0]['user_id']
+                    library.checkout_book(holders[isbn], isbn)
+                handoff = elapsed / len(isbns)
+
+            # Expiry over many ready holds, 1% of them due.
+            queues = HoldQueues({'user_id': f"user{i}", 'isbn': "isbn", 'placed': 0, 'barcode': None,
+                                 'expires': i} for i in range(n))
+            now = n // 100
+
+            def sweep():
+                return [key for key, hold in queues.ready.items() if hold['expires'] <= now]
+
+            def pop_timers():
+                # expired() pops the heap, so each run starts from a copy.
+                queues.timers = list(timers)
+                start = time.perf_counter()
+                queues.expired(now)
+                return time.perf_counter() - start
+
+            timers = queues.timers
+            sweep_time = best_of(sweep)
+            timer_time = min(pop_timers() for _ in range(3))
+
+            library.save_data()
+            reload = best_of(lambda: library.storage.load_holds())
+            library.close()
+        print(f"{n:>10} {place * 1e6:>11.1f} {scan_time * 1e6:>10.1f} {handoff * 1e6:>14.1f} "
+              f"{sweep_time * 1e3:>11.2f} {timer_time * 1e3:>12.3f} {reload * 1e3:>12.1f}")
+
+
+def bench_batch(sizes, books=10000, users=1000, chunk_size=1000):
+    """
+    Compare applying a transaction file in batches with calling the library once per transaction.
+
+    The transactions are a day of circulation: checkouts of distinct books,
+    then the check-ins of the same loans in random order, all of which
+    succeed. The interactive path calls the library methods directly, as the
+    menu does, so each operation is committed under the storage durability
+    level; the batch path also parses and validates each line.
+
+    Args:
+        sizes (list): Numbers of transactions, at most twice the catalog size.
+        books (int, optional): Catalog size. Defaults to 10000.
+        users (int, optional): Number of users. Defaults to 1000.
+        chunk_size (int, optional): Transactions per commit of the batch path. Defaults to 1000.
+    """
+    setups = (("json", {}), ("json+journal", {'journal': True}), ("sqlite", {'backend': 'sqlite'}))
+    print(f"{'transactions':>12} {'storage':>13} {'durability':>10} {'interactive/s':>14} {'batch/s':>10} "
+          f"{'speedup':>8}")
+    for n in sizes:
+        rng = random.Random(0)
+        loans = [(f"user{rng.randrange(users)}", f"isbn{i}") for i in rng.sample(range(books), n // 2)]
+        returns = rng.sample(loans, len(loans))
+        transactions = ([{'op': 'checkout', 'user_id': user_id, 'isbn': isbn} for user_id, isbn in loans] +
+                        [{'op': 'checkin', 'user_id': user_id, 'isbn': isbn} for user_id, isbn in returns])
+        lines = [json.dumps(transaction) for transaction in transactions]
+        for durability in ('batch', 'always'):
+            for name, setup in setups:
+                rates = []
+                for batched in (False, True):
+                    with tempfile.TemporaryDirectory() as directory:
+                        path = Path(directory)
+                        library = LibraryManagementSystem(
+                            path / "books.json", path / "users.json", path / "checkouts.json",
+                            journal_file=path / "journal.jsonl" if setup.get('journal') else None,
+                            backend=setup.get('backend', 'json'), database=path / "library.db",
+                            durability=durability)
+                        library.bulk_add_books({'title': f"Title {i}", 'author': f"Author {i % 500}",
+                                                'isbn': f"isbn{i}"} for i in range(books))
+                        library.bulk_add_users({'name': f"User {u}", 'user_id': f"user{u}"} for u in range(users))
+                        start = time.perf_counter()
+                        if batched:
+                            for _ in run_batch(library, lines, chunk_size):
+                                pass
+                        else:
+                            with library.captured():
+                                for transaction in transactions:
+                                    method = (library.checkout_book if transaction['op'] == 'checkout'
+                                              else library.checkin_book)
+                                    method(transaction['user_id'], transaction['isbn'])
+                        library.flush()
+                        library.commit()
+                        rates.append(n / (time.perf_counter() - start))
+                        library.close()
+                print(f"{n:>12} {name:>13} {durability:>10} {rates[0]:>14.0f} {rates[1]:>10.0f} "
+                      f"{rates[1] / rates[0]:>7.1f}x")
+
+
+def pseudo_words(count, rng):
+    """
+    Make distinct pronounceable words, for a vocabulary larger than WORDS.
+
+    Args:
+        count (int): Number of words.
+        rng (random.Random): Source of randomness.
+
+    Returns:
+        list: The words.
+    """
+    onsets = ["", "b", "bl", "br", "c", "ch", "cl", "cr", "d", "dr", "f", "fl", "fr", "g", "gl", "gr", "h", "j", "k",
+              "l", "m", "n", "p", "pl", "pr", "qu", "r", "s", "sc", "sh", "sl", "sp", "st", "t", "th", "tr", "v", "w",
+              "wh", "y", "z"]
+    codas = ["", "", "", "b", "ck", "d", "f", "g", "l", "ll", "m", "n", "nd", "ng", "nt", "p", "r", "rd", "rn", "s",
+             "sh", "ss", "st", "t", "th", "x"]
+    syllables = [onset + vowel + coda for onset in onsets
+                 for vowel in ("a", "e", "i", "o", "u", "y", "ai", "ea", "ee", "oo", "ou") for coda in codas]
+    made = set()
+    while len(made) < count:
+        made.add("".join(rng.choice(syllables) for _ in range(rng.choice((1, 2, 2, 2, 3)))))
+    return sorted(made)
+
+
+def typo(word, rng):
+    """
+    Apply one random edit (substitution, insertion, deletion or transposition) to a word.
+
+    Args:
+        word (str): The word.
+        rng (random.Random): Source of randomness.
+
+    Returns:
+        str: The misspelled word.
+    """
+    i = rng.randrange(len(word) - 1)
+    letter = rng.choice("abcdefghijklmnopqrstuvwxyz")
+    return rng.choice((word[:i] + letter + word[i + 1:], word[:i] + letter + word[i:], word[:i] + word[i + 1:],
+                       word[:i] + word[i + 1] + word[i] + word[i + 2:]))
+
+
+def bench_fuzzy(sizes, vocabulary=100000, queries=200, updates=10000):
+    """
+    Measure typo-tolerant title and author searches and the upkeep of their index.
+
+    Titles are two to four words and authors two words, drawn from a
+    vocabulary of pronounceable pseudo-words. Each query is a title word
+    or an author surname with one random edit, as typed by a user; the time
+    is that of the first page of results, and hits counts the queries that
+    found the book the word was taken from. The scan column compares the query
+    word with every word of the catalog, which is what the n-gram filter of
+    FuzzyIndex avoids. Updates retitle a book, so its words are removed from
+    the index and added back.
+
+    Args:
+        sizes (list): Catalog sizes.
+        vocabulary (int, optional): Number of distinct words. Defaults to 100000.
+        queries (int, optional): Queries per size. Defaults to 200.
+        updates (int, optional): Book updates per size. Defaults to 10000.
+    """
+    rng = random.Random(0)
+    pool = pseudo_words(vocabulary, rng)
+    surnames = pool[:vocabulary // 10]
+    print(f"{'books':>9} {'build (s)':>10} {'query (ms)':>11} {'p99 (ms)':>9} {'scan (ms)':>10} {'hits':>6} "
+          f"{'update (us)':>12}")
+    for n in sizes:
+        manager = BookManager()
+        for i in range(n):
+            manager.add_book(" ".join(rng.sample(pool, rng.randint(2, 4))).title(),
+                             f"{rng.choice(pool)} {rng.choice(surnames)}".title(), f"isbn{i}")
+        start = time.perf_counter()
+        index = manager.fuzzy_index()
+        build = time.perf_counter() - start
+
+        books = [manager.books[f"isbn{rng.randrange(n)}"] for _ in range(queries)]
+        searches = [({'title': typo(rng.choice(words(book.title)), rng)} if i % 2 else
+                     {'author': typo(words(book.author)[-1], rng)}) for i, book in enumerate(books)]
+        times, hits = [], 0
+        for book, search in zip(books, searches):
+            start = time.perf_counter()
+            results = list(manager.search_books(limit=20, fuzzy=MAX_DISTANCE, **search))
+            times.append(time.perf_counter() - start)
+            hits += any(key[-1] == book.isbn for key in manager.fuzzy_matches(max_distance=MAX_DISTANCE, **search))
+        times.sort()
+
+        vocabulary_words = list(index.vocabulary)
+        start = time.perf_counter()
+        for search in searches[:20]:
+            word = next(iter(search.values()))
+            limit = min(MAX_DISTANCE, len(word) // 3)
+            [other for other in vocabulary_words if edit_distance(word, other, limit) <= limit]
+        scan = (time.perf_counter() - start) / 20
+
+        start = time.perf_counter()
+        for _ in range(updates):
+            isbn = f"isbn{rng.randrange(n)}"
+            manager.update_book(isbn, title=" ".join(rng.sample(pool, 3)).title())
+        update = (time.perf_counter() - start) / updates
+
+        print(f"{n:>9} {build:>10.2f} {1000 * sum(times) / len(times):>11.2f} "
+              f"{1000 * times[int(len(times) * 0.99)]:>9.2f} {1000 * scan:>10.1f} {hits:>3}/{queries:<3} "
+              f"{1e6 * update:>11.1f}")
+
+
+def best_of(function, repeat=3):
+    """
+    Run a function several times and return the fastest run.
+
+    Args:
+        function (callable): The function to time.
+        repeat (int, optional): Number of runs. Defaults to 3.
+
+    Returns:
+        float: Duration of the fastest run in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_suite(sizes, operations=1000):
+    """
+    Time the hot paths of the library on synthetic data at several scales.
+
+    Each size n means n books, n // 10 users and n // 20 active loans. The
+    journal is not fsync'd, so the results measure the code rather than the disk.
+
+    Args:
+        sizes (list): Catalog sizes to measure.
+        operations (int, optional): Number of point operations timed per size. Defaults to 1000.
+
+    Returns:
+        dict: Seconds per call, keyed by 'operation@size'.
+    """
+    results = {}
+    for n in sizes:
+        users, loans = max(n // 10, 1), n // 20
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory)
+            files = generate_data(path, n, users, loans)
+            journal = path / "journal.jsonl"
+            rng = random.Random(1)
+
+            def load():
+                return LibraryManagementSystem(*files, journal_file=journal, durability='none')
+
+            library = load()
+            results[f"load_data@{n}"] = best_of(load)
+            results[f"save_data@{n}"] = best_of(library.save_data)
+
+            isbns = [f"isbn{rng.randrange(n)}" for _ in range(100 * operations)]
+            results[f"get_book_by_isbn@{n}"] = best_of(
+                lambda: [library.book_manager.get_book_by_isbn(isbn) for isbn in isbns], 5) / len(isbns)
+
+            queries = [rng.choice(WORDS)[:rng.randrange(3, 7)] for _ in range(100)]
+            def search():
+                return [list(library.book_manager.search_books(title=query, limit=20)) for query in queries]
+
+            def search_uncached():
+                library.book_manager.cache.clear()
+                return search()
+
+            results[f"search_books@{n}"] = best_of(search_uncached, 5) / len(queries)
+            results[f"search_books_cached@{n}"] = best_of(search, 5) / len(queries)
+
+            # Books from loans onwards are free, so each pair checks out and back in.
+            pairs = [(f"user{rng.randrange(users)}", f"isbn{loans + rng.randrange(n - loans)}")
+                     for _ in range(operations)]
+            checkouts, checkins = [], []
+            with library.captured():
+                for _ in range(3):
+                    start = time.perf_counter()
+                    for user_id, isbn in pairs:
+                        library.checkout_book(user_id, isbn)
+                    checkouts.append(time.perf_counter() - start)
+                    start = time.perf_counter()
+                    for user_id, isbn in pairs:
+                        library.checkin_book(user_id, isbn)
+                    checkins.append(time.perf_counter() - start)
+            results[f"checkout_book@{n}"] = min(checkouts) / operations
+            results[f"checkin_book@{n}"] = min(checkins) / operations
+            library.close()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Print results next to a baseline and list the regressions.
+
+    Args:
+        results (dict): Seconds per call, keyed by 'operation@size'.
+        baseline (dict): Baseline results in the same format.
+        threshold (float): Allowed slowdown, e.g. 0.25 for 25%.
+
+    Returns:
+        list: Keys of the results slower than baseline by more than threshold.
+    """
+    regressions = []
+    print(f"{'benchmark':<28} {'seconds':>12} {'baseline':>12} {'change':>8}")
+    for key, seconds in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            print(f"{key:<28} {seconds:>12.3g} {'-':>12} {'-':>8}")
+            continue
+        change = seconds / reference - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(key)
+            flag = " REGRESSION"
+        print(f"{key:<28} {seconds:>12.3g} {reference:>12.3g} {change:>+8.0%}{flag}")
+    return regressions
+
+
+def bench_suite(sizes, baseline_file, threshold, save_baseline):
+    """
+    Run the benchmark suite and compare it with, or store it as, the baseline.
+
+    Timings depend on the machine, so the baseline is not part of the
+    repository (it is in .gitignore): create one on the machine that runs
+    the check with `python bench.py suite --save-baseline`, then run
+    `python bench.py suite` after each change.
+
+    Args:
+        sizes (list): Catalog sizes to measure.
+        baseline_file (Path): JSON file holding the baseline results.
+        threshold (float): Allowed slowdown before a result counts as a regression.
+        save_baseline (bool): Store the results as the new baseline.
+
+    Returns:
+        int: Exit status, 1 if any benchmark regressed.
+    """
+    results = run_suite(sizes)
+    baseline = json.loads(baseline_file.read_text()) if baseline_file.exists() else {}
+    regressions = compare(results, baseline, threshold)
+    if not baseline and not save_baseline:
+        print(f"No baseline in {baseline_file}; run with --save-baseline to create one.")
+    if save_baseline:
+        baseline_file.write_text(json.dumps(dict(baseline, **results), indent=2, sort_keys=True) + "\n")
+        print(f"Baseline saved to {baseline_file}.")
+        return 0
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) regressed by more than {threshold:.0%}.")
+        return 1
+    return 0
+
+
+def main():
+    """
+    Run the benchmarks selected on the command line.
+    """
+    parser = argparse.ArgumentParser(description="Library Management System benchmarks")
+    parser.add_argument("benchmark", choices=["suite", "lookups", "memory", "durability", "concurrency", "startup",
+                                              "shards", "snapshots", "inventory", "copies", "overdue", "holds", "batch",
+                                              "fuzzy"])
+    parser.add_argument("--sizes", type=int, nargs="+")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--shards", type=int, nargs="+", help="Shard counts to compare")
+    parser.add_argument("--baseline", type=Path, default=Path("bench_baseline.json"))
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown, e.g. 0.25 for 25%%")
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+
+    sizes = args.sizes or [1000, 10000, 100000, 1000000]
+    if args.benchmark == "suite":
+        sys.exit(bench_suite(args.sizes or [1000, 10000, 100000], args.baseline, args.threshold,
+                             args.save_baseline))
+    elif args.benchmark == "lookups":
+        bench_lookups(sizes)
+    elif args.benchmark == "memory":
+        bench_memory(sizes)
+    elif args.benchmark == "durability":
+        bench_durability(sizes)
+    elif args.benchmark == "concurrency":
+        bench_concurrency(sizes, args.threads)
+    elif args.benchmark == "startup":
+        bench_startup(sizes)
+    elif args.benchmark == "snapshots":
+        bench_snapshots(args.sizes or [100000], args.threads)
+    elif args.benchmark == "shards":
+        bench_shards(args.sizes or [100000], args.shards or sorted({1, 2, 4, os.cpu_count()}))
+    elif args.benchmark == "inventory":
+        bench_inventory(sizes)
+    elif args.benchmark == "copies":
+        bench_copies(args.sizes or [100, 1000, 10000])
+    elif args.benchmark == "overdue":
+        bench_overdue(args.sizes or [10000, 100000, 1000000])
+    elif args.benchmark == "holds":
+        bench_holds(args.sizes or [10000, 100000])
+    elif args.benchmark == "batch":
+        bench_batch(args.sizes or [2000])
+    elif args.benchmark == "fuzzy":
+        bench_fuzzy(args.sizes or [100000, 1000000])
+
+
+if __name__ == "__main__":
+    main()
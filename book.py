@@ -1,11 +1,660 @@
+import functools
+import heapq
+import itertools
+import sys
+import weakref
+from collections import OrderedDict
+from fuzzy import MAX_DISTANCE, FuzzyIndex
+from metrics import METRICS
 from models import Book
+from paging import KeyOrder, paginate
+from snapshot import MappedBooks
+from versions import book_view
+
+
+class SearchIndex:
+    """
+    Inverted index of title and author n-grams for substring search.
+
+    Only n-grams of gram_size characters have postings. A shorter query is
+    a prefix of the n-grams that start where it occurs, so each prefix maps
+    to those n-grams in heads. Occurrences too close to the end of a value
+    to start an n-gram are found in tails, which maps the last characters
+    of each value to its ISBNs; there are few distinct endings to check.
+    """
+
+    FIELDS = ('title', 'author')
+
+    def __init__(self, gram_size=3):
+        """
+        Initialize the SearchIndex class.
+
+        Args:
+            gram_size (int, optional): Length of the indexed n-grams. Queries
+                shorter than this are answered from heads and tails. Defaults to 3.
+        """
+        self.gram_size = gram_size
+        self.postings = {field: {} for field in self.FIELDS}
+        self.heads = {field: {} for field in self.FIELDS}
+        self.tails = {field: {} for field in self.FIELDS}
+        self.normalized = {}
+
+    def grams(self, text):
+        """
+        Return the set of n-grams of a normalized string.
+
+        Args:
+            text (str): Lowercased text.
+
+        Returns:
+            set: All substrings of text that are gram_size characters long.
+        """
+        size = self.gram_size
+        return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+    def tail(self, text):
+        """
+        Return the end of a normalized string where no n-gram starts.
+
+        Args:
+            text (str): Lowercased text.
+
+        Returns:
+            str: The last gram_size - 1 characters of text, or all of a shorter text.
+        """
+        return text[max(len(text) - self.gram_size + 1, 0):]
+
+    def add(self, book):
+        """
+        Add a book to the index.
+
+        Args:
+            book (Book): The book to index.
+        """
+        values = (book.title.lower(), book.author.lower())
+        self.normalized[book.isbn] = values
+        for field, value in zip(self.FIELDS, values):
+            postings, heads, tails = self.postings[field], self.heads[field], self.tails[field]
+            grams = self.grams(value)
+            for gram in grams.difference(postings):
+                postings[gram] = set()
+                for size in range(1, self.gram_size):
+                    heads.setdefault(gram[:size], set()).add(gram)
+            for gram in grams:
+                postings[gram].add(book.isbn)
+            tails.setdefault(self.tail(value), set()).add(book.isbn)
+
+    def remove(self, book):
+        """
+        Remove a book from the index.
+
+        Args:
+            book (Book): The book to remove.
+        """
+        values = self.normalized.pop(book.isbn, None)
+        if values is None:
+            return
+        for field, value in zip(self.FIELDS, values):
+            postings, heads, tails = self.postings[field], self.heads[field], self.tails[field]
+            for gram in self.grams(value):
+                isbns = postings[gram]
+                isbns.discard(book.isbn)
+                if not isbns:
+                    del postings[gram]
+                    for size in range(1, self.gram_size):
+                        grams = heads[gram[:size]]
+                        grams.discard(gram)
+                        if not grams:
+                            del heads[gram[:size]]
+            tail = self.tail(value)
+            isbns = tails[tail]
+            isbns.discard(book.isbn)
+            if not isbns:
+                del tails[tail]
+
+    def candidates(self, field, query):
+        """
+        Return the ISBNs whose field contains the query as a substring.
+
+        Args:
+            field (str): 'title' or 'author'.
+            query (str): Lowercased query string.
+
+        Returns:
+            set: Matching ISBNs.
+        """
+        postings = self.postings[field]
+        if len(query) < self.gram_size:
+            tails = self.tails[field]
+            sets = [postings[gram] for gram in self.heads[field].get(query, ())]
+            sets += [tails[tail] for tail in tails if query in tail]
+            return set().union(*sets)
+        if len(query) == self.gram_size:
+            return postings.get(query, set())
+        gram_sets = []
+        for i in range(len(query) - self.gram_size + 1):
+            isbns = postings.get(query[i:i + self.gram_size])
+            if not isbns:
+                return set()
+            gram_sets.append(isbns)
+        gram_sets.sort(key=len)
+        position = self.FIELDS.index(field)
+        return {isbn for isbn in gram_sets[0].intersection(*gram_sets[1:])
+                if query in self.normalized[isbn][position]}
+
+    def score(self, isbn, title, author):
+        """
+        Rank a matching book: exact field matches first, then word prefixes.
+
+        Args:
+            isbn (str): ISBN of the matching book.
+            title (str): Lowercased title query, or None.
+            author (str): Lowercased author query, or None.
+
+        Returns:
+            int: Higher is a better match.
+        """
+        score = 0
+        for query, value in zip((title, author), self.normalized[isbn]):
+            if not query:
+                continue
+            if value == query:
+                score += 3
+            elif value.startswith(query) or f" {query}" in value:
+                score += 2
+            else:
+                score += 1
+        return score
+
+    def matches(self, title=None, author=None):
+        """
+        Return the ISBNs matching the title and author queries, unordered.
+
+        Args:
+            title (str, optional): Lowercased substring of the title. Defaults to None.
+            author (str, optional): Lowercased substring of the author. Defaults to None.
+
+        Returns:
+            set or dict: Matching ISBNs; every indexed ISBN when both queries are empty.
+        """
+        sets = [self.candidates(field, query)
+                for field, query in zip(self.FIELDS, (title, author)) if query]
+        if not sets:
+            return self.normalized
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
+
+    def search(self, title=None, author=None, limit=None, within=None):
+        """
+        Return the ISBNs matching the title and author queries, best first.
+
+        Ties are broken by title and then ISBN, so the order is stable.
+
+        Args:
+            title (str, optional): Substring of the title. Defaults to None.
+            author (str, optional): Substring of the author. Defaults to None.
+            limit (int, optional): Only rank the best `limit` matches. Defaults to None.
+            within (callable, optional): Narrows the set of matching ISBNs
+                before ranking, e.g. to the available books. Defaults to None.
+
+        Returns:
+            list: Matching ISBNs ordered by decreasing score.
+        """
+        title = title.lower() if title else None
+        author = author.lower() if author else None
+        matches = self.matches(title, author)
+        if within is not None:
+            matches = within(matches)
+
+        def rank(isbn):
+            return self.rank(isbn, title, author)
+
+        if limit is not None:
+            return heapq.nsmallest(limit, matches, key=rank)
+        return sorted(matches, key=rank)
+
+    def rank(self, isbn, title, author):
+        """
+        Return the sort key of a matching book: best score, then title, then ISBN.
+
+        Args:
+            isbn (str): ISBN of the matching book.
+            title (str): Lowercased title query, or None.
+            author (str): Lowercased author query, or None.
+
+        Returns:
+            tuple: Keys sort in result order.
+        """
+        return -self.score(isbn, title, author), self.normalized[isbn][0], isbn
+
+
+class SearchCache:
+    """
+    LRU cache of search results, bounded by entry count and approximate memory.
+
+    Results are lists of ISBNs keyed by the normalized query. An entry may
+    hold only the best results of a query, when it was computed for a page.
+    """
+
+    # Approximate bytes per cached ISBN: the list slot and the reverse index entry.
+    BYTES_PER_RESULT = 80
+    # Approximate bytes per entry besides its results.
+    ENTRY_BYTES = 400
+
+    def __init__(self, max_entries=1024, max_bytes=16 << 20):
+        """
+        Initialize the SearchCache class.
+
+        Args:
+            max_entries (int, optional): Maximum number of cached queries. Defaults to 1024.
+            max_bytes (int, optional): Approximate memory limit. Defaults to 16 MiB.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.by_isbn = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(title, author, isbn):
+        """
+        Normalize a query into a cache key.
+
+        Args:
+            title (str): Title query, or None.
+            author (str): Author query, or None.
+            isbn (str): ISBN query, or None.
+
+        Returns:
+            tuple: Lowercased title and author, and the ISBN; empty values become None.
+        """
+        return title.lower() if title else None, author.lower() if author else None, isbn or None
+
+    def get(self, key, stop=None):
+        """
+        Look up the results of a query.
+
+        Args:
+            key (tuple): Query key, see key().
+            stop (int, optional): Number of best results needed, or None for all.
+
+        Returns:
+            list: Cached ISBNs in result order, or None on a miss.
+        """
+        entry = self.entries.get(key)
+        if entry is not None and (entry[1] or (stop is not None and stop <= len(entry[0]))):
+            self.entries.move_to_end(key)
+            self.hits += 1
+            METRICS.increment('library_search_cache_total', (('result', 'hit'),))
+            return entry[0]
+        self.misses += 1
+        METRICS.increment('library_search_cache_total', (('result', 'miss'),))
+        return None
+
+    def put(self, key, isbns, complete):
+        """
+        Cache the results of a query, evicting the least recently used entries.
+
+        Args:
+            key (tuple): Query key, see key().
+            isbns (list): ISBNs in result order.
+            complete (bool): Whether isbns holds every result, not just the best ones.
+        """
+        size = self.ENTRY_BYTES + self.BYTES_PER_RESULT * len(isbns)
+        if size > self.max_bytes:
+            return
+        self.discard(key)
+        self.entries[key] = (isbns, complete, size)
+        self.bytes += size
+        for isbn in isbns:
+            self.by_isbn.setdefault(isbn, set()).add(key)
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            self.discard(next(iter(self.entries)))
+            self.evictions += 1
+
+    def discard(self, key):
+        """
+        Remove a query from the cache.
+
+        Args:
+            key (tuple): Query key, see key().
+        """
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.bytes -= entry[2]
+        for isbn in entry[0]:
+            keys = self.by_isbn[isbn]
+            keys.discard(key)
+            if not keys:
+                del self.by_isbn[isbn]
+
+    def invalidate_isbn(self, isbn):
+        """
+        Drop the cached queries whose results include a book.
+
+        Args:
+            isbn (str): ISBN of the book that changed.
+        """
+        for key in list(self.by_isbn.get(isbn, ())):
+            self.discard(key)
+
+    def invalidate_matches(self, book):
+        """
+        Drop the cached queries a book matches, i.e. whose results it may now be part of.
+
+        Args:
+            book (Book): The book that was added or changed.
+        """
+        title, author = book.title.lower(), book.author.lower()
+        stale = [key for key in self.entries
+                 if (not key[0] or key[0] in title) and (not key[1] or key[1] in author) and
+                    (not key[2] or key[2] == book.isbn)]
+        for key in stale:
+            self.discard(key)
+
+    def clear(self):
+        """
+        Drop every cached query.
+        """
+        self.entries.clear()
+        self.by_isbn.clear()
+        self.bytes = 0
+
+
+class CheckedOutBooks:
+    """
+    The books with no copy left on the shelf, in check-out order, and the catalog size.
+
+    Checked-out books are usually a small fraction of the catalog, so only
+    they are kept: listing them costs O(k) for k checked-out books, without
+    touching the rest of the catalog, and an availability filter starts
+    from the smaller of the two sides.
+    """
+
+    def __init__(self, total=0, books=()):
+        """
+        Initialize the CheckedOutBooks class.
+
+        Args:
+            total (int, optional): Number of books in the catalog. Defaults to 0.
+            books (iterable, optional): The checked-out books. Defaults to ().
+        """
+        self.books = {book.isbn: book for book in books}
+        self.total = total
+
+    def __len__(self):
+        """Return the number of books."""
+        return self.total
+
+    @property
+    def available(self):
+        """Number of available books."""
+        return self.total - len(self.books)
+
+    def add(self, book):
+        """
+        Count a new book.
+
+        Args:
+            book (Book): The book.
+        """
+        self.total += 1
+        if not book.available:
+            self.books[book.isbn] = book
+
+    def remove(self, isbn):
+        """
+        Stop counting a deleted book.
+
+        Args:
+            isbn (str): ISBN of the book.
+        """
+        self.total -= 1
+        self.books.pop(isbn, None)
+
+    def set(self, book, available):
+        """
+        Set the availability of a book.
+
+        Args:
+            book (Book): The book.
+            available (bool): Whether the book is now available.
+        """
+        if available:
+            self.books.pop(book.isbn, None)
+        else:
+            self.books[book.isbn] = book
+
+    def is_available(self, isbn):
+        """
+        Tell whether a book is available.
+
+        Args:
+            isbn (str): ISBN of the book.
+
+        Returns:
+            bool: False if the book is checked out.
+        """
+        return isbn not in self.books
+
+    def within(self, available, isbns):
+        """
+        Keep the books of one availability out of a set of ISBNs.
+
+        Checked-out books are found by walking the smaller of isbns and the
+        checked-out set; available ones by dropping the checked-out ones from isbns.
+
+        Args:
+            available (bool): Availability of the books to keep.
+            isbns (set): ISBNs of books in the catalog.
+
+        Returns:
+            list: The ISBNs kept.
+        """
+        checked_out = self.books
+        if available:
+            return list(itertools.filterfalse(checked_out.__contains__, isbns))
+        if len(checked_out) < len(isbns):
+            return [isbn for isbn in checked_out if isbn in isbns]
+        return list(filter(checked_out.__contains__, isbns))
+
+    def list_books(self, limit=None, offset=0, cursor=None):
+        """
+        List the checked-out books in check-out order.
+
+        Args:
+            limit (int, optional): Maximum number of books. Defaults to None (all).
+            offset (int, optional): Number of books to skip. Defaults to 0.
+            cursor (str, optional): ISBN of the last book of the previous page. Defaults to None.
+
+        Returns:
+            iterator: The books of the page.
+
+        Raises:
+            ValueError: If the cursor book is not checked out; see paging.paginate.
+        """
+        # A copy of the keys, so check-ins while the page is read do not break it.
+        return map(self.books.__getitem__, paginate(list(self.books), limit, offset, cursor))
+
 
 class BookManager:
-    def __init__(self):
+    def __init__(self, indexed=False, cache_size=0, cache_bytes=16 << 20):
         """
         Initialize the BookManager class.
+
+        Books are kept in a dict keyed by ISBN, in insertion order.
+
+        Args:
+            indexed (bool, optional): Maintain a SearchIndex for search_books.
+                It is built on the first search, so loading stays cheap.
+                Defaults to False.
+            cache_size (int, optional): Number of search results kept in a
+                SearchCache; 0 disables the cache. Defaults to 0.
+            cache_bytes (int, optional): Approximate memory limit of the cache.
+                Defaults to 16 MiB.
+
+        The FuzzyIndex of typo-tolerant searches is built on the first such
+        search, whether or not the manager is indexed.
+        """
+        self.books = {}
+        self.indexed = indexed
+        self.index = None
+        self.cache = SearchCache(cache_size, cache_bytes) if cache_size else None
+        self.observer = self.book_changed
+        self.readers = weakref.WeakSet()
+        self.shared = False
+        self.checked_out = None
+        self.fuzzy = None
+        self.order = None
+
+    def load(self, books):
+        """
+        Replace the book list with the given books.
+
+        Args:
+            books (iterable): Book objects to index, or a MappedBooks catalog,
+                which is used as is.
+
+        Raises:
+            ValueError: If two books share the same ISBN.
         """
-        self.books = []
+        self.index = None
+        self.shared = False
+        self.checked_out = None
+        self.fuzzy = None
+        self.order = None
+        if self.cache is not None:
+            self.cache.clear()
+        if isinstance(books, MappedBooks):
+            books.observer = self.observer
+            self.books = books
+            return
+        self.books = {}
+        for book in books:
+            self._insert(book)
+
+    def search_index(self):
+        """
+        Return the search index, building it on first use.
+
+        Returns:
+            SearchIndex: The index, or None if the manager is not indexed.
+        """
+        if self.index is None and self.indexed:
+            index = SearchIndex()
+            for book in self.books.values():
+                index.add(book)
+            self.index = index
+        return self.index
+
+    def fuzzy_index(self):
+        """
+        Return the index of title and author words, building it on first use.
+
+        Returns:
+            FuzzyIndex: The index.
+        """
+        if self.fuzzy is None:
+            fuzzy = FuzzyIndex(('title', 'author'))
+            for book in self.books.values():
+                fuzzy.add(book.isbn, (book.title, book.author))
+            self.fuzzy = fuzzy
+        return self.fuzzy
+
+    def key_order(self):
+        """
+        Return the catalog order of the ISBNs, building it on first use.
+
+        Returns:
+            KeyOrder: ISBNs in catalog order, for seeking list cursors.
+        """
+        if self.order is None:
+            self.order = KeyOrder(self.books)
+        return self.order
+
+    def availability(self):
+        """
+        Return the set of checked-out books, building it on first use.
+
+        Returns:
+            CheckedOutBooks: The checked-out books and the catalog size.
+        """
+        if self.checked_out is None:
+            self.checked_out = CheckedOutBooks(
+                len(self.books), (book for book in self.books.values() if not book.available))
+        return self.checked_out
+
+    def _insert(self, book):
+        """
+        Index a book by its ISBN.
+
+        Args:
+            book (Book): The book to index.
+
+        Raises:
+            ValueError: If a book with the same ISBN already exists.
+        """
+        if book.isbn in self.books:
+            raise ValueError(f"A book with ISBN '{book.isbn}' already exists.")
+        self._own()
+        self.books[book.isbn] = book
+        book.observer = self.observer
+        if self.index is not None:
+            self.index.add(book)
+        if self.fuzzy is not None:
+            self.fuzzy.add(book.isbn, (book.title, book.author))
+        if self.order is not None:
+            self.order.add(book.isbn)
+        if self.checked_out is not None:
+            self.checked_out.add(book)
+        if self.cache is not None:
+            self.cache.invalidate_matches(book)
+
+    def book_changed(self, book, available=None):
+        """
+        Observer of the books: called before a book changes in place.
+
+        Read snapshots still holding the book save its current fields, and
+        cached results containing it are dropped.
+
+        Args:
+            book (Book): The book about to change.
+            available (bool, optional): Its new availability, when that is
+                what changes. Defaults to None.
+        """
+        for view in self.readers:
+            view.keep(book.isbn, book)
+        if self.cache is not None:
+            self.cache.invalidate_isbn(book.isbn)
+        if available is not None and self.checked_out is not None:
+            self.checked_out.set(book, available)
+
+    def snapshot(self):
+        """
+        Take a read snapshot of the books, in constant time.
+
+        The container is shared with the snapshot until the next insertion or
+        deletion, which copies it first.
+
+        Returns:
+            FrozenView: BookRecords as of now, in catalog order.
+        """
+        self.shared = True
+        view = book_view(self.books)
+        self.readers.add(view)
+        return view
+
+    def _own(self):
+        """
+        Copy the book container if a read snapshot shares it.
+        """
+        if self.shared:
+            self.books = self.books.copy()
+            self.shared = False
 
     def add_book(self, title, author, isbn):
         """
@@ -15,9 +664,32 @@ class BookManager:
             title (str): The title of the book.
             author (str): The author of the book.
             isbn (str): The ISBN of the book.
+
+        Raises:
+            ValueError: If a book with the same ISBN already exists.
+        """
+        self._insert(Book(title, author, isbn))
+
+    def bulk_add_books(self, records):
         """
-        book = Book(title, author, isbn)
-        self.books.append(book)
+        Add many books at once.
+
+        All ISBNs are checked before any book is added, so either every book
+        is added or none is.
+
+        Args:
+            records (list): (title, author, isbn) tuples.
+
+        Raises:
+            ValueError: If an ISBN is repeated or already in the book list.
+        """
+        isbns = {isbn for _, _, isbn in records}
+        if len(isbns) != len(records) or any(isbn in self.books for isbn in isbns):
+            raise ValueError("Bulk add contains duplicate or existing ISBNs.")
+        if self.cache is not None:
+            self.cache.clear()
+        for title, author, isbn in records:
+            self._insert(Book(title, author, isbn))
 
     def update_book(self, isbn, title=None, author=None):
         """
@@ -30,16 +702,26 @@ class BookManager:
         """
         book = self.get_book_by_isbn(isbn)
         if book:
+            if title and not isinstance(title, str):
+                print("Title must be a string.")
+                return
+            if author and not isinstance(author, str):
+                print("Author must be a string.")
+                return
+            if self.index is not None:
+                self.index.remove(book)
+            self.book_changed(book)
             if title:
-                if not isinstance(title, str):
-                    print("Title must be a string.")
-                    return
                 book.title = title
             if author:
-                if not isinstance(author, str):
-                    print("Author must be a string.")
-                    return
-                book.author = author
+                book.author = sys.intern(author)
+            if self.index is not None:
+                self.index.add(book)
+            if self.fuzzy is not None:
+                self.fuzzy.remove(isbn)
+                self.fuzzy.add(isbn, (book.title, book.author))
+            if self.cache is not None:
+                self.cache.invalidate_matches(book)
 
     def delete_book(self, isbn):
         """
@@ -48,36 +730,229 @@ class BookManager:
         Args:
             isbn (str): The ISBN of the book to be deleted.
         """
-        book = self.get_book_by_isbn(isbn)
-        if book:
-            self.books.remove(book)
+        if isbn not in self.books:
+            return
+        self._own()
+        book = self.books.pop(isbn)
+        if self.index is not None:
+            self.index.remove(book)
+        if self.fuzzy is not None:
+            self.fuzzy.remove(isbn)
+        if self.order is not None:
+            self.order.remove(isbn)
+        if self.checked_out is not None:
+            self.checked_out.remove(isbn)
+        if self.cache is not None:
+            self.cache.invalidate_isbn(isbn)
+
+    def list_books(self, limit=None, offset=0, cursor=None):
+        """
+        Lazily list the books in catalog order.
+
+        A cursor is sought through key_order(), so every page costs the same
+        however deep into the catalog it is.
+
+        Args:
+            limit (int, optional): Maximum number of books. Defaults to None (all).
+            offset (int, optional): Number of books to skip. Defaults to 0.
+            cursor (str, optional): ISBN of the last book of the previous page. Defaults to None.
+
+        Returns:
+            iterator: The books of the page.
+
+        Raises:
+            ValueError: If the cursor book is not in the catalog.
+        """
+        isbns = self.books if cursor is None else self.key_order().after(cursor)
+        return map(self.books.__getitem__, paginate(isbns, limit, offset))
+
+    def search_books(self, title=None, author=None, isbn=None, limit=None, offset=0, cursor=None, available=None,
+                     fuzzy=0):
+        """
+        Lazily search for books based on title, author, ISBN and/or availability.
+
+        With a search index the results are ranked, exact and word-prefix
+        matches first; otherwise they are in catalog order. With no criteria
+        at all every book is returned in catalog order; with availability
+        alone, available books come in catalog order and checked-out books
+        in check-out order. Fuzzy searches are ranked as described in
+        fuzzy_matches.
+
+        Args:
+            title (str, optional): The title of the book to search for. Defaults to None.
+            author (str, optional): The author of the book to search for. Defaults to None.
+            isbn (str, optional): The ISBN of the book to search for. Defaults to None.
+            limit (int, optional): Maximum number of results. Defaults to None (all).
+            offset (int, optional): Number of results to skip. Defaults to 0.
+            cursor (str, optional): ISBN of the last result of the previous page. Defaults to None.
+            available (bool, optional): Only return books that are (True) or are
+                not (False) available. Defaults to None (either).
+            fuzzy (int, optional): Match every word of the title and author
+                with up to this many typos, instead of as substrings; see
+                fuzzy_matches. Defaults to 0 (substring search).
+
+        Returns:
+            iterator: The books that match the search criteria.
 
-    def list_books(self):
+        Raises:
+            ValueError: If the cursor is not among the results; see paging.paginate.
         """
-        List all the books in the book list.
+        if not (title or author or isbn):
+            if available is None:
+                return self.list_books(limit, offset, cursor)
+            if not available:
+                return self.availability().list_books(limit, offset, cursor)
+        stop = None if limit is None or cursor is not None else offset + limit
+        if fuzzy and (title or author):
+            # The cache only knows how to invalidate substring matches.
+            isbns = (key[-1] for key in self.fuzzy_matches(title, author, fuzzy, isbn, available, stop))
+        elif available is not None:
+            # Results depend on availability, which the cache does not track.
+            isbns = self._match_available(title, author, isbn, available, stop)
+        elif self.cache is None:
+            isbns = self._match(title, author, isbn, stop)
+        else:
+            key = SearchCache.key(title, author, isbn)
+            isbns = self.cache.get(key, stop)
+            if isbns is None:
+                isbns = list(itertools.islice(self._match(title, author, isbn, stop), stop))
+                self.cache.put(key, isbns, stop is None or len(isbns) < stop)
+        return map(self.books.__getitem__, paginate(isbns, limit, offset, cursor))
+
+    def _match(self, title, author, isbn, stop):
+        """
+        Find the ISBNs matching a query, in result order.
+
+        Args:
+            title (str): Title query, or None.
+            author (str): Author query, or None.
+            isbn (str): ISBN query, or None.
+            stop (int): Number of best results needed from the search index, or None for all.
+
+        Returns:
+            iterable: Matching ISBNs; lazy when there is no search index.
+        """
+        if self.indexed and not isbn:
+            return self.search_index().search(title, author, stop)
+        if isbn:
+            book = self.books.get(isbn)
+            candidates = [book] if book else []
+        else:
+            candidates = self.books.values()
+        title = title.lower() if title else None
+        author = author.lower() if author else None
+        return (book.isbn for book in candidates
+                if (not title or title in book.title.lower()) and
+                   (not author or author in book.author.lower()))
+
+    def _match_available(self, title, author, isbn, available, stop):
+        """
+        Find the ISBNs matching a query among the books of one availability.
+
+        Search index matches are filtered by availability before ranking, so
+        only the books kept are ranked.
+
+        Args:
+            title (str): Title query, or None.
+            author (str): Author query, or None.
+            isbn (str): ISBN query, or None.
+            available (bool): Availability of the books to keep.
+            stop (int): Number of best results needed from the search index, or None for all.
+
+        Returns:
+            iterable: Matching ISBNs, in result order.
         """
-        for book in self.books:
-            print(book)
+        checked_out = self.availability()
+        if not (title or author or isbn):
+            return itertools.filterfalse(checked_out.books.__contains__, self.books)
+        if self.indexed and not isbn:
+            return self.search_index().search(title, author, stop, functools.partial(checked_out.within, available))
+        return (key for key in self._match(title, author, isbn, None) if checked_out.is_available(key) == available)
 
-    def search_books(self, title=None, author=None, isbn=None):
+    def fuzzy_matches(self, title=None, author=None, max_distance=MAX_DISTANCE, isbn=None, available=None,
+                      stop=None):
         """
-        Search for books based on title, author, and/or ISBN.
+        Find the books whose title and author contain every query word, give or take a few typos.
+
+        Words are matched whole, within an edit distance that grows with
+        their length; see FuzzyIndex.similar. Results are ranked by the total
+        edit distance, then by title and ISBN.
+
+        Args:
+            title (str, optional): Words of the title. Defaults to None.
+            author (str, optional): Words of the author. Defaults to None.
+            max_distance (int, optional): Largest edit distance per word. Defaults to MAX_DISTANCE.
+            isbn (str, optional): Only this book. Defaults to None.
+            available (bool, optional): Only books that are (True) or are not
+                (False) available. Defaults to None (either).
+            stop (int, optional): Number of best results needed. Defaults to None (all).
+
+        Returns:
+            list: Sort keys (distance, lowercased title, ISBN) of the matches, best first.
+        """
+        matches = self._fuzzy_candidates(title, author, max_distance, isbn, available)
+        peek = getattr(self.books, 'peek', self.books.get)
+
+        def rank(key):
+            return matches[key], peek(key).title.lower(), key
+
+        if stop is not None:
+            return heapq.nsmallest(stop, map(rank, matches))
+        return sorted(map(rank, matches))
+
+    def _fuzzy_candidates(self, title, author, max_distance, isbn, available):
+        """
+        Find the books matching a fuzzy query, unordered.
+
+        Returns:
+            dict: Total edit distance of each matching ISBN.
+        """
+        matches = self.fuzzy_index().matches((title, author), max_distance)
+        if isbn:
+            matches = {isbn: matches[isbn]} if isbn in matches else {}
+        if available is not None:
+            matches = {key: matches[key] for key in self.availability().within(available, matches)}
+        return matches
+
+    def count_books(self, title=None, author=None, isbn=None, available=None, fuzzy=0):
+        """
+        Count the books matching the search criteria without building the results.
 
         Args:
             title (str, optional): The title of the book to search for. Defaults to None.
             author (str, optional): The author of the book to search for. Defaults to None.
             isbn (str, optional): The ISBN of the book to search for. Defaults to None.
+            available (bool, optional): Only count books that are (True) or are
+                not (False) available. Defaults to None (either).
+            fuzzy (int, optional): Largest edit distance per word, see
+                search_books. Defaults to 0 (substring search).
+
+        Returns:
+            int: The number of matching books.
+        """
+        if fuzzy and (title or author):
+            return len(self._fuzzy_candidates(title, author, fuzzy, isbn, available))
+        if available is not None:
+            if title or author or isbn:
+                return sum(1 for _ in self._match_available(title, author, isbn, available, None))
+            checked_out = self.availability()
+            return checked_out.available if available else len(checked_out) - checked_out.available
+        if not (title or author or isbn):
+            return len(self.books)
+        if self.indexed and not isbn:
+            return len(self.search_index().matches(title.lower() if title else None, author.lower() if author else None))
+        return sum(1 for _ in self.search_books(title, author, isbn))
+
+    def inventory(self):
+        """
+        Return the inventory totals, in constant time once availability() is built.
 
         Returns:
-            list: A list of books that match the search criteria.
+            dict: Numbers of 'books', 'available' and 'checked_out' books.
         """
-        results = []
-        for book in self.books:
-            if (not title or title.lower() in book.title.lower()) and \
-               (not author or author.lower() in book.author.lower()) and \
-               (not isbn or isbn == book.isbn):
-                results.append(book)
-        return results
+        checked_out = self.availability()
+        return {'books': len(checked_out), 'available': checked_out.available,
+                'checked_out': len(checked_out) - checked_out.available}
 
     def get_book_by_isbn(self, isbn):
         """
@@ -89,7 +964,4 @@ class BookManager:
         Returns:
             Book: The book object with the specified ISBN, or None if not found.
         """
-        for book in self.books:
-            if book.isbn == isbn:
-                return book
-        return None
+        return self.books.get(isbn)
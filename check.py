@@ -1,10 +1,97 @@
+import contextlib
+import functools
+import itertools
+import os
+import threading
+import time
 from datetime import datetime
+from pathlib import Path
 from book import BookManager
+from fuzzy import MAX_DISTANCE
+from holds import PICKUP_DAYS
+from ledger import DAY, LOAN_DAYS
+from metrics import METRICS
 from user import UserManager
-from storage import Storage
+from storage import BackgroundWriter, dump_json_array, is_newer, open_storage
+from versions import ReadSnapshot
+
+# Number of results printed before asking whether to show more.
+PAGE_SIZE = 20
+# Operations passed to write() around the operations of a batch() block.
+BEGIN_BATCH = 'begin_batch'
+END_BATCH = 'end_batch'
+
+
+def synchronized(method):
+    """
+    Run a LibraryManagementSystem method while holding the library lock.
+
+    Args:
+        method (callable): The method to wrap.
+
+    Returns:
+        callable: The wrapped method.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def validate_text(value, label):
+    """
+    Check a free-text field such as a title, author or name.
+
+    Args:
+        value (str): The value to check.
+        label (str): Name of the field, used in the error message.
+
+    Returns:
+        str: An error message, or None if the value is valid.
+    """
+    if not value:
+        return f"{label} cannot be empty."
+    if not isinstance(value, str):
+        return f"{label} must be a string."
+    return None
+
+
+def validate_id(value, label):
+    """
+    Check an identifier field such as an ISBN or user ID.
+
+    Args:
+        value (str): The value to check.
+        label (str): Name of the field, used in the error message.
+
+    Returns:
+        str: An error message, or None if the value is valid.
+    """
+    if not value:
+        return f"{label} cannot be empty."
+    if not isinstance(value, str) or not value.isalnum():
+        return f"{label} must contain only alphanumeric characters."
+    return None
+
+
+def format_time(seconds):
+    """
+    Format epoch seconds as a local date and time for the operator.
+
+    Args:
+        seconds (int): Epoch seconds.
+
+    Returns:
+        str: The date and time, to the minute.
+    """
+    return datetime.fromtimestamp(seconds).strftime("%Y-%m-%d %H:%M")
+
 
 class LibraryManagementSystem:
-    def __init__(self, books_file, users_file, checkouts_file):
+    def __init__(self, books_file, users_file, checkouts_file, journal_file=None, compact_every=10000,
+                 progress=None, backend='json', database=None, durability='batch', background_writer=False,
+                 snapshot_file=None, loan_days=LOAN_DAYS, holds_file=None, pickup_days=PICKUP_DAYS):
         """
         Initialize the LibraryManagementSystem class.
 
@@ -12,27 +99,393 @@ class LibraryManagementSystem:
             books_file (str): Path to the file containing book data.
             users_file (str): Path to the file containing user data.
             checkouts_file (str): Path to the file containing checkout data.
+            journal_file (str, optional): Path to the append-only journal. When set,
+                each operation is journaled instead of rewriting all files.
+            compact_every (int, optional): Number of journal records after which
+                the journal is folded into the data files. Defaults to 10000.
+            progress (callable, optional): Called as progress(name, done, total)
+                while the data files are loaded. Defaults to None.
+            backend (str, optional): Storage backend, 'json' or 'sqlite'. Defaults to 'json'.
+            database (str, optional): Path to the database of the sqlite backend.
+            durability (str, optional): 'none', 'batch' or 'always'; see
+                storage.DURABILITY_LEVELS. Defaults to 'batch'.
+            background_writer (bool, optional): Persist operations on a dedicated
+                writer thread instead of the calling thread. Defaults to False.
+            snapshot_file (str, optional): Path to a binary book snapshot, used
+                instead of books_file by the json backend; see Storage.
+            loan_days (int, optional): Loan period of new checkouts, in days.
+                Defaults to ledger.LOAN_DAYS.
+            holds_file (str, optional): Path to the file containing hold data
+                (json backend); see Storage.
+            pickup_days (int, optional): Days a returned book is kept for the
+                next holder. Defaults to holds.PICKUP_DAYS.
         """
-        self.storage = Storage(books_file, users_file, checkouts_file)
-        self.book_manager = BookManager()
+        self.storage = open_storage(backend, books_file, users_file, checkouts_file, journal_file, database,
+                                    durability, snapshot_file, holds_file)
+        self.compact_every = compact_every
+        self.loan_days = loan_days
+        self.pickup_days = pickup_days
+        self.unsaved = 0
+        self.batching = 0
+        self.batch_depth = 0
+        self._deferrals = []
+        self.progress = progress
+        self.book_manager = BookManager(indexed=True, cache_size=1024)
         self.user_manager = UserManager()
+        self.lock = threading.RLock()
+        self._local = threading.local()
+        self._timer = None
         self.load_data()
+        self.writer = BackgroundWriter(self.write, self.commit) if background_writer else None
 
+    def report(self, message):
+        """
+        Report a message to the operator.
+
+        Messages are printed, unless the calling thread is inside captured().
+
+        Args:
+            message (str): The message to report.
+        """
+        sink = getattr(self._local, 'sink', None)
+        if sink is None:
+            print(message)
+        else:
+            sink.append(str(message))
+
+    @contextlib.contextmanager
+    def captured(self):
+        """
+        Collect the messages reported by the calling thread instead of printing them.
+
+        Yields:
+            list: The reported messages, in order.
+        """
+        previous = getattr(self._local, 'sink', None)
+        self._local.sink = []
+        try:
+            yield self._local.sink
+        finally:
+            self._local.sink = previous
+
+    def show_pages(self, query, key, empty_message, page_size=PAGE_SIZE):
+        """
+        Print query results one page at a time, asking before each further page.
+
+        Args:
+            query (callable): Called with limit and cursor keyword arguments;
+                returns one page of results.
+            key (callable): Returns the cursor value (ISBN or user ID) of a result.
+            empty_message (str): Reported when there are no results at all.
+            page_size (int, optional): Results per page. Defaults to PAGE_SIZE.
+        """
+        cursor = None
+        while True:
+            try:
+                page = query(limit=page_size + 1, cursor=cursor)
+            except ValueError:
+                # Another desk deleted the last result shown.
+                self.report("The list changed since the last page; search again to continue.")
+                return
+            if not page and cursor is None:
+                self.report(empty_message)
+            for item in page[:page_size]:
+                self.report(item)
+            if len(page) <= page_size:
+                return
+            if input("Press Enter for more, or q to stop: ").strip().lower() == 'q':
+                return
+            cursor = key(page[page_size - 1])
+
+    @METRICS.timed('library_operation_seconds', 'load_data')
     def load_data(self):
         """
-        Load data from storage into book_manager, user_manager, and checkouts.
+        Load data from storage into book_manager, user_manager, checkouts and
+        holds, then replay the journal on top of it.
         """
-        self.book_manager.books = self.storage.load_books()
-        self.user_manager.users = self.storage.load_users()
-        self.checkouts = self.storage.load_checkouts()
+        self.book_manager.load(self.storage.load_books(self.progress))
+        self.user_manager.load(self.storage.load_users(self.book_manager.books, self.progress))
+        self.checkouts = self.storage.load_checkouts(self.progress)
+        self.holds = self.storage.load_holds(self.progress)
+        for record in self.storage.load_journal():
+            self.apply_record(record)
 
+    @METRICS.timed('library_operation_seconds', 'save_data')
+    @synchronized
     def save_data(self):
         """
-        Save data from book_manager, user_manager, and checkouts into storage.
+        Save data from book_manager, user_manager, checkouts and holds into storage.
         """
-        self.storage.save_books(self.book_manager.books)
-        self.storage.save_users(self.user_manager.users)
+        self.storage.save_books(self.book_manager.books.values())
+        self.storage.save_users(self.user_manager.users.values())
         self.storage.save_checkouts(self.checkouts)
+        self.storage.save_holds(self.holds)
+        self.storage.clear_journal()
+        self.unsaved = 0
+
+    @synchronized
+    def read_snapshot(self):
+        """
+        Take a consistent read snapshot of books, users and checkouts.
+
+        Taking it costs the same whatever the catalog size. It can then be read
+        without the library lock while operations continue; see versions.ReadSnapshot.
+
+        Returns:
+            ReadSnapshot: The snapshot.
+        """
+        return ReadSnapshot(self.book_manager.snapshot(), self.user_manager.snapshot(), self.checkouts.snapshot())
+
+    def export_books(self, path):
+        """
+        Export the catalog as a JSON array, in the format of the books file.
+
+        The export reads a snapshot, so it does not hold up other operations.
+
+        Args:
+            path (str): The file to write.
+        """
+        books = self.read_snapshot().books
+        with open(path, 'w') as f:
+            dump_json_array((book.to_dict() for book in books), f)
+
+    def compact(self):
+        """
+        Fold the journal into the data files and truncate it.
+
+        With a background writer the save is queued behind pending operations.
+        """
+        if self.writer:
+            self.writer.submit(None, None)
+        else:
+            self.save_data()
+
+    def close(self):
+        """
+        Save pending operations and flush the journal to disk.
+        """
+        timer = self._timer
+        if timer is not None:
+            timer.cancel()
+            timer.join()
+        if self.writer:
+            self.writer.stop()
+        if self.unsaved:
+            self.save_data()
+        self.storage.close()
+
+    def persist(self, op, **fields):
+        """
+        Persist a single operation.
+
+        Without a journal the data files are rewritten, with bursts of operations
+        coalesced according to the storage durability level; with a journal the
+        operation is appended and the files are only rewritten on compaction.
+
+        With a background writer the operation is queued and this returns
+        immediately; the writer thread applies operations in order.
+
+        Args:
+            op (str): Name of the operation.
+            **fields: Arguments needed to replay the operation.
+        """
+        if self.writer:
+            self.writer.submit(op, fields)
+        else:
+            self.write(op, fields)
+
+    def write(self, op, fields):
+        """
+        Write a single operation to storage.
+
+        Args:
+            op (str): Name of the operation, None to save all data files, or
+                BEGIN_BATCH or END_BATCH around the operations of a batch.
+            fields (dict): Arguments needed to replay the operation.
+        """
+        if op is None:
+            self.save_data()
+            return
+        if op == BEGIN_BATCH:
+            deferral = self.storage.deferred()
+            deferral.__enter__()
+            self._deferrals.append(deferral)
+            self.batching += 1
+            return
+        if op == END_BATCH:
+            self.batching -= 1
+            self._deferrals.pop().__exit__(None, None, None)
+            if not self.batching:
+                self.commit()
+            return
+        if not self.storage.journaled:
+            self.unsaved += 1
+            if not self.batching and self.storage.commit_due(self.unsaved):
+                self.save_data()
+        else:
+            self.storage.append(op, **fields)
+            if self.storage.journal_length >= self.compact_every:
+                self.save_data()
+        self._schedule_commit()
+
+    def _schedule_commit(self):
+        """
+        Commit pending operations after the storage sync interval, unless they are committed before.
+
+        A burst of operations is otherwise only committed when the next
+        operation finds a commit due, so the last ones of a burst would wait
+        for the next burst. With a background writer there is no timer: the
+        writer commits whenever its queue drains.
+        """
+        if self.writer or self._timer is not None or not (self.unsaved or self.storage.pending):
+            return
+        self._timer = threading.Timer(self.storage.sync_interval, self._commit_later)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _commit_later(self):
+        """
+        Commit pending operations when the timer set by _schedule_commit fires.
+        """
+        with self.lock:
+            self._timer = None
+            self.commit()
+
+    def commit(self):
+        """
+        Make every written operation durable, ending a group commit.
+
+        Inside batch() this waits for the end of the block.
+        """
+        if self.batching:
+            return
+        if self.storage.journaled:
+            self.storage.sync()
+        elif self.unsaved:
+            self.save_data()
+
+    def flush(self):
+        """
+        Wait until every operation has been handed to storage.
+        """
+        if self.writer:
+            self.writer.flush()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Commit the operations of the block together when it ends.
+
+        Operations are applied and written as usual, but the data files are
+        not saved and the journal is not synced until the block ends; the
+        sqlite backend applies them in one transaction. Other threads wait
+        for the block to end. Blocks can be nested; the outermost one commits.
+
+        The start and end of the block are persisted like operations, so a
+        background writer defers storage between them in queue order, and
+        the block never waits for the writer while holding the lock, which
+        the writer needs to save the data files.
+        """
+        with self.lock:
+            outermost = not self.batch_depth
+            self.batch_depth += 1
+            self.persist(BEGIN_BATCH)
+            try:
+                yield
+            finally:
+                self.persist(END_BATCH)
+                self.batch_depth -= 1
+        if outermost:
+            self.flush()
+
+    def apply_record(self, record):
+        """
+        Replay one journal record against the in-memory data.
+
+        Replay is idempotent, so a journal can be applied over data files that
+        already contain some of its operations, e.g. after a crash during
+        compaction.
+
+        Args:
+            record (dict): Journal record as written by persist().
+        """
+        fields = dict(record)
+        op = fields.pop('op')
+        if op == 'add_book':
+            if not self.book_manager.get_book_by_isbn(fields['isbn']):
+                self.book_manager.add_book(fields['title'], fields['author'], fields['isbn'])
+        elif op == 'update_book':
+            self.book_manager.update_book(fields['isbn'], fields.get('title'), fields.get('author'))
+        elif op == 'delete_book':
+            self._drop_loans(self.checkouts.holders_of(fields['isbn']))
+            self.book_manager.delete_book(fields['isbn'])
+            self.holds.cancel_isbn(fields['isbn'])
+        elif op == 'add_user':
+            if not self.user_manager.get_user_by_id(fields['user_id']):
+                self.user_manager.add_user(fields['name'], fields['user_id'])
+        elif op == 'update_user':
+            self.user_manager.update_user(fields['user_id'], fields.get('name'))
+        elif op == 'delete_user':
+            self._drop_loans(self.checkouts.loans_for_user(fields['user_id']))
+            self.user_manager.delete_user(fields['user_id'])
+            self.holds.cancel_user(fields['user_id'])
+        elif op == 'checkout':
+            user = self.user_manager.get_user_by_id(fields['user_id'])
+            book = self.book_manager.get_book_by_isbn(fields['isbn'])
+            if user and book:
+                user.checked_out_books.add(book)
+            if book:
+                book.check_out(fields.get('barcode'))
+            if not self.checkouts.get(fields['user_id'], fields['isbn']):
+                self.checkouts.add(fields)
+            self.holds.cancel(fields['user_id'], fields['isbn'])
+        elif op == 'checkin':
+            user = self.user_manager.get_user_by_id(fields['user_id'])
+            book = self.book_manager.get_book_by_isbn(fields['isbn'])
+            if user and book:
+                user.checked_out_books.discard(book)
+            if book:
+                book.check_in(fields.get('barcode'))
+            self.checkouts.close(fields['user_id'], fields['isbn'])
+        elif op == 'add_copies':
+            book = self.book_manager.get_book_by_isbn(fields['isbn'])
+            if book:
+                book.add_copies(fields['barcodes'])
+        elif op == 'place_hold':
+            if self.holds.get(fields['user_id'], fields['isbn']) is None:
+                self.holds.place(fields['user_id'], fields['isbn'], fields['placed'])
+        elif op == 'cancel_hold':
+            self.holds.cancel(fields['user_id'], fields['isbn'])
+        elif op == 'hold_ready':
+            book = self.book_manager.get_book_by_isbn(fields['isbn'])
+            if book:
+                book.check_out(fields.get('barcode'))
+            self.holds.make_ready(fields['user_id'], fields['isbn'], fields.get('barcode'), fields['expires'])
+        elif op == 'hold_release':
+            book = self.book_manager.get_book_by_isbn(fields['isbn'])
+            if book:
+                book.check_in(fields.get('barcode'))
+        else:
+            self.report(f"Unknown journal operation '{op}'.")
+
+    def _drop_loans(self, entries):
+        """
+        Close the loans of a book or user about to be deleted, returning the books to the shelf.
+
+        Deletion is refused while loans are open, but journals written by
+        older versions may delete a book or user with open loans.
+
+        Args:
+            entries (list): Checkout entries to close.
+        """
+        for entry in entries:
+            self.checkouts.close(entry['user_id'], entry['isbn'])
+            user = self.user_manager.get_user_by_id(entry['user_id'])
+            book = self.book_manager.get_book_by_isbn(entry['isbn'])
+            if user and book:
+                user.checked_out_books.discard(book)
+            if book:
+                book.check_in(entry.get('barcode'))
 
     # Book operations
     def add_book_flow(self):
@@ -40,28 +493,24 @@ class LibraryManagementSystem:
         Flow for adding a book.
         """
         title = input("Enter title: ")
-        if not title:
-            print("Title cannot be empty.")
-            return
-        if not isinstance(title, str):
-            print("Title must be a string.")
+        error = validate_text(title, "Title")
+        if error:
+            self.report(error)
             return
         author = input("Enter author: ")
-        if not author:
-            print("Author cannot be empty.")
-            return
-        if not isinstance(author, str):
-            print("Author must be a string.")
+        error = validate_text(author, "Author")
+        if error:
+            self.report(error)
             return
         isbn = input("Enter ISBN: ")
-        if not isbn:
-            print("ISBN cannot be empty.")
-            return
-        if not isbn.isalnum():
-            print("ISBN must contain only alphanumeric characters.")
+        error = validate_id(isbn, "ISBN")
+        if error:
+            self.report(error)
             return
         self.add_book(title, author, isbn)
 
+    @METRICS.timed('library_operation_seconds', 'add_book')
+    @synchronized
     def add_book(self, title, author, isbn):
         """
         Add a book to the book_manager.
@@ -70,18 +519,131 @@ class LibraryManagementSystem:
             title (str): Title of the book.
             author (str): Author of the book.
             isbn (str): ISBN of the book.
+
+        Returns:
+            bool: True if the book was added.
+        """
+        try:
+            self.book_manager.add_book(title, author, isbn)
+        except ValueError as e:
+            self.report(e)
+            return False
+        self.persist('add_book', title=title, author=author, isbn=isbn)
+        self.report("Book added.")
+        return True
+
+    @METRICS.timed('library_operation_seconds', 'bulk_add_books')
+    @synchronized
+    def bulk_add_books(self, records):
+        """
+        Add many books and save once.
+
+        Records are validated with the same rules as add_book_flow; invalid
+        records and ISBNs already in the catalog are reported and skipped.
+        Copies listed in a record are added on the shelf.
+
+        Args:
+            records (iterable): Dicts with 'title', 'author' and 'isbn' keys,
+                and optionally 'copies', a list of barcodes or, as read from a
+                CSV file, a string of barcodes separated by spaces.
+
+        Returns:
+            tuple: Number of books added, and a list of (record number, error message).
+        """
+        valid, errors, seen, copies = [], [], set(), []
+        for number, record in enumerate(records, 1):
+            title, author, isbn = record.get('title'), record.get('author'), record.get('isbn')
+            error = validate_text(title, "Title") or validate_text(author, "Author") or validate_id(isbn, "ISBN")
+            if not error and (isbn in seen or isbn in self.book_manager.books):
+                error = f"A book with ISBN '{isbn}' already exists."
+            barcodes = record.get('copies') or []
+            if isinstance(barcodes, str):
+                barcodes = barcodes.split()
+            if not error and not isinstance(barcodes, list):
+                error = "Copies must be a list of barcodes."
+            if not error:
+                error = next(filter(None, (validate_id(barcode, "Barcode") for barcode in barcodes)), None)
+            if error:
+                errors.append((number, error))
+                continue
+            seen.add(isbn)
+            valid.append((title, author, isbn))
+            if barcodes:
+                copies.append((isbn, barcodes))
+        if valid:
+            self.book_manager.bulk_add_books(valid)
+            for isbn, barcodes in copies:
+                self.book_manager.books[isbn].add_copies(barcodes)
+            self.compact()
+        return len(valid), errors
+
+    @METRICS.timed('library_operation_seconds', 'query_books')
+    @synchronized
+    def query_books(self, title=None, author=None, isbn=None, limit=None, offset=0, cursor=None,
+                    count_only=False, available=None, fuzzy=0):
+        """
+        Return one page of the books matching title, author, ISBN and/or availability, without printing.
+
+        With no criteria every book is returned in catalog order. Only the
+        requested page is built, under the library lock.
+
+        Args:
+            title (str, optional): Title of the book to search for.
+            author (str, optional): Author of the book to search for.
+            isbn (str, optional): ISBN of the book to search for.
+            limit (int, optional): Maximum number of books. Defaults to None (all).
+            offset (int, optional): Number of books to skip. Defaults to 0.
+            cursor (str, optional): ISBN of the last book of the previous page. Defaults to None.
+            count_only (bool, optional): Return the number of matches instead. Defaults to False.
+            available (bool, optional): Only books that are (True) or are not
+                (False) available. Defaults to None (either).
+            fuzzy (int, optional): Largest number of typos per word of the title
+                and author; see BookManager.search_books. Defaults to 0 (exact).
+
+        Returns:
+            list or int: The books of the page, or the number of matching books.
+
+        Raises:
+            ValueError: If the cursor is not among the results; see paging.paginate.
+        """
+        if count_only:
+            return self.book_manager.count_books(title, author, isbn, available, fuzzy)
+        return list(self.book_manager.search_books(title, author, isbn, limit, offset, cursor, available, fuzzy))
+
+    @synchronized
+    def inventory(self):
+        """
+        Return the inventory totals; see BookManager.inventory.
+
+        Returns:
+            dict: Numbers of 'books', 'available' and 'checked_out' books.
+        """
+        return self.book_manager.inventory()
+
+    def list_books(self, limit=None, offset=0, cursor=None):
+        """
+        Print one page of the books in catalog order.
+
+        Args:
+            limit (int, optional): Maximum number of books. Defaults to None (all).
+            offset (int, optional): Number of books to skip. Defaults to 0.
+            cursor (str, optional): ISBN of the last book of the previous page. Defaults to None.
+
+        Returns:
+            list: The books printed.
         """
-        self.book_manager.add_book(title, author, isbn)
-        self.save_data()
-        print("Book added.")
+        books = self.query_books(limit=limit, offset=offset, cursor=cursor)
+        if not books and offset == 0 and cursor is None:
+            self.report("No books.")
+        for book in books:
+            self.report(book)
+        return books
 
-    def list_books(self):
+    def list_books_flow(self):
         """
-        List all the books in the book_manager.
+        Flow for listing books one page at a time.
         """
-        if not self.book_manager.books:
-            print("No books.")
-        self.book_manager.list_books()
+        self.show_pages(self.query_books, lambda book: book.isbn, "No books.")
 
     def search_book_flow(self):
         """
@@ -90,23 +652,34 @@ class LibraryManagementSystem:
         title = input("Enter title: ")
         author = input("Enter author: ")
         isbn = input("Enter ISBN: ")
-        self.search_books(title, author, isbn)
-        results = self.search_books(title, author, isbn)
-        if not results:
-            print("No books found.")
+        availability = input("Availability (available/checked out/any): ").strip().lower()
+        available = {'available': True, 'checked out': False}.get(availability)
+        fuzzy = 0
+        if (title or author) and not self.query_books(title, author, isbn, count_only=True, available=available):
+            self.report("No exact matches; showing similar titles and authors.")
+            fuzzy = MAX_DISTANCE
+        self.show_pages(functools.partial(self.query_books, title, author, isbn, available=available, fuzzy=fuzzy),
+                        lambda book: book.isbn, "No books found.")
 
-    def search_books(self, title=None, author=None, isbn=None):
+    def search_books(self, title=None, author=None, isbn=None, limit=None, offset=0, cursor=None):
         """
-        Search books in the book_manager based on title, author, and/or ISBN.
+        Print one page of the books matching title, author and/or ISBN.
 
         Args:
             title (str, optional): Title of the book to search for.
             author (str, optional): Author of the book to search for.
             isbn (str, optional): ISBN of the book to search for.
+            limit (int, optional): Maximum number of books. Defaults to None (all).
+            offset (int, optional): Number of books to skip. Defaults to 0.
+            cursor (str, optional): ISBN of the last book of the previous page. Defaults to None.
+
+        Returns:
+            list: The books printed.
         """
-        results = self.book_manager.search_books(title, author, isbn)
-        for book in results:
-            print(book)
+        books = self.query_books(title, author, isbn, limit, offset, cursor)
+        for book in books:
+            self.report(book)
+        return books
 
     def update_book_flow(self):
         """
@@ -114,12 +687,14 @@ class LibraryManagementSystem:
         """
         isbn = input("Enter ISBN of the book to update: ")
         if not isbn:
-            print("ISBN cannot be empty.")
+            self.report("ISBN cannot be empty.")
             return
         title = input("Enter new title: ")
         author = input("Enter new author: ")
         self.update_book(isbn, title, author)
 
+    @METRICS.timed('library_operation_seconds', 'update_book')
+    @synchronized
     def update_book(self, isbn, title=None, author=None):
         """
         Update a book in the book_manager.
@@ -128,10 +703,14 @@ class LibraryManagementSystem:
             isbn (str): ISBN of the book to update.
             title (str, optional): New title of the book.
             author (str, optional): New author of the book.
+
+        Returns:
+            bool: True once the update has been applied.
         """
         self.book_manager.update_book(isbn, title, author)
-        self.save_data()
-        print("Book updated.")
+        self.persist('update_book', isbn=isbn, title=title, author=author)
+        self.report("Book updated.")
+        return True
 
     def delete_book_flow(self):
         """
@@ -140,16 +719,78 @@ class LibraryManagementSystem:
         isbn = input("Enter ISBN of the book to delete: ")
         self.delete_book(isbn)
 
+    @METRICS.timed('library_operation_seconds', 'delete_book')
+    @synchronized
     def delete_book(self, isbn):
         """
         Delete a book from the book_manager.
 
+        A book that is checked out cannot be deleted, so no loan refers to a
+        missing book.
+
         Args:
             isbn (str): ISBN of the book to delete.
+
+        Returns:
+            bool: True once the book has been deleted, False if it is checked out.
         """
+        loans = self.checkouts.holders_of(isbn)
+        if loans:
+            self.report(f"Book '{isbn}' is checked out by {len(loans)} user(s); check it in before deleting it.")
+            return False
         self.book_manager.delete_book(isbn)
-        self.save_data()
-        print("Book deleted.")
+        self.holds.cancel_isbn(isbn)
+        self.persist('delete_book', isbn=isbn)
+        self.report("Book deleted.")
+        return True
+
+    def add_copies_flow(self):
+        """
+        Flow for adding copies of a book.
+        """
+        isbn = input("Enter ISBN of the book: ")
+        error = validate_id(isbn, "ISBN")
+        if error:
+            self.report(error)
+            return
+        barcodes = input("Enter barcodes separated by spaces, or a number of copies: ").split()
+        if len(barcodes) == 1 and barcodes[0].isdigit():
+            book = self.book_manager.get_book_by_isbn(isbn)
+            start = book.total_copies + 1 if book else 1
+            barcodes = [f"{isbn}C{number}" for number in range(start, start + int(barcodes[0]))]
+        self.add_copies(isbn, barcodes)
+
+    @METRICS.timed('library_operation_seconds', 'add_copies')
+    @synchronized
+    def add_copies(self, isbn, barcodes):
+        """
+        Add copies of a book, identified by their barcodes.
+
+        Args:
+            isbn (str): ISBN of the book.
+            barcodes (list): Barcodes of the new copies; those already present are skipped.
+
+        Returns:
+            int: Number of copies added.
+        """
+        book = self.book_manager.get_book_by_isbn(isbn)
+        if not book:
+            self.report("Book not found.")
+            return 0
+        for barcode in barcodes:
+            error = validate_id(barcode, "Barcode")
+            if error:
+                self.report(error)
+                return 0
+        added = book.add_copies(barcodes)
+        if added:
+            self.persist('add_copies', isbn=isbn, barcodes=added)
+        now = int(time.time())
+        for barcode in added:
+            if not self._hand_off(book, barcode, now):
+                break
+        self.report(f"{len(added)} copies added; {book.available_copies} of {book.total_copies} available.")
+        return len(added)
 
     # User operations
     def add_user_flow(self):
@@ -157,21 +798,19 @@ class LibraryManagementSystem:
         Flow for adding a user.
         """
         name = input("Enter user name: ")
-        if not name:
-            print("Name cannot be empty.")
-            return
-        if not isinstance(name, str):
-            print("Name must be a string.")
+        error = validate_text(name, "Name")
+        if error:
+            self.report(error)
             return
         user_id = input("Enter user ID: ")
-        if not user_id:
-            print("User ID cannot be empty.")
-            return
-        if not user_id.isalnum():
-            print("User ID must contain only alphanumeric characters.")
+        error = validate_id(user_id, "User ID")
+        if error:
+            self.report(error)
             return
         self.add_user(name, user_id)
 
+    @METRICS.timed('library_operation_seconds', 'add_user')
+    @synchronized
     def add_user(self, name, user_id):
         """
         Add a user to the user_manager.
@@ -179,18 +818,103 @@ class LibraryManagementSystem:
         Args:
             name (str): Name of the user.
             user_id (str): ID of the user.
+
+        Returns:
+            bool: True if the user was added.
+        """
+        try:
+            self.user_manager.add_user(name, user_id)
+        except ValueError as e:
+            self.report(e)
+            return False
+        self.persist('add_user', name=name, user_id=user_id)
+        self.report("User added.")
+        return True
+
+    @METRICS.timed('library_operation_seconds', 'bulk_add_users')
+    @synchronized
+    def bulk_add_users(self, records):
+        """
+        Add many users and save once.
+
+        Records are validated with the same rules as add_user_flow; invalid
+        records and user IDs already registered are reported and skipped.
+
+        Args:
+            records (iterable): Dicts with 'name' and 'user_id' keys.
+
+        Returns:
+            tuple: Number of users added, and a list of (record number, error message).
+        """
+        valid, errors, seen = [], [], set()
+        for number, record in enumerate(records, 1):
+            name, user_id = record.get('name'), record.get('user_id')
+            error = validate_text(name, "Name") or validate_id(user_id, "User ID")
+            if not error and (user_id in seen or user_id in self.user_manager.users):
+                error = f"A user with ID '{user_id}' already exists."
+            if error:
+                errors.append((number, error))
+                continue
+            seen.add(user_id)
+            valid.append((name, user_id))
+        if valid:
+            self.user_manager.bulk_add_users(valid)
+            self.compact()
+        return len(valid), errors
+
+    @METRICS.timed('library_operation_seconds', 'query_users')
+    @synchronized
+    def query_users(self, name=None, user_id=None, limit=None, offset=0, cursor=None, count_only=False, fuzzy=0):
+        """
+        Return one page of the users matching name and/or user ID, without printing.
+
+        With no criteria every user is returned in registration order. Only
+        the requested page is built, under the library lock.
+
+        Args:
+            name (str, optional): Name of the user to search for.
+            user_id (str, optional): ID of the user to search for.
+            limit (int, optional): Maximum number of users. Defaults to None (all).
+            offset (int, optional): Number of users to skip. Defaults to 0.
+            cursor (str, optional): ID of the last user of the previous page. Defaults to None.
+            count_only (bool, optional): Return the number of matches instead. Defaults to False.
+            fuzzy (int, optional): Largest number of typos per word of the name;
+                see UserManager.search_users. Defaults to 0 (exact).
+
+        Returns:
+            list or int: The users of the page, or the number of matching users.
+
+        Raises:
+            ValueError: If the cursor is not among the results; see paging.paginate.
+        """
+        if count_only:
+            return self.user_manager.count_users(name, user_id, fuzzy)
+        return list(self.user_manager.search_users(name, user_id, limit, offset, cursor, fuzzy))
+
+    def list_users(self, limit=None, offset=0, cursor=None):
+        """
+        Print one page of the users in registration order.
+
+        Args:
+            limit (int, optional): Maximum number of users. Defaults to None (all).
+            offset (int, optional): Number of users to skip. Defaults to 0.
+            cursor (str, optional): ID of the last user of the previous page. Defaults to None.
+
+        Returns:
+            list: The users printed.
         """
-        self.user_manager.add_user(name, user_id)
-        self.save_data()
-        print("User added.")
+        users = self.query_users(limit=limit, offset=offset, cursor=cursor)
+        if not users and offset == 0 and cursor is None:
+            self.report("No users.")
+        for user in users:
+            self.report(user)
+        return users
 
-    def list_users(self):
+    def list_users_flow(self):
         """
-        List all the users in the user_manager.
+        Flow for listing users one page at a time.
         """
-        if not self.user_manager.users:
-            print("No users.")
-        self.user_manager.list_users()
+        self.show_pages(self.query_users, lambda user: user.user_id, "No users.")
 
     def search_user_flow(self):
         """
@@ -198,22 +922,31 @@ class LibraryManagementSystem:
         """
         name = input("Enter name: ")
         user_id = input("Enter user ID: ")
-        self.search_users(name, user_id)
-        results = self.search_users(name, user_id)
-        if not results:
-            print("No users found.")
+        fuzzy = 0
+        if name and not self.query_users(name, user_id, count_only=True):
+            self.report("No exact matches; showing similar names.")
+            fuzzy = MAX_DISTANCE
+        self.show_pages(functools.partial(self.query_users, name, user_id, fuzzy=fuzzy), lambda user: user.user_id,
+                        "No users found.")
 
-    def search_users(self, name=None, user_id=None):
+    def search_users(self, name=None, user_id=None, limit=None, offset=0, cursor=None):
         """
-        Search users in the user_manager based on name and/or user ID.
+        Print one page of the users matching name and/or user ID.
 
         Args:
             name (str, optional): Name of the user to search for.
             user_id (str, optional): ID of the user to search for.
+            limit (int, optional): Maximum number of users. Defaults to None (all).
+            offset (int, optional): Number of users to skip. Defaults to 0.
+            cursor (str, optional): ID of the last user of the previous page. Defaults to None.
+
+        Returns:
+            list: The users printed.
         """
-        results = self.user_manager.search_users(name, user_id)
-        for user in results:
-            print(user)
+        users = self.query_users(name, user_id, limit, offset, cursor)
+        for user in users:
+            self.report(user)
+        return users
 
     def update_user_flow(self):
         """
@@ -221,11 +954,13 @@ class LibraryManagementSystem:
         """
         user_id = input("Enter user ID of the user to update: ")
         if not user_id:
-            print("User ID cannot be empty.")
+            self.report("User ID cannot be empty.")
             return
         name = input("Enter new name: ")
         self.update_user(user_id, name)
 
+    @METRICS.timed('library_operation_seconds', 'update_user')
+    @synchronized
     def update_user(self, user_id, name=None):
         """
         Update a user in the user_manager.
@@ -233,10 +968,14 @@ class LibraryManagementSystem:
         Args:
             user_id (str): ID of the user to update.
             name (str, optional): New name of the user.
+
+        Returns:
+            bool: True once the update has been applied.
         """
         self.user_manager.update_user(user_id, name)
-        self.save_data()
-        print("User updated.")
+        self.persist('update_user', user_id=user_id, name=name)
+        self.report("User updated.")
+        return True
 
     def delete_user_flow(self):
         """
@@ -245,16 +984,34 @@ class LibraryManagementSystem:
         user_id = input("Enter user ID of the user to delete: ")
         self.delete_user(user_id)
 
+    @METRICS.timed('library_operation_seconds', 'delete_user')
+    @synchronized
     def delete_user(self, user_id):
         """
         Delete a user from the user_manager.
 
+        A user with books checked out cannot be deleted, so no loan refers to
+        a missing user.
+
         Args:
             user_id (str): ID of the user to delete.
+
+        Returns:
+            bool: True once the user has been deleted, False if they have books checked out.
         """
+        loans = self.checkouts.loans_for_user(user_id)
+        if loans:
+            self.report(f"User '{user_id}' has {len(loans)} book(s) checked out; "
+                        f"check them in before deleting the user.")
+            return False
         self.user_manager.delete_user(user_id)
-        self.save_data()
-        print("User deleted.")
+        self.persist('delete_user', user_id=user_id)
+        now = int(time.time())
+        for hold in self.holds.cancel_user(user_id):
+            if 'expires' in hold:
+                self._release(hold, now)
+        self.report("User deleted.")
+        return True
 
     # Checkout and check-in operations
     def checkout_book_flow(self):
@@ -262,21 +1019,19 @@ class LibraryManagementSystem:
         Flow for checking out a book.
         """
         user_id = input("Enter user ID: ")
-        if not user_id:
-            print("User ID cannot be empty.")
-            return
-        if not user_id.isalnum():
-            print("User ID must contain only alphanumeric characters.")
+        error = validate_id(user_id, "User ID")
+        if error:
+            self.report(error)
             return
         isbn = input("Enter ISBN of the book to checkout: ")
-        if not isbn:
-            print("ISBN cannot be empty.")
-            return
-        if not isbn.isalnum():
-            print("ISBN must contain only alphanumeric characters.")
+        error = validate_id(isbn, "ISBN")
+        if error:
+            self.report(error)
             return
         self.checkout_book(user_id, isbn)
 
+    @METRICS.timed('library_operation_seconds', 'checkout_book')
+    @synchronized
     def checkout_book(self, user_id, isbn):
         """
         Checkout a book for a user.
@@ -284,43 +1039,60 @@ class LibraryManagementSystem:
         Args:
             user_id (str): ID of the user.
             isbn (str): ISBN of the book.
+
+        Returns:
+            bool: True if the book was checked out.
         """
         user = self.user_manager.get_user_by_id(user_id)
         book = self.book_manager.get_book_by_isbn(isbn)
 
         if user and book:
-            user.check_out_book(book)
-            checkout_entry = {
-                'user_id': user_id,
-                'isbn': isbn,
-                'checkout_time': datetime.now().isoformat()
-            }
-            self.checkouts.append(checkout_entry)
-            self.save_data()
-            print(f"Book '{book.title}' checked out by '{user.name}'.")
+            if self.checkouts.get(user_id, isbn):
+                # Checked before anything changes, so a refusal leaves no trace.
+                self.report(f"Book '{book.title}' is already checked out by you.")
+                return False
+            now = int(time.time())
+            self._expire_holds(now)
+            hold = self.holds.get(user_id, isbn)
+            if hold is not None and 'expires' in hold:
+                # The copy set aside for the user is already off the shelf.
+                user.checked_out_books.add(book)
+                barcode = hold['barcode']
+            else:
+                try:
+                    barcode = user.check_out_book(book)
+                except ValueError as e:
+                    self.report(e)
+                    return False
+            self.holds.cancel(user_id, isbn)
+            checkout_entry = self.checkouts.open(user_id, isbn, now, barcode, now + self.loan_days * DAY)
+            self.persist('checkout', **checkout_entry)
+            copy = f" (copy {barcode})" if barcode else ""
+            self.report(f"Book '{book.title}'{copy} checked out by '{user.name}', "
+                        f"due {format_time(checkout_entry['due'])}.")
+            return True
         else:
-            print("Invalid user ID or book ISBN.")
+            self.report("Invalid user ID or book ISBN.")
+            return False
 
     def checkin_book_flow(self):
         """
         Flow for checking in a book.
         """
         user_id = input("Enter user ID: ")
-        if not user_id:
-            print("User ID cannot be empty.")
-            return
-        if not user_id.isalnum():
-            print("User ID must contain only alphanumeric characters.")
+        error = validate_id(user_id, "User ID")
+        if error:
+            self.report(error)
             return
         isbn = input("Enter ISBN of the book to check-in: ")
-        if not isbn:
-            print("ISBN cannot be empty.")
-            return
-        if not isbn.isalnum():
-            print("ISBN must contain only alphanumeric characters.")
+        error = validate_id(isbn, "ISBN")
+        if error:
+            self.report(error)
             return
         self.checkin_book(user_id, isbn)
 
+    @METRICS.timed('library_operation_seconds', 'checkin_book')
+    @synchronized
     def checkin_book(self, user_id, isbn):
         """
         Check in a book for a user.
@@ -328,19 +1100,300 @@ class LibraryManagementSystem:
         Args:
             user_id (str): ID of the user.
             isbn (str): ISBN of the book.
+
+        Returns:
+            bool: True if the book was checked in.
         """
         user = self.user_manager.get_user_by_id(user_id)
         book = self.book_manager.get_book_by_isbn(isbn)
 
         if user and book:
-            user.check_in_book(book)
-            for checkout in self.checkouts:
-                if checkout['user_id'] == user_id and checkout['isbn'] == isbn:
-                    self.checkouts.remove(checkout)
-                    break
-            self.save_data()
-            print(f"Book '{book.title}' checked in by '{user.name}'.")
+            now = int(time.time())
+            self._expire_holds(now)
+            entry = self.checkouts.get(user_id, isbn)
+            try:
+                barcode = user.check_in_book(book, entry.get('barcode') if entry else None)
+            except ValueError as e:
+                self.report(e)
+                return False
+            self.checkouts.close(user_id, isbn)
+            if barcode:
+                self.persist('checkin', user_id=user_id, isbn=isbn, barcode=barcode)
+            else:
+                self.persist('checkin', user_id=user_id, isbn=isbn)
+            self.report(f"Book '{book.title}' checked in by '{user.name}'.")
+            self._hand_off(book, barcode, now)
+            return True
         else:
-            print("Invalid user ID or book ISBN.")
+            self.report("Invalid user ID or book ISBN.")
+            return False
+
+    # Holds
+    def place_hold_flow(self):
+        """
+        Flow for placing a hold on a book.
+        """
+        user_id = input("Enter user ID: ")
+        error = validate_id(user_id, "User ID")
+        if error:
+            self.report(error)
+            return
+        isbn = input("Enter ISBN of the book to hold: ")
+        error = validate_id(isbn, "ISBN")
+        if error:
+            self.report(error)
+            return
+        self.place_hold(user_id, isbn)
+
+    @METRICS.timed('library_operation_seconds', 'place_hold')
+    @synchronized
+    def place_hold(self, user_id, isbn):
+        """
+        Place a hold on a book that is not available, at the end of its queue.
+
+        Args:
+            user_id (str): ID of the user.
+            isbn (str): ISBN of the book.
+
+        Returns:
+            bool: True if the hold was placed.
+        """
+        user = self.user_manager.get_user_by_id(user_id)
+        book = self.book_manager.get_book_by_isbn(isbn)
+        if not (user and book):
+            self.report("Invalid user ID or book ISBN.")
+            return False
+        now = int(time.time())
+        self._expire_holds(now)
+        if book in user.checked_out_books:
+            self.report(f"Book '{book.title}' is already checked out by you.")
+            return False
+        if book.available:
+            self.report(f"Book '{book.title}' is available; check it out instead.")
+            return False
+        try:
+            hold = self.holds.place(user_id, isbn, now)
+        except ValueError as e:
+            self.report(e)
+            return False
+        self.persist('place_hold', **hold)
+        self.report(f"Hold placed on '{book.title}' for '{user.name}', position {self.holds.waiting(isbn)}.")
+        return True
+
+    def cancel_hold_flow(self):
+        """
+        Flow for showing the holds of a user and cancelling one.
+        """
+        user_id = input("Enter user ID: ")
+        error = validate_id(user_id, "User ID")
+        if error:
+            self.report(error)
+            return
+        holds = self.holds_of(user_id)
+        if not holds:
+            self.report("No holds found.")
+            return
+        for hold in holds:
+            self.report(hold)
+        isbn = input("Enter ISBN of the hold to cancel: ")
+        error = validate_id(isbn, "ISBN")
+        if error:
+            self.report(error)
+            return
+        self.cancel_hold(user_id, isbn)
+
+    @synchronized
+    def holds_of(self, user_id):
+        """
+        Describe the holds of a user.
+
+        Args:
+            user_id (str): ID of the user.
+
+        Returns:
+            list: One line per hold, with its queue position or pickup deadline.
+        """
+        lines = []
+        for hold in self.holds.holds_of(user_id):
+            if 'expires' in hold:
+                status = f"ready until {format_time(hold['expires'])}"
+            else:
+                status = f"position {self.holds.position(user_id, hold['isbn'])}"
+            lines.append(f"{hold['isbn']}: {status}")
+        return sorted(lines)
+
+    @METRICS.timed('library_operation_seconds', 'cancel_hold')
+    @synchronized
+    def cancel_hold(self, user_id, isbn):
+        """
+        Cancel a hold, passing a copy set aside for it on to the next holder.
+
+        Args:
+            user_id (str): ID of the user.
+            isbn (str): ISBN of the book.
+
+        Returns:
+            bool: True if the hold was cancelled.
+        """
+        hold = self.holds.cancel(user_id, isbn)
+        if hold is None:
+            self.report("Hold not found.")
+            return False
+        self.persist('cancel_hold', user_id=user_id, isbn=isbn)
+        self.report("Hold cancelled.")
+        if 'expires' in hold:
+            self._release(hold, int(time.time()))
+        return True
+
+    @METRICS.timed('library_operation_seconds', 'expire_holds')
+    @synchronized
+    def expire_holds(self, now=None):
+        """
+        Cancel the holds not picked up in time, passing their copies on.
+
+        Checkouts, check-ins and new holds do this too, so it only needs to be
+        called to release copies while the library is otherwise idle.
+
+        Args:
+            now (int, optional): Epoch seconds. Defaults to the current time.
+
+        Returns:
+            int: Number of holds expired.
+        """
+        return self._expire_holds(int(time.time()) if now is None else now)
+
+    def _expire_holds(self, now):
+        """Expire the holds due by now; only their timers are looked at."""
+        expired = self.holds.expired(now)
+        for user_id, isbn in expired:
+            hold = self.holds.cancel(user_id, isbn)
+            self.persist('cancel_hold', user_id=user_id, isbn=isbn)
+            self.report(f"Hold of '{user_id}' on ISBN '{isbn}' expired.")
+            self._release(hold, now)
+        return len(expired)
+
+    def _hand_off(self, book, barcode, now):
+        """
+        Set a copy of a book aside for the first holder in its queue.
+
+        Args:
+            book (Book): The book.
+            barcode (str): Barcode of the copy, or None for a book without copies.
+            now (int): Epoch seconds.
+
+        Returns:
+            bool: True if somebody was waiting.
+        """
+        user_id = self.holds.first(book.isbn)
+        if user_id is None:
+            return False
+        expires = now + self.pickup_days * DAY
+        book.check_out(barcode)
+        self.holds.make_ready(user_id, book.isbn, barcode, expires)
+        self.persist('hold_ready', user_id=user_id, isbn=book.isbn, barcode=barcode, expires=expires)
+        self.report(f"Book '{book.title}' is held for '{user_id}' until {format_time(expires)}.")
+        return True
+
+    def _release(self, hold, now):
+        """Pass the copy of a removed ready hold on to the next holder, or back to the shelf."""
+        book = self.book_manager.get_book_by_isbn(hold['isbn'])
+        if book is None or self._hand_off(book, hold['barcode'], now):
+            return
+        book.check_in(hold['barcode'])
+        self.persist('hold_release', isbn=book.isbn, barcode=hold['barcode'])
+
+    def overdue_flow(self):
+        """
+        Flow for listing overdue loans and loans due in the next 24 hours.
+        """
+        for heading, loans in (("Overdue", self.overdue_loans()), ("Due in the next 24 hours", self.loans_due())):
+            self.report(f"{heading}: {len(loans)}")
+            for entry in loans:
+                self.report(f"  {entry['user_id']} {entry['isbn']} due {format_time(entry['due'])}")
+
+    @METRICS.timed('library_operation_seconds', 'overdue_loans')
+    @synchronized
+    def overdue_loans(self, now=None, limit=None, offset=0):
+        """
+        Return one page of the overdue loans, most overdue first.
+
+        Args:
+            now (int, optional): Epoch seconds. Defaults to the current time.
+            limit (int, optional): Maximum number of loans. Defaults to None (all).
+            offset (int, optional): Number of loans to skip. Defaults to 0.
+
+        Returns:
+            list: Checkout entries.
+        """
+        now = int(time.time()) if now is None else now
+        stop = None if limit is None else offset + limit
+        return list(itertools.islice(self.checkouts.overdue(now), offset, stop))
+
+    @METRICS.timed('library_operation_seconds', 'loans_due')
+    @synchronized
+    def loans_due(self, hours=24, now=None, limit=None, offset=0):
+        """
+        Return one page of the loans due soon, earliest first; overdue loans are not included.
+
+        Args:
+            hours (int, optional): Length of the period, from now. Defaults to 24.
+            now (int, optional): Epoch seconds. Defaults to the current time.
+            limit (int, optional): Maximum number of loans. Defaults to None (all).
+            offset (int, optional): Number of loans to skip. Defaults to 0.
+
+        Returns:
+            list: Checkout entries.
+        """
+        now = int(time.time()) if now is None else now
+        stop = None if limit is None else offset + limit
+        return list(itertools.islice(self.checkouts.due_between(now, now + hours * 3600), offset, stop))
+
+    # Metrics
+    def stats_flow(self):
+        """
+        Flow for showing operation and storage metrics.
+        """
+        export_format = input("Format (text/json): ").strip().lower()
+        inventory = self.inventory()
+        self.report(f"Books: {inventory['books']}, available: {inventory['available']}, "
+                    f"checked out: {inventory['checked_out']}")
+        if export_format == 'json':
+            self.report(METRICS.to_json())
+        else:
+            self.report(METRICS.to_prometheus())
+
+
+def open_library(**options):
+    """
+    Open the library of the current directory, as configured by the environment.
+
+    Every entry point opens the library through this function, so they all
+    use the same files. The storage backend is read from the LIBRARY_BACKEND
+    environment variable ('json' or 'sqlite'), the sqlite database path from
+    LIBRARY_DATABASE and the durability level ('none', 'batch' or 'always')
+    from LIBRARY_DURABILITY. Books are kept in the binary snapshot named by
+    LIBRARY_SNAPSHOT (default books.snapshot; empty to keep them in books.json).
+
+    Args:
+        **options: Further LibraryManagementSystem arguments, e.g. progress
+            or background_writer.
+
+    Returns:
+        LibraryManagementSystem: The library.
 
-     
\ No newline at end of file
+    Raises:
+        ValueError: If the snapshot is turned off but books.snapshot is newer
+            than books.json. Loading books.json would silently drop the books
+            added since, and the loans on them.
+    """
+    backend = os.environ.get("LIBRARY_BACKEND", "json")
+    snapshot_file = os.environ.get("LIBRARY_SNAPSHOT", "books.snapshot") or None
+    if backend == "json" and snapshot_file is None and is_newer(Path("books.snapshot"), Path("books.json")):
+        raise ValueError("books.snapshot is newer than books.json. Unset LIBRARY_SNAPSHOT to keep using it, "
+                         "or run 'python export_data.py books.json' with it first to go back to books.json.")
+    return LibraryManagementSystem("books.json", "users.json", "checkouts.json", journal_file="journal.jsonl",
+                                   holds_file="holds.json", backend=backend,
+                                   database=os.environ.get("LIBRARY_DATABASE", "library.db"),
+                                   snapshot_file=snapshot_file,
+                                   durability=os.environ.get("LIBRARY_DURABILITY", "batch"),
+                                   **options)
@@ -0,0 +1,20 @@
+import argparse
+from check import open_library
+
+
+def main():
+    """
+    Export the book catalog as a JSON array, the format of books.json.
+    """
+    parser = argparse.ArgumentParser(description="Export books from the Library Management System")
+    parser.add_argument("path", help="JSON file to write")
+    args = parser.parse_args()
+
+    library = open_library()
+    library.export_books(args.path)
+    library.close()
+    print(f"Exported {len(library.book_manager.books)} books to {args.path}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+import itertools
+import re
+from collections import Counter
+
+# Words are runs of letters and digits; punctuation separates them.
+WORD = re.compile(r"\w+")
+# Edits allowed per word by default; see FuzzyIndex.similar.
+MAX_DISTANCE = 2
+
+
+def words(text):
+    """
+    Split text into lowercased words.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        list: The words, in order.
+    """
+    return WORD.findall(text.lower())
+
+
+def edit_distance(a, b, limit):
+    """
+    Return the Levenshtein distance of two strings, giving up past a limit.
+
+    Only the band of the distance matrix within limit of its diagonal can
+    hold distances up to limit, so only that band is computed, a row at a
+    time, stopping as soon as every cell of a row exceeds the limit.
+
+    Args:
+        a (str): First string.
+        b (str): Second string.
+        limit (int): Largest distance of interest.
+
+    Returns:
+        int: The distance, or limit + 1 if it is greater than limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    beyond = limit + 1
+    previous = [min(j, beyond) for j in range(len(b) + 1)]
+    for i, char in enumerate(a, 1):
+        current = [beyond] * (len(b) + 1)
+        current[0] = best = min(i, beyond)
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            # Inline comparisons; min() costs a call per cell.
+            cost = previous[j - 1] + (char != b[j - 1])
+            if previous[j] < cost:
+                cost = previous[j] + 1
+            if current[j - 1] < cost:
+                cost = current[j - 1] + 1
+            current[j] = cost
+            if cost < best:
+                best = cost
+        if best > limit:
+            return beyond
+        previous = current
+    return min(previous[-1], beyond)
+
+
+class FuzzyIndex:
+    """
+    Index of the words of text fields, for search that tolerates typos.
+
+    Each field maps its words to the keys (ISBNs or user IDs) of the records
+    using them. The words themselves are indexed by their length and n-grams,
+    padded so that the first and last letters count as much as the others.
+    Words within an edit distance of a query word have a length within that
+    distance and share a minimum number of n-grams with it, so only the few
+    that do are compared letter by letter.
+    """
+
+    def __init__(self, fields, gram_size=3):
+        """
+        Initialize the FuzzyIndex class.
+
+        Args:
+            fields (tuple): Names of the indexed fields, e.g. ('title', 'author').
+            gram_size (int, optional): Length of the indexed n-grams. Defaults to 3.
+        """
+        self.fields = fields
+        self.gram_size = gram_size
+        self.postings = {field: {} for field in fields}
+        self.records = {}
+        self.vocabulary = {}
+        self.gram_words = {}
+        self.lengths = {}
+
+    def grams(self, word):
+        """
+        Return the set of padded n-grams of a word.
+
+        Args:
+            word (str): A lowercased word.
+
+        Returns:
+            set: The n-grams of the word with gram_size - 1 '$' on each side.
+        """
+        size = self.gram_size
+        padded = "$" * (size - 1) + word + "$" * (size - 1)
+        return {padded[i:i + size] for i in range(len(padded) - size + 1)}
+
+    def add(self, key, values):
+        """
+        Add a record to the index.
+
+        Args:
+            key (str): Key of the record.
+            values (tuple): Text of each field, in the order of fields.
+        """
+        record = tuple(words(value) for value in values)
+        self.records[key] = record
+        for field, field_words in zip(self.fields, record):
+            postings = self.postings[field]
+            for word in field_words:
+                keys = postings.get(word)
+                if keys is None:
+                    keys = postings[word] = set()
+                    self._add_word(word)
+                keys.add(key)
+
+    def remove(self, key):
+        """
+        Remove a record from the index.
+
+        Args:
+            key (str): Key of the record.
+        """
+        record = self.records.pop(key, None)
+        if record is None:
+            return
+        for field, field_words in zip(self.fields, record):
+            postings = self.postings[field]
+            for word in field_words:
+                keys = postings.get(word)
+                if keys is None:
+                    continue
+                keys.discard(key)
+                if not keys:
+                    del postings[word]
+                    self._remove_word(word)
+
+    def _add_word(self, word):
+        """Count a word new to a field, indexing its n-grams if no other field has it."""
+        fields = self.vocabulary.get(word, 0)
+        self.vocabulary[word] = fields + 1
+        if fields:
+            return
+        for gram in self.grams(word):
+            self.gram_words.setdefault((len(word), gram), set()).add(word)
+        self.lengths.setdefault(len(word), set()).add(word)
+
+    def _remove_word(self, word):
+        """Uncount a word gone from a field, dropping its n-grams if no field has it."""
+        fields = self.vocabulary[word] - 1
+        if fields:
+            self.vocabulary[word] = fields
+            return
+        del self.vocabulary[word]
+        for gram in self.grams(word):
+            words_of_gram = self.gram_words[(len(word), gram)]
+            words_of_gram.discard(word)
+            if not words_of_gram:
+                del self.gram_words[(len(word), gram)]
+        same_length = self.lengths[len(word)]
+        same_length.discard(word)
+        if not same_length:
+            del self.lengths[len(word)]
+
+    def similar(self, word, max_distance):
+        """
+        Find the indexed words close to a word.
+
+        The distance allowed grows with the length of the word, one edit
+        per three letters up to max_distance, so short words are not matched
+        by nearly every other short word.
+
+        Args:
+            word (str): A lowercased word.
+            max_distance (int): Largest edit distance allowed.
+
+        Returns:
+            dict: Distance of each indexed word within the allowed distance.
+        """
+        limit = min(max_distance, len(word) // 3)
+        if limit == 0:
+            return {word: 0} if word in self.vocabulary else {}
+        grams = self.grams(word)
+        # An edit changes at most gram_size n-grams of either word, so words
+        # within `limit` edits share all but gram_size * limit of the n-grams
+        # of each of them.
+        lost = self.gram_size * limit
+        threshold = len(grams) - lost
+        lengths = range(len(word) - limit, len(word) + limit + 1)
+        if threshold > 0:
+            gram_words = self.gram_words
+            counts = Counter(itertools.chain.from_iterable(
+                gram_words.get((length, gram), ()) for length in lengths for gram in grams))
+            candidates = [candidate for candidate, count in counts.items()
+                          if count >= threshold and (len(candidate) <= len(word) or
+                                                     count >= len(self.grams(candidate)) - lost)]
+        else:
+            candidates = itertools.chain.from_iterable(self.lengths.get(length, ()) for length in lengths)
+        similar = {}
+        for candidate in candidates:
+            distance = edit_distance(word, candidate, limit)
+            if distance <= limit:
+                similar[candidate] = distance
+        return similar
+
+    def matches(self, queries, max_distance=MAX_DISTANCE):
+        """
+        Find the records whose fields contain every word of the queries, give or take a few edits.
+
+        Args:
+            queries (tuple): Query text of each field, in the order of fields,
+                or None for fields not searched.
+            max_distance (int, optional): Largest edit distance allowed per
+                word; see similar(). Defaults to MAX_DISTANCE.
+
+        Returns:
+            dict: Total edit distance of each matching key, 0 for an exact match
+                of every word.
+        """
+        result = None
+        for field, query in zip(self.fields, queries):
+            if not query:
+                continue
+            postings = self.postings[field]
+            for word in words(query):
+                found = {}
+                # Closest words last, so a key used by several keeps its best distance.
+                for similar, distance in sorted(self.similar(word, max_distance).items(),
+                                                key=lambda item: item[1], reverse=True):
+                    keys = postings.get(similar)
+                    if keys:
+                        found.update(dict.fromkeys(keys, distance))
+                if result is None:
+                    result = found
+                    continue
+                small, large = (found, result) if len(found) < len(result) else (result, found)
+                result = {key: distance + large[key] for key, distance in small.items() if key in large}
+                if not result:
+                    return result
+        return result or {}
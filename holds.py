@@ -0,0 +1,266 @@
+import heapq
+from collections import OrderedDict
+
+# Days a returned book is kept for the next holder before the hold expires.
+PICKUP_DAYS = 3
+
+
+class HoldQueues:
+    """
+    FIFO hold queues per ISBN, and the holds whose book is ready for pickup.
+
+    A hold waits in the queue of its ISBN until a copy comes back. The copy
+    is then set aside for the first holder, whose hold becomes ready, until
+    it is picked up or the hold expires. Expiry times are kept in a heap, so
+    expired() only looks at the holds that are due.
+
+    Holds are dicts with 'user_id', 'isbn' and 'placed' keys; ready holds
+    also have 'barcode' (None for a book without copies) and 'expires'.
+    Times are epoch seconds.
+    """
+
+    def __init__(self, holds=()):
+        """
+        Initialize the HoldQueues class.
+
+        Args:
+            holds (iterable, optional): Holds in the order they were placed,
+                as produced by iterating over a HoldQueues. Defaults to ().
+        """
+        self.queues = {}
+        self.ready = {}
+        self.by_user = {}
+        self.timers = []
+        for hold in holds:
+            self.add(hold)
+
+    def __len__(self):
+        """Return the number of holds, waiting or ready."""
+        return len(self.ready) + sum(len(queue) for queue in self.queues.values())
+
+    def __iter__(self):
+        """Iterate over the ready holds, then the waiting holds of each ISBN in queue order."""
+        yield from self.ready.values()
+        for queue in self.queues.values():
+            yield from queue.values()
+
+    def add(self, hold):
+        """
+        Record a hold, at the end of its queue unless it is ready.
+
+        Args:
+            hold (dict): The hold.
+
+        Raises:
+            ValueError: If the user already has a hold on the ISBN.
+        """
+        user_id, isbn = hold['user_id'], hold['isbn']
+        if self.get(user_id, isbn) is not None:
+            raise ValueError(f"User '{user_id}' already has a hold on ISBN '{isbn}'.")
+        if hold.get('expires') is None:
+            self.queues.setdefault(isbn, OrderedDict())[user_id] = hold
+        else:
+            self.ready[(user_id, isbn)] = hold
+            heapq.heappush(self.timers, (hold['expires'], user_id, isbn))
+        self.by_user.setdefault(user_id, set()).add(isbn)
+
+    def place(self, user_id, isbn, placed):
+        """
+        Place a hold at the end of the queue of an ISBN.
+
+        Args:
+            user_id (str): ID of the user.
+            isbn (str): ISBN of the book.
+            placed (int): Epoch seconds.
+
+        Returns:
+            dict: The new hold.
+
+        Raises:
+            ValueError: If the user already has a hold on the ISBN.
+        """
+        hold = {'user_id': user_id, 'isbn': isbn, 'placed': placed}
+        self.add(hold)
+        return hold
+
+    def get(self, user_id, isbn):
+        """
+        Get the hold of a user on an ISBN.
+
+        Args:
+            user_id (str): ID of the user.
+            isbn (str): ISBN of the book.
+
+        Returns:
+            dict: The hold, waiting or ready, or None if there is none.
+        """
+        hold = self.ready.get((user_id, isbn))
+        if hold is None:
+            hold = self.queues.get(isbn, {}).get(user_id)
+        return hold
+
+    def position(self, user_id, isbn):
+        """
+        Return the position of a waiting hold in its queue.
+
+        This walks the queue, so it is meant for showing to the user.
+
+        Args:
+            user_id (str): ID of the user.
+            isbn (str): ISBN of the book.
+
+        Returns:
+            int: 1 for the first holder, or None if the user is not waiting.
+        """
+        for position, holder in enumerate(self.queues.get(isbn, ()), 1):
+            if holder == user_id:
+                return position
+        return None
+
+    def waiting(self, isbn):
+        """
+        Return the number of holds waiting for an ISBN.
+
+        Args:
+            isbn (str): ISBN of the book.
+
+        Returns:
+            int: Length of the queue.
+        """
+        return len(self.queues.get(isbn, ()))
+
+    def first(self, isbn):
+        """
+        Return the user first in the queue of an ISBN.
+
+        Args:
+            isbn (str): ISBN of the book.
+
+        Returns:
+            str: The user ID, or None if nobody is waiting.
+        """
+        queue = self.queues.get(isbn)
+        return next(iter(queue)) if queue else None
+
+    def make_ready(self, user_id, isbn, barcode, expires):
+        """
+        Set a copy aside for a waiting hold.
+
+        Args:
+            user_id (str): ID of the user, usually first(isbn).
+            isbn (str): ISBN of the book.
+            barcode (str): Barcode of the copy, or None for a book without copies.
+            expires (int): Epoch seconds until which the copy is kept.
+
+        Returns:
+            dict: The ready hold, or None if the user was not waiting.
+        """
+        queue = self.queues.get(isbn)
+        if not queue or user_id not in queue:
+            return None
+        hold = dict(queue.pop(user_id), barcode=barcode, expires=expires)
+        if not queue:
+            del self.queues[isbn]
+        self.ready[(user_id, isbn)] = hold
+        heapq.heappush(self.timers, (expires, user_id, isbn))
+        return hold
+
+    def cancel(self, user_id, isbn):
+        """
+        Remove the hold of a user on an ISBN, waiting or ready.
+
+        Args:
+            user_id (str): ID of the user.
+            isbn (str): ISBN of the book.
+
+        Returns:
+            dict: The removed hold, or None if there was none. A ready hold
+                still has its copy set aside, which the caller must release.
+        """
+        # The expiry timer of a ready hold is left in the heap and skipped by expired().
+        hold = self.ready.pop((user_id, isbn), None)
+        if hold is None:
+            queue = self.queues.get(isbn)
+            hold = queue.pop(user_id, None) if queue else None
+            if hold is None:
+                return None
+            if not queue:
+                del self.queues[isbn]
+        isbns = self.by_user[user_id]
+        isbns.discard(isbn)
+        if not isbns:
+            del self.by_user[user_id]
+        return hold
+
+    def cancel_user(self, user_id):
+        """
+        Remove every hold of a user, e.g. when the user is deleted.
+
+        Args:
+            user_id (str): ID of the user.
+
+        Returns:
+            list: The removed holds; see cancel().
+        """
+        return [self.cancel(user_id, isbn) for isbn in list(self.by_user.get(user_id, ()))]
+
+    def cancel_isbn(self, isbn):
+        """
+        Remove every hold on an ISBN, e.g. when the book is deleted.
+
+        Args:
+            isbn (str): ISBN of the book.
+
+        Returns:
+            list: The removed holds; see cancel().
+        """
+        holds = self.holders_of(isbn)
+        for hold in holds:
+            self.cancel(hold['user_id'], isbn)
+        return holds
+
+    def holds_of(self, user_id):
+        """
+        List the holds of a user.
+
+        Args:
+            user_id (str): ID of the user.
+
+        Returns:
+            list: The holds, waiting or ready.
+        """
+        return [self.get(user_id, isbn) for isbn in self.by_user.get(user_id, ())]
+
+    def holders_of(self, isbn):
+        """
+        List the holds on an ISBN.
+
+        Args:
+            isbn (str): ISBN of the book.
+
+        Returns:
+            list: The ready holds, then the waiting ones in queue order.
+        """
+        ready = [hold for (_, key), hold in self.ready.items() if key == isbn]
+        return ready + list(self.queues.get(isbn, {}).values())
+
+    def expired(self, now):
+        """
+        Find the ready holds whose pickup time is over.
+
+        Only the timers that are due are popped from the heap; the holds
+        are left in place for the caller to cancel.
+
+        Args:
+            now (int): Epoch seconds.
+
+        Returns:
+            list: (user_id, isbn) pairs, earliest expiry first.
+        """
+        timers, expired = self.timers, []
+        while timers and timers[0][0] <= now:
+            expires, user_id, isbn = heapq.heappop(timers)
+            hold = self.ready.get((user_id, isbn))
+            if hold is not None and hold['expires'] == expires:
+                expired.append((user_id, isbn))
+        return expired
@@ -0,0 +1,63 @@
+import argparse
+import csv
+import json
+import time
+from pathlib import Path
+from check import open_library
+
+
+def read_records(path, file_format=None):
+    """
+    Read import records from a CSV or JSON Lines file.
+
+    CSV files must have a header row naming the fields (title, author, isbn
+    and optionally copies, barcodes separated by spaces, for books; name,
+    user_id for users).
+
+    Args:
+        path (str): Path to the file.
+        file_format (str, optional): 'csv' or 'jsonl'. Guessed from the file
+            extension when None.
+
+    Yields:
+        dict: One record per row or line.
+    """
+    path = Path(path)
+    file_format = file_format or ('csv' if path.suffix.lower() == '.csv' else 'jsonl')
+    with path.open('r', newline='') as f:
+        if file_format == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def main():
+    """
+    Import books or users from a file in one batch and report the throughput.
+    """
+    parser = argparse.ArgumentParser(description="Bulk import into the Library Management System")
+    parser.add_argument("kind", choices=["books", "users"])
+    parser.add_argument("path", help="CSV or JSON Lines file to import")
+    parser.add_argument("--format", choices=["csv", "jsonl"], dest="file_format")
+    args = parser.parse_args()
+
+    library = open_library()
+    records = list(read_records(args.path, args.file_format))
+    start = time.perf_counter()
+    if args.kind == "books":
+        added, errors = library.bulk_add_books(records)
+    else:
+        added, errors = library.bulk_add_users(records)
+    elapsed = time.perf_counter() - start
+    library.close()
+
+    for number, error in errors:
+        print(f"Record {number}: {error}")
+    rate = len(records) / elapsed if elapsed else float('inf')
+    print(f"Imported {added} of {len(records)} {args.kind} in {elapsed:.2f}s ({rate:.0f} records/s).")
+
+
+if __name__ == "__main__":
+    main()
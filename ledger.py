@@ -0,0 +1,242 @@
+import bisect
+from datetime import datetime
+
+# Seconds in a day, the width of a due date bucket.
+DAY = 86400
+# Default loan period, in days.
+LOAN_DAYS = 14
+
+
+def timestamp(value):
+    """
+    Convert a time from a checkout entry to integer epoch seconds.
+
+    Args:
+        value (int or str): Epoch seconds, or an ISO timestamp as written by
+            older versions.
+
+    Returns:
+        int: Epoch seconds.
+    """
+    if isinstance(value, str):
+        return int(datetime.fromisoformat(value).timestamp())
+    return value
+
+
+class CheckoutLedger:
+    """
+    Active checkouts indexed by (user_id, isbn), by user, by ISBN and by due date.
+
+    The due date index is a calendar of day buckets: loans due on the same
+    day share a bucket, and the days that have loans are kept sorted. A
+    query over a time range only visits the buckets of the days in range,
+    so it never touches loans due outside it.
+    """
+
+    def __init__(self, entries=()):
+        """
+        Initialize the CheckoutLedger class.
+
+        Args:
+            entries (iterable, optional): Checkout dicts with 'user_id', 'isbn',
+                'checkout_time' and 'due' keys, and 'barcode' for a copy. Times
+                are epoch seconds. Defaults to ().
+        """
+        self.entries = {}
+        self.by_user = {}
+        self.by_isbn = {}
+        self.due_days = {}
+        self.days = []
+        self.shared = False
+        for entry in entries:
+            self.add(entry)
+
+    def __len__(self):
+        """Return the number of active checkouts."""
+        return len(self.entries)
+
+    def __iter__(self):
+        """Iterate over the checkout entries, oldest first."""
+        return iter(self.entries.values())
+
+    def add(self, entry):
+        """
+        Record a checkout entry.
+
+        Entries written by older versions, with an ISO checkout time and no
+        due date, are converted and given the default loan period.
+
+        Args:
+            entry (dict): Checkout dict with 'user_id', 'isbn', 'checkout_time'
+                and 'due' keys.
+
+        Raises:
+            ValueError: If the user already has this ISBN checked out.
+        """
+        user_id, isbn = entry['user_id'], entry['isbn']
+        if (user_id, isbn) in self.entries:
+            raise ValueError(f"User '{user_id}' already has ISBN '{isbn}' checked out.")
+        if 'due' not in entry:
+            checkout_time = timestamp(entry['checkout_time'])
+            entry = dict(entry, checkout_time=checkout_time, due=checkout_time + LOAN_DAYS * DAY)
+        self._own()
+        self.entries[(user_id, isbn)] = entry
+        self.by_user.setdefault(user_id, {})[isbn] = entry
+        self.by_isbn.setdefault(isbn, {})[user_id] = entry
+        day = entry['due'] // DAY
+        bucket = self.due_days.get(day)
+        if bucket is None:
+            bucket = self.due_days[day] = {}
+            bisect.insort(self.days, day)
+        bucket[(user_id, isbn)] = entry['due']
+
+    def open(self, user_id, isbn, checkout_time, barcode=None, due=None):
+        """
+        Open a checkout.
+
+        Args:
+            user_id (str): ID of the user.
+            isbn (str): ISBN of the book.
+            checkout_time (int): Epoch seconds of the checkout.
+            barcode (str, optional): Barcode of the copy, for a book with copies. Defaults to None.
+            due (int, optional): Epoch seconds the book is due back. Defaults to
+                LOAN_DAYS after the checkout.
+
+        Returns:
+            dict: The new checkout entry.
+        """
+        if due is None:
+            due = checkout_time + LOAN_DAYS * DAY
+        entry = {'user_id': user_id, 'isbn': isbn, 'checkout_time': checkout_time, 'due': due}
+        if barcode is not None:
+            entry['barcode'] = barcode
+        self.add(entry)
+        return entry
+
+    def close(self, user_id, isbn):
+        """
+        Close a checkout.
+
+        Args:
+            user_id (str): ID of the user.
+            isbn (str): ISBN of the book.
+
+        Returns:
+            dict: The closed checkout entry, or None if there was none.
+        """
+        if (user_id, isbn) not in self.entries:
+            return None
+        self._own()
+        entry = self.entries.pop((user_id, isbn))
+        loans = self.by_user[user_id]
+        del loans[isbn]
+        if not loans:
+            del self.by_user[user_id]
+        holders = self.by_isbn[isbn]
+        del holders[user_id]
+        if not holders:
+            del self.by_isbn[isbn]
+        day = entry['due'] // DAY
+        bucket = self.due_days[day]
+        del bucket[(user_id, isbn)]
+        if not bucket:
+            del self.due_days[day]
+            del self.days[bisect.bisect_left(self.days, day)]
+        return entry
+
+    def due_between(self, start, end):
+        """
+        Iterate over the loans due in a time range, earliest due first.
+
+        Only the day buckets overlapping the range are visited, and each is
+        sorted on the way, so k results out of n loans cost O(k log k) plus
+        a bisection of the sorted days.
+
+        Args:
+            start (int): Epoch seconds; loans due at or after it are included.
+                None for no lower bound.
+            end (int): Epoch seconds; loans due before it are included.
+
+        Yields:
+            dict: Checkout entries.
+        """
+        low = 0 if start is None else bisect.bisect_left(self.days, start // DAY)
+        high = bisect.bisect_right(self.days, (end - 1) // DAY)
+        for day in self.days[low:high]:
+            bucket = self.due_days.get(day, {})
+            for due, key in sorted((due, key) for key, due in bucket.items()):
+                if due >= end:
+                    return
+                entry = self.entries.get(key)
+                if entry is not None and (start is None or due >= start):
+                    yield entry
+
+    def overdue(self, now):
+        """
+        Iterate over the loans that are overdue, most overdue first.
+
+        Args:
+            now (int): Epoch seconds; loans due before it are overdue.
+
+        Returns:
+            iterator: Checkout entries, see due_between.
+        """
+        return self.due_between(None, now)
+
+    def snapshot(self):
+        """
+        Take a read snapshot of the entries, in constant time.
+
+        Entries are never changed in place; the dict is shared with the
+        snapshot until the next checkout or checkin, which copies it first.
+
+        Returns:
+            dict: Checkout entries keyed by (user_id, isbn).
+        """
+        self.shared = True
+        return self.entries
+
+    def _own(self):
+        """
+        Copy the entries if a read snapshot shares them.
+        """
+        if self.shared:
+            self.entries = dict(self.entries)
+            self.shared = False
+
+    def get(self, user_id, isbn):
+        """
+        Get the checkout of a book by a user.
+
+        Args:
+            user_id (str): ID of the user.
+            isbn (str): ISBN of the book.
+
+        Returns:
+            dict: The checkout entry, or None if not found.
+        """
+        return self.entries.get((user_id, isbn))
+
+    def loans_for_user(self, user_id):
+        """
+        Get all active checkouts of a user.
+
+        Args:
+            user_id (str): ID of the user.
+
+        Returns:
+            list: Checkout entries of the user.
+        """
+        return list(self.by_user.get(user_id, {}).values())
+
+    def holders_of(self, isbn):
+        """
+        Get all active checkouts of a book.
+
+        Args:
+            isbn (str): ISBN of the book.
+
+        Returns:
+            list: Checkout entries for the ISBN.
+        """
+        return list(self.by_isbn.get(isbn, {}).values())
@@ -1,18 +1,39 @@
-from check import LibraryManagementSystem
+import os
+from check import open_library
+from metrics import METRICS
 
 def main():
     """
     The main function that runs the Library Management System.
+
+    Storage is configured by environment variables, see check.open_library.
+    Setting LIBRARY_METRICS to 0 turns off metrics collection.
+    """
+    METRICS.enabled = os.environ.get("LIBRARY_METRICS", "1") != "0"
+    library = open_library(progress=show_progress)
+
+    try:
+        run_menu(library)
+    except (KeyboardInterrupt, EOFError):
+        # Ctrl-C or the end of input: save what is pending rather than lose it.
+        library.close()
+        print("\nExiting.")
+
+
+def run_menu(library):
     """
-    library = LibraryManagementSystem("books.json", "users.json", "checkouts.json")
+    Run menu choices until the user exits.
 
+    Args:
+        library (LibraryManagementSystem): The library.
+    """
     while True:
         choice = main_menu()
 
         if choice == '1':
             library.add_book_flow()
         elif choice == '2':
-            library.list_books()
+            library.list_books_flow()
         elif choice == '3':
             library.search_book_flow()
         elif choice == '4':
@@ -22,7 +43,7 @@ def main():
         elif choice == '6':
             library.add_user_flow()
         elif choice == '7':
-            library.list_users()
+            library.list_users_flow()
         elif choice == '8':
             library.search_user_flow()
         elif choice == '9':
@@ -34,12 +55,37 @@ def main():
         elif choice == '12':
             library.checkin_book_flow()
         elif choice == '13':
+            library.stats_flow()
+        elif choice == '14':
+            library.add_copies_flow()
+        elif choice == '15':
+            library.overdue_flow()
+        elif choice == '16':
+            library.place_hold_flow()
+        elif choice == '17':
+            library.cancel_hold_flow()
+        elif choice == '18':
+            library.close()
             print("Exiting.")
             break
         else:
             print("Invalid choice, please try again.")
 
 
+def show_progress(name, done, total):
+    """
+    Displays the loading progress of a data file.
+
+    Args:
+        name (str): Name of the file being loaded.
+        done (int): Number of characters read so far.
+        total (int): Size of the file.
+    """
+    percent = 100 * done // total if total else 100
+    end = "\n" if done >= total else ""
+    print(f"\rLoading {name}: {percent}%", end=end, flush=True)
+
+
 def main_menu():
     """
     Displays the main menu and returns the user's choice.
@@ -57,7 +103,12 @@ def main_menu():
     print("10. Delete User")
     print("11. Checkout Book")
     print("12. Check-in Book")
-    print("13. Exit")
+    print("13. Show Stats")
+    print("14. Add Copies")
+    print("15. Overdue Loans")
+    print("16. Place Hold")
+    print("17. Cancel Hold")
+    print("18. Exit")
     choice = input("Enter choice: ")
     return choice
 
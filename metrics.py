@@ -0,0 +1,174 @@
+import bisect
+import functools
+import json
+import threading
+import time
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+BUCKETS = (1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2, 5e-2, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+
+class Histogram:
+    """Latency histogram with fixed buckets."""
+
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        """
+        Initialize an empty Histogram.
+        """
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        """
+        Record one duration.
+
+        Args:
+            seconds (float): The duration to record.
+        """
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+
+class Metrics:
+    """Registry of counters and latency histograms."""
+
+    def __init__(self, enabled=True):
+        """
+        Initialize the Metrics class.
+
+        Args:
+            enabled (bool, optional): Whether measurements are recorded. Defaults to True.
+        """
+        self.enabled = enabled
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def increment(self, name, labels, value=1):
+        """
+        Add to a counter.
+
+        Args:
+            name (str): Metric name.
+            labels (tuple): Sorted (label, value) pairs.
+            value (int, optional): Amount to add. Defaults to 1.
+        """
+        if not self.enabled:
+            return
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, seconds):
+        """
+        Record a duration in a histogram.
+
+        Args:
+            name (str): Metric name.
+            labels (tuple): Sorted (label, value) pairs.
+            seconds (float): The duration to record.
+        """
+        key = (name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def timed(self, name, operation):
+        """
+        Decorate a function so that each call is timed into a histogram.
+
+        When metrics are disabled the wrapper only checks a flag.
+
+        Args:
+            name (str): Histogram name.
+            operation (str): Value of the 'operation' label.
+
+        Returns:
+            callable: The decorator.
+        """
+        labels = (('operation', operation),)
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(name, labels, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        """
+        Forget every recorded measurement.
+        """
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def to_dict(self):
+        """
+        Convert the recorded measurements to a dictionary.
+
+        Returns:
+            dict: Counters and histograms, keyed by metric name.
+        """
+        with self.lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self.counters.items())]
+            histograms = [{'name': name, 'labels': dict(labels), 'count': h.count, 'sum': h.total,
+                           'buckets': dict(zip([str(b) for b in BUCKETS] + ['+Inf'], h.counts))}
+                          for (name, labels), h in sorted(self.histograms.items())]
+        return {'counters': counters, 'histograms': histograms}
+
+    def to_json(self):
+        """
+        Dump the recorded measurements as JSON.
+
+        Returns:
+            str: JSON document, see to_dict.
+        """
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self):
+        """
+        Render the recorded measurements in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics snapshot.
+        """
+        def render(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}" if pairs else ""
+
+        lines = []
+        with self.lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{render(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip(list(BUCKETS) + ['+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{render(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{render(labels)} {histogram.total}")
+                lines.append(f"{name}_count{render(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
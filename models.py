@@ -1,7 +1,19 @@
+import sys
+
+
 class Book:
-    """Represents a book with title, author, ISBN, and availability."""
+    """
+    Represents a title with author, ISBN, and availability, and its copies.
+
+    A book has a single implicit copy until copies are added. It then holds
+    its copies by barcode, with a free list of the copies on the shelf, so
+    that taking or returning any copy costs the same whatever their number.
+    The single implicit copy becomes the copy whose barcode is the ISBN.
+    """
+
+    __slots__ = ('title', 'author', 'isbn', 'available', 'observer', 'copies', 'free')
 
-    def __init__(self, title, author, isbn, available=True):
+    def __init__(self, title, author, isbn, available=True, copies=None, checked_out_copies=()):
         """
         Initialize a Book object.
 
@@ -10,27 +22,186 @@ class Book:
             author (str): The author of the book.
             isbn (str): The ISBN of the book.
             available (bool): Indicates whether the book is available or not (default: True).
+                Ignored when copies are given.
+            copies (list, optional): Barcodes of the copies. Defaults to None (a single copy).
+            checked_out_copies (iterable, optional): Barcodes of the copies that are
+                checked out. Defaults to ().
+
+        The observer, if set, is called with the book and its new availability
+        just before a copy is checked out, checked in or added.
         """
         self.title = title
-        self.author = author
+        self.author = sys.intern(author)
         self.isbn = isbn
         self.available = available
+        self.observer = None
+        self.copies = None
+        self.free = None
+        if copies is not None:
+            checked_out_copies = set(checked_out_copies)
+            self.copies = {barcode: barcode not in checked_out_copies for barcode in copies}
+            self.free = [barcode for barcode, free in self.copies.items() if free]
+            self.available = bool(self.free)
 
     def __repr__(self):
         """Return a string representation of the Book object."""
-        return f"Book('{self.title}', '{self.author}', '{self.isbn}', available={self.available})"
+        if self.copies is None:
+            return f"Book('{self.title}', '{self.author}', '{self.isbn}', available={self.available})"
+        return (f"Book('{self.title}', '{self.author}', '{self.isbn}', available={self.available}, "
+                f"copies={len(self.free)}/{len(self.copies)})")
+
+    def __reduce__(self):
+        """Pickle the book without its observer."""
+        if self.copies is None:
+            return Book, (self.title, self.author, self.isbn, self.available)
+        return Book, (self.title, self.author, self.isbn, self.available, list(self.copies),
+                      self.checked_out_copies())
+
+    @property
+    def total_copies(self):
+        """int: Number of copies."""
+        return 1 if self.copies is None else len(self.copies)
+
+    @property
+    def available_copies(self):
+        """int: Number of copies on the shelf."""
+        return int(self.available) if self.copies is None else len(self.free)
+
+    def checked_out_copies(self):
+        """
+        List the barcodes of the copies that are checked out.
+
+        Returns:
+            list: The barcodes, empty for a book without copies.
+        """
+        if self.copies is None:
+            return []
+        return [barcode for barcode, free in self.copies.items() if not free]
+
+    def check_out(self, barcode=None):
+        """
+        Check out a copy of the book, notifying its observer first.
+
+        Without a barcode the copy last returned to the shelf is taken.
+        Checking out a copy that is already out does nothing, so journal
+        records can be replayed.
+
+        Args:
+            barcode (str, optional): Barcode of the copy. Defaults to None (any free copy).
+
+        Returns:
+            str: Barcode of the copy checked out, or None for a book without
+                copies or if nothing was checked out.
+        """
+        if self.copies is None:
+            if self.observer is not None:
+                self.observer(self, False)
+            self.available = False
+            return None
+        free = self.free
+        if barcode is None:
+            if not free:
+                return None
+            barcode = free[-1]
+        elif not self.copies.get(barcode):
+            return None
+        if self.observer is not None:
+            self.observer(self, len(free) > 1)
+        # Copies are usually taken from the end, e.g. when a journal is replayed.
+        if free[-1] == barcode:
+            free.pop()
+        else:
+            free.remove(barcode)
+        self.copies[barcode] = False
+        self.available = bool(free)
+        return barcode
+
+    def check_in(self, barcode=None):
+        """
+        Check in a copy of the book, notifying its observer first.
+
+        Checking in a copy that is already on the shelf does nothing.
+
+        Args:
+            barcode (str, optional): Barcode of the copy. Defaults to None (any
+                checked out copy, e.g. for a loan made before copies were added).
 
-    def check_out(self):
-        """Check out the book."""
-        self.available = False
+        Returns:
+            str: Barcode of the copy checked in, or None for a book without
+                copies or if nothing was checked in.
+        """
+        if self.copies is None:
+            if self.observer is not None:
+                self.observer(self, True)
+            self.available = True
+            return None
+        if barcode is None:
+            barcode = next((barcode for barcode, free in self.copies.items() if not free), None)
+        if barcode is None or self.copies.get(barcode) is not False:
+            return None
+        if self.observer is not None:
+            self.observer(self, True)
+        self.copies[barcode] = True
+        self.free.append(barcode)
+        self.available = True
+        return barcode
+
+    def add_copies(self, barcodes):
+        """
+        Add copies to the shelf, notifying the observer first.
+
+        The first copies added to a book without copies join its implicit
+        copy, whose barcode is the ISBN. Barcodes already present are skipped.
+
+        Args:
+            barcodes (iterable): Barcodes of the new copies.
 
-    def check_in(self):
-        """Check in the book."""
+        Returns:
+            list: Barcodes of the copies added.
+        """
+        barcodes = list(dict.fromkeys(barcodes))
+        if self.copies is not None:
+            barcodes = [barcode for barcode in barcodes if barcode not in self.copies]
+        if not barcodes:
+            return []
+        if self.observer is not None:
+            self.observer(self, True)
+        if self.copies is None:
+            self.copies = {self.isbn: self.available}
+            self.free = [self.isbn] if self.available else []
+            barcodes = [barcode for barcode in barcodes if barcode != self.isbn]
+        for barcode in barcodes:
+            self.copies[barcode] = True
+        self.free.extend(barcodes)
         self.available = True
+        return barcodes
+
+    def to_dict(self):
+        """
+        Convert the Book object to a dictionary.
+
+        Copies, if any, are stored as their barcodes and those checked out.
+
+        Returns:
+            dict: A dictionary representation of the Book object.
+        """
+        data = {
+            'title': self.title,
+            'author': self.author,
+            'isbn': self.isbn,
+            'available': self.available
+        }
+        if self.copies is not None:
+            data['copies'] = list(self.copies)
+            data['checked_out_copies'] = self.checked_out_copies()
+        return data
 
 
 class User: 
-    '''Represents a user with a name, user_id, and a list of checked out books.'''
+    '''Represents a user with a name, user_id, and a set of checked out books.'''
+
+    __slots__ = ('name', 'user_id', 'checked_out_books')
+
     def __init__(self, name, user_id):
         """
         Initialize a User object.
@@ -41,7 +212,7 @@ class User:
         """
         self.name = name
         self.user_id = user_id
-        self.checked_out_books = []
+        self.checked_out_books = set()
 
     def __repr__(self):
         """Return a string representation of the User object."""
@@ -51,27 +222,38 @@ class User:
         """
         Check out a book.
 
+        A user holds at most one copy of a book.
+
         Args:
             book (Book): The book to be checked out.
 
+        Returns:
+            str: Barcode of the copy checked out, or None for a book without copies.
+
         Raises:
             TypeError: If the book is not an instance of Book.
-            ValueError: If the book is not available.
+            ValueError: If the book is not available, or the user already has a copy.
         """
         if not isinstance(book, Book):
             raise TypeError("book must be an instance of Book")
+        if book in self.checked_out_books:
+            raise ValueError(f"Book '{book.title}' is already checked out by you.")
         if book.available:
-            self.checked_out_books.append(book)
-            book.check_out()
+            self.checked_out_books.add(book)
+            return book.check_out()
         else:
             raise ValueError(f"Book '{book.title}' is not available.")
 
-    def check_in_book(self, book):
+    def check_in_book(self, book, barcode=None):
         """
         Check in a book.
 
         Args:
             book (Book): The book to be checked in.
+            barcode (str, optional): Barcode of the copy, see Book.check_in. Defaults to None.
+
+        Returns:
+            str: Barcode of the copy checked in, or None for a book without copies.
 
         Raises:
             TypeError: If the book is not an instance of Book.
@@ -81,7 +263,7 @@ class User:
             raise TypeError("book must be an instance of Book")
         if book in self.checked_out_books:
             self.checked_out_books.remove(book)
-            book.check_in()
+            return book.check_in(barcode)
         else:
             raise ValueError(f"Book '{book.title}' is not checked out by you.")
 
@@ -89,11 +271,13 @@ class User:
         """
         Convert the User object to a dictionary.
 
+        Checked out books are stored as ISBN references to the catalog.
+
         Returns:
             dict: A dictionary representation of the User object.
         """
         return {
             'name': self.name,
             'user_id': self.user_id,
-            'checked_out_books': [vars(book) for book in self.checked_out_books]
+            'checked_out_books': [book.isbn for book in self.checked_out_books]
         }
@@ -0,0 +1,107 @@
+import itertools
+
+# Placeholder left in KeyOrder.keys by a removed key until the next compaction.
+_REMOVED = object()
+
+
+def paginate(keys, limit=None, offset=0, cursor=None):
+    """
+    Lazily select one page of an ordered sequence of keys.
+
+    Only the keys up to the end of the page are ever consumed, so the first
+    page of a million-entry catalog costs one page of work. A cursor is
+    found by scanning the keys; listings in insertion order should seek it
+    with KeyOrder.after instead.
+
+    Args:
+        keys (iterable): Keys (ISBNs or user IDs) in result order.
+        limit (int, optional): Maximum number of keys. Defaults to None (all).
+        offset (int, optional): Number of keys to skip. Defaults to 0.
+        cursor (str, optional): Last key of the previous page; the page starts
+            right after it. Defaults to None (start from the beginning).
+
+    Returns:
+        iterator: The keys of the page.
+
+    Raises:
+        ValueError: If cursor is not among the keys, e.g. because it has
+            been deleted since the previous page.
+    """
+    keys = iter(keys)
+    if cursor is not None:
+        keys = itertools.dropwhile(cursor.__ne__, keys)
+        if next(keys, None) is None:
+            raise ValueError(f"Unknown cursor '{cursor}'.")
+    stop = None if limit is None else offset + limit
+    return itertools.islice(keys, offset, stop)
+
+
+class KeyOrder:
+    """
+    Keys in insertion order, with the position of each, so a cursor resumes without a scan.
+
+    A removed key leaves a placeholder behind, and the list is compacted
+    once placeholders outnumber the keys, so removal is amortized O(1).
+    """
+
+    def __init__(self, keys=()):
+        """
+        Initialize the KeyOrder class.
+
+        Args:
+            keys (iterable, optional): Keys in insertion order. Defaults to ().
+        """
+        self.keys = []
+        self.positions = {}
+        self.removed = 0
+        for key in keys:
+            self.add(key)
+
+    def add(self, key):
+        """
+        Append a key.
+
+        Args:
+            key (str): The key.
+        """
+        self.positions[key] = len(self.keys)
+        self.keys.append(key)
+
+    def remove(self, key):
+        """
+        Remove a key, if present.
+
+        Args:
+            key (str): The key.
+        """
+        position = self.positions.pop(key, None)
+        if position is None:
+            return
+        self.keys[position] = _REMOVED
+        self.removed += 1
+        if self.removed > len(self.positions):
+            # A new list, so iterators from after() keep reading the old one.
+            self.keys = [key for key in self.keys if key is not _REMOVED]
+            self.positions = {key: position for position, key in enumerate(self.keys)}
+            self.removed = 0
+
+    def after(self, cursor):
+        """
+        Iterate over the keys following a cursor.
+
+        Args:
+            cursor (str): A key.
+
+        Returns:
+            iterator: The keys after the cursor, in insertion order.
+
+        Raises:
+            ValueError: If cursor is not a key, see paginate.
+        """
+        position = self.positions.get(cursor)
+        if position is None:
+            raise ValueError(f"Unknown cursor '{cursor}'.")
+        keys = self.keys
+        # Membership is checked in the current positions, as a compaction
+        # leaves this iterator on the old list, which later removals skip.
+        return (key for key in map(keys.__getitem__, range(position + 1, len(keys))) if key in self.positions)
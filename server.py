@@ -0,0 +1,299 @@
+import argparse
+import asyncio
+import json
+import random
+import resource
+import statistics
+import time
+import traceback
+from check import open_library, validate_id, validate_text
+
+
+def validate_count(value, label):
+    """
+    Check a count argument such as a page limit or offset.
+
+    Args:
+        value (int): The value to check.
+        label (str): Name of the argument, used in the error message.
+
+    Returns:
+        str: An error message, or None if the value is a non-negative integer.
+    """
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        return f"{label} must be a non-negative integer."
+    return None
+
+
+def validate_page(limit, offset, cursor, label):
+    """
+    Check the paging arguments of a listing or search.
+
+    Args:
+        limit (int): Maximum number of results, or None.
+        offset (int): Number of results to skip.
+        cursor (str): Key of the last result of the previous page, or None.
+        label (str): Name of the cursor key, used in the error message.
+
+    Returns:
+        str: An error message, or None if the arguments are valid.
+    """
+    return ((limit is not None and validate_count(limit, "Limit")) or validate_count(offset, "Offset") or
+            (cursor is not None and validate_id(cursor, label)) or None)
+
+
+class LibraryServer:
+    """Serves library operations as line-delimited JSON over TCP or a Unix socket."""
+
+    def __init__(self, library):
+        """
+        Initialize the LibraryServer class.
+
+        Args:
+            library (LibraryManagementSystem): The library to serve. It should use
+                a background writer so that persistence never runs on the caller.
+        """
+        self.library = library
+        self.handlers = {
+            'add_book': self.add_book,
+            'add_user': self.add_user,
+            'search_books': self.search_books,
+            'list_books': self.list_books,
+            'list_users': self.list_users,
+            'inventory': self.library.inventory,
+            'checkout_book': self.checkout_book,
+            'checkin_book': self.checkin_book,
+        }
+
+    def add_book(self, title, author, isbn):
+        """Validate and add a book; see LibraryManagementSystem.add_book."""
+        error = validate_text(title, "Title") or validate_text(author, "Author") or validate_id(isbn, "ISBN")
+        if error:
+            self.library.report(error)
+            return False
+        return self.library.add_book(title, author, isbn)
+
+    def add_user(self, name, user_id):
+        """Validate and add a user; see LibraryManagementSystem.add_user."""
+        error = validate_text(name, "Name") or validate_id(user_id, "User ID")
+        if error:
+            self.library.report(error)
+            return False
+        return self.library.add_user(name, user_id)
+
+    def search_books(self, title=None, author=None, isbn=None, limit=None, offset=0, cursor=None,
+                     count_only=False, available=None, fuzzy=0):
+        """Return one page of matching books as dicts, or their count; see LibraryManagementSystem.query_books."""
+        error = ((title and validate_text(title, "Title")) or (author and validate_text(author, "Author")) or
+                 (isbn and validate_id(isbn, "ISBN")) or validate_page(limit, offset, cursor, "Cursor") or
+                 validate_count(fuzzy, "Fuzzy"))
+        if available is not None and not isinstance(available, bool):
+            error = error or "Available must be true or false."
+        if error:
+            self.library.report(error)
+            return False
+        books = self.library.query_books(title, author, isbn, limit, offset, cursor, count_only, available, fuzzy)
+        return books if count_only else [book.to_dict() for book in books]
+
+    def list_books(self, limit=None, offset=0, cursor=None):
+        """Return one page of books as dicts."""
+        error = validate_page(limit, offset, cursor, "Cursor")
+        if error:
+            self.library.report(error)
+            return False
+        return [book.to_dict() for book in self.library.query_books(limit=limit, offset=offset, cursor=cursor)]
+
+    def list_users(self, limit=None, offset=0, cursor=None):
+        """Return one page of users as dicts."""
+        error = validate_page(limit, offset, cursor, "Cursor")
+        if error:
+            self.library.report(error)
+            return False
+        return [user.to_dict() for user in self.library.query_users(limit=limit, offset=offset, cursor=cursor)]
+
+    def checkout_book(self, user_id, isbn):
+        """Check out a book; see LibraryManagementSystem.checkout_book."""
+        return self.library.checkout_book(user_id, isbn)
+
+    def checkin_book(self, user_id, isbn):
+        """Check in a book; see LibraryManagementSystem.checkin_book."""
+        return self.library.checkin_book(user_id, isbn)
+
+    def execute(self, request):
+        """
+        Execute one request and build its response.
+
+        Args:
+            request (dict): Request with an 'op' key and the operation arguments.
+
+        Returns:
+            dict: Response with 'ok', 'result' and 'messages' keys, or 'ok' and 'error'.
+                Malformed requests and arguments get an error response rather
+                than an exception, so they never end the connection; any other
+                exception is printed and answered with a generic error.
+        """
+        if not isinstance(request, dict):
+            return {'ok': False, 'error': "Request must be a JSON object."}
+        fields = dict(request)
+        op = fields.pop('op', None)
+        handler = self.handlers.get(op) if isinstance(op, str) else None
+        if handler is None:
+            return {'ok': False, 'error': "Unknown operation."}
+        with self.library.captured() as messages:
+            try:
+                result = handler(**fields)
+            except (TypeError, ValueError) as e:
+                return {'ok': False, 'error': str(e)}
+            except Exception:
+                traceback.print_exc()
+                return {'ok': False, 'error': "Internal error."}
+        return {'ok': result is not False, 'result': result, 'messages': messages}
+
+    async def handle(self, reader, writer):
+        """
+        Serve one connection until the client closes it.
+
+        Operations run in the default executor, so waiting for the library lock
+        never blocks the event loop.
+
+        Args:
+            reader (asyncio.StreamReader): Connection reader.
+            writer (asyncio.StreamWriter): Connection writer.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    response = await loop.run_in_executor(None, self.execute, request)
+                except ValueError:
+                    # Invalid JSON, or a line that is not UTF-8 at all.
+                    response = {'ok': False, 'error': "Invalid request."}
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8765, unix_path=None):
+        """
+        Accept connections forever.
+
+        Args:
+            host (str, optional): TCP host. Defaults to '127.0.0.1'.
+            port (int, optional): TCP port. Defaults to 8765.
+            unix_path (str, optional): Listen on this Unix socket instead of TCP.
+        """
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle, unix_path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port, limit=1 << 20)
+        async with server:
+            await server.serve_forever()
+
+
+def raise_file_limit():
+    """
+    Raise the open file limit to the hard limit, to allow many connections.
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+async def run_client(host, port, unix_path, requests, latencies):
+    """
+    Send requests one after another on a single connection, recording latencies.
+
+    Args:
+        host (str): TCP host.
+        port (int): TCP port.
+        unix_path (str): Unix socket path, or None for TCP.
+        requests (int): Number of requests to send.
+        latencies (list): Receives the latency of each request in seconds.
+    """
+    if unix_path:
+        reader, writer = await asyncio.open_unix_connection(unix_path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    for _ in range(requests):
+        user_id = f"load{random.randrange(100)}"
+        isbn = f"load{random.randrange(1000)}"
+        request = random.choice([
+            {'op': 'search_books', 'title': f"Title {random.randrange(1000)}", 'limit': 10},
+            {'op': 'checkout_book', 'user_id': user_id, 'isbn': isbn},
+            {'op': 'checkin_book', 'user_id': user_id, 'isbn': isbn},
+        ])
+        start = time.perf_counter()
+        writer.write(json.dumps(request).encode() + b'\n')
+        await reader.readline()
+        latencies.append(time.perf_counter() - start)
+    writer.close()
+
+
+async def load_test(host, port, unix_path, connections, requests):
+    """
+    Open many concurrent connections and report request latency percentiles.
+
+    Test books and users are added first; adding them again on later runs is
+    harmless.
+
+    Args:
+        host (str): TCP host.
+        port (int): TCP port.
+        unix_path (str): Unix socket path, or None for TCP.
+        connections (int): Number of concurrent connections.
+        requests (int): Requests sent per connection.
+    """
+    raise_file_limit()
+    if unix_path:
+        reader, writer = await asyncio.open_unix_connection(unix_path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    setup = [{'op': 'add_user', 'name': f"Load {i}", 'user_id': f"load{i}"} for i in range(100)]
+    setup += [{'op': 'add_book', 'title': f"Title {i}", 'author': "Load", 'isbn': f"load{i}"} for i in range(1000)]
+    for request in setup:
+        writer.write(json.dumps(request).encode() + b'\n')
+        await reader.readline()
+    writer.close()
+
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(host, port, unix_path, requests, latencies) for _ in range(connections)))
+    elapsed = time.perf_counter() - start
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"{len(latencies)} requests over {connections} connections in {elapsed:.2f}s "
+          f"({len(latencies) / elapsed:.0f} req/s)")
+    print(f"p50 {quantiles[49] * 1000:.2f} ms, p99 {quantiles[98] * 1000:.2f} ms")
+
+
+def main():
+    """
+    Run the library server, or the load generator against a running server.
+    """
+    parser = argparse.ArgumentParser(description="Library Management System server")
+    parser.add_argument("mode", choices=["serve", "loadgen"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", dest="unix_path", help="Unix socket path to use instead of TCP")
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=20, help="Requests per connection")
+    args = parser.parse_args()
+
+    if args.mode == "loadgen":
+        asyncio.run(load_test(args.host, args.port, args.unix_path, args.connections, args.requests))
+        return
+
+    raise_file_limit()
+    library = open_library(background_writer=True)
+    try:
+        asyncio.run(LibraryServer(library).serve(args.host, args.port, args.unix_path))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        library.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+import contextlib
+import functools
+import heapq
+import itertools
+import multiprocessing
+import operator
+import os
+import threading
+import time
+import zlib
+from pathlib import Path
+from check import LibraryManagementSystem, validate_id
+
+
+def shard_of(isbn, shards):
+    """
+    Return the shard owning an ISBN.
+
+    Args:
+        isbn (str): The ISBN.
+        shards (int): Number of shards.
+
+    Returns:
+        int: Shard number, stable across runs and processes.
+    """
+    return zlib.crc32(isbn.encode()) % shards
+
+
+def ranked_search(library, title, author, stop, available=None, fuzzy=0):
+    """
+    Search one shard, returning results with their sort keys for merging.
+
+    Args:
+        library (LibraryManagementSystem): The shard's library.
+        title (str): Substring of the title, or None.
+        author (str): Substring of the author, or None.
+        stop (int): Number of best results to return, or None for all.
+        available (bool, optional): Only books of this availability. Defaults to None (either).
+        fuzzy (int, optional): Largest number of typos per word; see
+            BookManager.fuzzy_matches. Defaults to 0 (substring search).
+
+    Returns:
+        list: (sort key, Book) pairs, best first; see SearchIndex.rank and
+            BookManager.fuzzy_matches.
+    """
+    with library.lock:
+        manager = library.book_manager
+        if fuzzy and (title or author):
+            keys = manager.fuzzy_matches(title, author, fuzzy, None, available, stop)
+            return [(key, manager.books[key[-1]]) for key in keys]
+        index = manager.search_index()
+        within = None if available is None else functools.partial(manager.availability().within, available)
+        isbns = index.search(title, author, stop, within)
+        title = title.lower() if title else None
+        author = author.lower() if author else None
+        return [(index.rank(isbn, title, author), manager.books[isbn]) for isbn in isbns]
+
+
+def serve_shard(connection, directory, number, durability):
+    """
+    Run one shard: a LibraryManagementSystem over its own files, driven by a pipe.
+
+    Each request is a (method, args, kwargs) tuple, where method is a dotted
+    attribute path on the library or 'ranked_search'. The reply is a
+    (result, messages) tuple, or (exception, messages) if the call raised.
+    None stops the shard.
+
+    Args:
+        connection (multiprocessing.connection.Connection): Pipe to the coordinator.
+        directory (Path): Directory holding the data files of all shards.
+        number (int): Shard number, used in the file names.
+        durability (str): Storage durability level.
+    """
+    library = LibraryManagementSystem(directory / f"books-{number}.json", directory / f"users-{number}.json",
+                                      directory / f"checkouts-{number}.json",
+                                      journal_file=directory / f"journal-{number}.jsonl",
+                                      snapshot_file=directory / f"books-{number}.snapshot",
+                                      durability=durability)
+    while True:
+        request = connection.recv()
+        if request is None:
+            library.close()
+            connection.send((None, []))
+            return
+        method, args, kwargs = request
+        with library.captured() as messages:
+            try:
+                if method == 'ranked_search':
+                    result = ranked_search(library, *args, **kwargs)
+                else:
+                    result = operator.attrgetter(method)(library)(*args, **kwargs)
+            except Exception as e:
+                result = e
+        connection.send((result, messages))
+
+
+class ShardedLibrary:
+    """
+    Catalog partitioned by ISBN hash across worker processes.
+
+    Each shard is a LibraryManagementSystem in its own process, with its own
+    data files. Book operations go to the shard owning the ISBN, searches are
+    scattered to every shard and their ranked results merged. Users are
+    replicated to every shard, so a checkout only involves the book's shard.
+    """
+
+    def __init__(self, directory, shards=None, durability='batch'):
+        """
+        Start the shard processes.
+
+        Args:
+            directory (str): Directory for the data files of all shards.
+            shards (int, optional): Number of shards. Defaults to the number of CPUs.
+            durability (str, optional): Storage durability level of every shard.
+                Defaults to 'batch'.
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        self.shards = shards or os.cpu_count()
+        self.connections = []
+        self.locks = []
+        self.processes = []
+        for number in range(self.shards):
+            connection, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=serve_shard, args=(child, directory, number, durability),
+                                              daemon=True)
+            process.start()
+            child.close()
+            self.connections.append(connection)
+            self.locks.append(threading.Lock())
+            self.processes.append(process)
+
+    def report(self, message):
+        """
+        Show a message from a shard to the operator.
+
+        Args:
+            message (str): The message.
+        """
+        print(message)
+
+    def _receive(self, number, reported):
+        """
+        Receive a reply from a shard and report its messages.
+
+        Args:
+            number (int): Shard number.
+            reported (set): Messages already reported by other shards for the
+                same request, which are not repeated.
+
+        Returns:
+            The result of the call, or the exception it raised.
+        """
+        result, messages = self.connections[number].recv()
+        for message in messages:
+            if str(message) not in reported:
+                reported.add(str(message))
+                self.report(message)
+        return result
+
+    def call(self, number, method, *args, **kwargs):
+        """
+        Call a library method on one shard.
+
+        Args:
+            number (int): Shard number.
+            method (str): Dotted attribute path on LibraryManagementSystem.
+            *args: Positional arguments of the method.
+            **kwargs: Keyword arguments of the method.
+
+        Returns:
+            The method's return value.
+
+        Raises:
+            Exception: The exception raised by the method on the shard.
+        """
+        with self.locks[number]:
+            self.connections[number].send((method, args, kwargs))
+            result = self._receive(number, set())
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    @contextlib.contextmanager
+    def holding(self, numbers):
+        """
+        Hold the locks of several shards, so no other request reaches them meanwhile.
+
+        Locks are taken in shard order, so concurrent holders cannot deadlock.
+
+        Args:
+            numbers (iterable): Shard numbers.
+        """
+        numbers = sorted(numbers)
+        for number in numbers:
+            self.locks[number].acquire()
+        try:
+            yield
+        finally:
+            for number in numbers:
+                self.locks[number].release()
+
+    def _exchange(self, requests):
+        """
+        Send requests to shards whose locks are held and wait for all replies.
+
+        A message reported by several shards, e.g. "User added.", is shown once.
+
+        Args:
+            requests (dict): (method, args, kwargs) tuples keyed by shard number.
+
+        Returns:
+            dict: Results keyed by shard number.
+
+        Raises:
+            Exception: The first exception raised on a shard, once every
+                shard has replied.
+        """
+        numbers = sorted(requests)
+        for number in numbers:
+            self.connections[number].send(requests[number])
+        reported = set()
+        results = {number: self._receive(number, reported) for number in numbers}
+        for result in results.values():
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+    def scatter(self, requests):
+        """
+        Send requests to several shards at once and wait for all replies.
+
+        Args:
+            requests (dict): (method, args, kwargs) tuples keyed by shard number.
+
+        Returns:
+            dict: Results keyed by shard number.
+
+        Raises:
+            Exception: The first exception raised on a shard, once every
+                shard has replied.
+        """
+        with self.holding(requests):
+            return self._exchange(requests)
+
+    def broadcast(self, method, *args, **kwargs):
+        """
+        Call a library method on every shard.
+
+        Args:
+            method (str): Dotted attribute path on LibraryManagementSystem.
+            *args: Positional arguments of the method.
+            **kwargs: Keyword arguments of the method.
+
+        Returns:
+            list: The return values, in shard order.
+        """
+        results = self.scatter({number: (method, args, kwargs) for number in range(self.shards)})
+        return [results[number] for number in range(self.shards)]
+
+    def owner(self, isbn):
+        """
+        Return the shard number owning an ISBN.
+
+        Args:
+            isbn (str): The ISBN.
+
+        Returns:
+            int: Shard number.
+        """
+        return shard_of(isbn, self.shards)
+
+    def get_book_by_isbn(self, isbn):
+        """See BookManager.get_book_by_isbn."""
+        return self.call(self.owner(isbn), 'book_manager.get_book_by_isbn', isbn)
+
+    def add_book(self, title, author, isbn):
+        """See LibraryManagementSystem.add_book."""
+        return self.call(self.owner(isbn), 'add_book', title, author, isbn)
+
+    def update_book(self, isbn, title=None, author=None):
+        """See LibraryManagementSystem.update_book."""
+        return self.call(self.owner(isbn), 'update_book', isbn, title, author)
+
+    def delete_book(self, isbn):
+        """See LibraryManagementSystem.delete_book."""
+        return self.call(self.owner(isbn), 'delete_book', isbn)
+
+    def add_copies(self, isbn, barcodes):
+        """See LibraryManagementSystem.add_copies."""
+        return self.call(self.owner(isbn), 'add_copies', isbn, barcodes)
+
+    def checkout_book(self, user_id, isbn):
+        """See LibraryManagementSystem.checkout_book."""
+        return self.call(self.owner(isbn), 'checkout_book', user_id, isbn)
+
+    def checkin_book(self, user_id, isbn):
+        """See LibraryManagementSystem.checkin_book."""
+        return self.call(self.owner(isbn), 'checkin_book', user_id, isbn)
+
+    def place_hold(self, user_id, isbn):
+        """See LibraryManagementSystem.place_hold."""
+        return self.call(self.owner(isbn), 'place_hold', user_id, isbn)
+
+    def cancel_hold(self, user_id, isbn):
+        """See LibraryManagementSystem.cancel_hold."""
+        return self.call(self.owner(isbn), 'cancel_hold', user_id, isbn)
+
+    def expire_holds(self, now=None):
+        """Expire the holds due on every shard; see LibraryManagementSystem.expire_holds."""
+        now = int(time.time()) if now is None else now
+        return sum(self.broadcast('expire_holds', now))
+
+    def add_user(self, name, user_id):
+        """Add a user to every shard; see LibraryManagementSystem.add_user."""
+        return all(self.broadcast('add_user', name, user_id))
+
+    def update_user(self, user_id, name=None):
+        """Update a user on every shard; see LibraryManagementSystem.update_user."""
+        return all(self.broadcast('update_user', user_id, name))
+
+    def delete_user(self, user_id):
+        """
+        Delete a user from every shard; see LibraryManagementSystem.delete_user.
+
+        Loans are checked on every shard first, so a user with a book
+        checked out on one shard is not deleted from the others. Every shard
+        stays locked from the check to the deletion, so no checkout can come
+        in between.
+        """
+        numbers = range(self.shards)
+        with self.holding(numbers):
+            results = self._exchange({number: ('checkouts.loans_for_user', (user_id,), {}) for number in numbers})
+            loans = sum(len(shard_loans) for shard_loans in results.values())
+            if loans:
+                self.report(f"User '{user_id}' has {loans} book(s) checked out; "
+                            f"check them in before deleting the user.")
+                return False
+            return all(self._exchange({number: ('delete_user', (user_id,), {}) for number in numbers}).values())
+
+    def bulk_add_books(self, records):
+        """
+        Add many books, each shard adding its part in parallel.
+
+        Args:
+            records (iterable): Dicts with 'title', 'author' and 'isbn' keys.
+
+        Returns:
+            tuple: Number of books added, and a list of (record number, error message).
+        """
+        parts = [([], []) for _ in range(self.shards)]
+        errors = []
+        for number, record in enumerate(records, 1):
+            isbn = record.get('isbn')
+            error = validate_id(isbn, "ISBN")
+            if error:
+                errors.append((number, error))
+                continue
+            numbers, part = parts[self.owner(isbn)]
+            numbers.append(number)
+            part.append(record)
+        results = self.scatter({shard: ('bulk_add_books', (part,), {})
+                                for shard, (_, part) in enumerate(parts) if part})
+        added = 0
+        for shard, (shard_added, shard_errors) in results.items():
+            added += shard_added
+            numbers = parts[shard][0]
+            errors.extend((numbers[number - 1], error) for number, error in shard_errors)
+        errors.sort()
+        return added, errors
+
+    def bulk_add_users(self, records):
+        """Add many users to every shard; see LibraryManagementSystem.bulk_add_users."""
+        return self.broadcast('bulk_add_users', list(records))[0]
+
+    def search_books(self, title=None, author=None, isbn=None, limit=None, offset=0, available=None, fuzzy=0):
+        """
+        Search every shard and merge the ranked results.
+
+        Results are ordered as with a single search index, best match first,
+        then by title and ISBN.
+
+        Args:
+            title (str, optional): Substring of the title.
+            author (str, optional): Substring of the author.
+            isbn (str, optional): ISBN of the book; only its shard is searched.
+            limit (int, optional): Maximum number of books. Defaults to None (all).
+            offset (int, optional): Number of books to skip. Defaults to 0.
+            available (bool, optional): Only books that are (True) or are not
+                (False) available. Defaults to None (either).
+            fuzzy (int, optional): Largest number of typos per word of the title
+                and author; see BookManager.search_books. Defaults to 0 (exact).
+
+        Returns:
+            list: The matching books.
+        """
+        if isbn:
+            return self.call(self.owner(isbn), 'query_books', title, author, isbn, limit, offset,
+                             available=available, fuzzy=fuzzy)
+        stop = None if limit is None else offset + limit
+        results = self.broadcast('ranked_search', title, author, stop, available, fuzzy)
+        merged = heapq.merge(*results, key=operator.itemgetter(0))
+        return [book for _, book in itertools.islice(merged, offset, stop)]
+
+    def count_books(self, title=None, author=None, isbn=None, available=None, fuzzy=0):
+        """See BookManager.count_books."""
+        if isbn:
+            return self.call(self.owner(isbn), 'book_manager.count_books', title, author, isbn, available, fuzzy)
+        return sum(self.broadcast('book_manager.count_books', title, author, None, available, fuzzy))
+
+    def inventory(self):
+        """Add up the inventory totals of every shard; see BookManager.inventory."""
+        totals = {'books': 0, 'available': 0, 'checked_out': 0}
+        for inventory in self.broadcast('inventory'):
+            for key in totals:
+                totals[key] += inventory[key]
+        return totals
+
+    def overdue_loans(self, now=None, limit=None, offset=0):
+        """Merge the overdue loans of every shard; see LibraryManagementSystem.overdue_loans."""
+        now = int(time.time()) if now is None else now
+        stop = None if limit is None else offset + limit
+        merged = heapq.merge(*self.broadcast('overdue_loans', now, stop), key=operator.itemgetter('due'))
+        return list(itertools.islice(merged, offset, stop))
+
+    def loans_due(self, hours=24, now=None, limit=None, offset=0):
+        """Merge the loans due soon on every shard; see LibraryManagementSystem.loans_due."""
+        now = int(time.time()) if now is None else now
+        stop = None if limit is None else offset + limit
+        merged = heapq.merge(*self.broadcast('loans_due', hours, now, stop), key=operator.itemgetter('due'))
+        return list(itertools.islice(merged, offset, stop))
+
+    def save_data(self):
+        """Save every shard; see LibraryManagementSystem.save_data."""
+        self.broadcast('save_data')
+
+    def close(self):
+        """
+        Close every shard and wait for the processes to exit.
+        """
+        self.scatter({number: None for number in range(self.shards)})
+        for process in self.processes:
+            process.join()
@@ -0,0 +1,329 @@
+import mmap
+import struct
+import sys
+from collections.abc import MutableMapping
+from models import Book
+
+MAGIC = b'LMSBOOK2'
+# Snapshots written before books had copies, without the copies fields.
+MAGIC_V1 = b'LMSBOOK1'
+# Magic and number of records.
+HEADER = struct.Struct('<8sI')
+# Heap offsets of the ISBN, title and author, their UTF-8 lengths, availability,
+# and the heap offset and length of the copies (length 0 for a single copy).
+RECORD = struct.Struct('<IIIHHHBII')
+RECORD_V1 = struct.Struct('<IIIHHHB')
+# The ISBN fields of a record, for lookups.
+ISBN_FIELDS = struct.Struct('<I8xH')
+# Record number, in the ISBN index.
+SLOT = struct.Struct('<I')
+
+
+def encode_copies(book):
+    """
+    Encode the copies of a book for the snapshot heap.
+
+    Barcodes are alphanumeric, so they are separated by spaces, and those
+    checked out are marked with a leading '*': one byte per copy besides
+    its barcode.
+
+    Args:
+        book (Book): A book with copies.
+
+    Returns:
+        bytes: The encoded copies.
+    """
+    return " ".join(barcode if free else f"*{barcode}" for barcode, free in book.copies.items()).encode()
+
+
+def decode_copies(data):
+    """
+    Decode copies encoded by encode_copies.
+
+    Args:
+        data (bytes): The encoded copies.
+
+    Returns:
+        tuple: Barcodes of the copies, and barcodes of those checked out.
+    """
+    barcodes = data.decode().split(" ")
+    checked_out = [barcode[1:] for barcode in barcodes if barcode[0] == "*"]
+    return [barcode.lstrip("*") for barcode in barcodes], checked_out
+
+
+def write_snapshot(books, f):
+    """
+    Write books as a binary snapshot.
+
+    The layout is a header, one fixed-width record per book in catalog order,
+    an index of record numbers sorted by ISBN, and a heap holding the strings.
+    Each distinct author is stored once, and the copies of a book, if any,
+    as one string, see encode_copies.
+
+    Args:
+        books (iterable): Book objects in catalog order.
+        f (file): Binary file open for writing.
+
+    Raises:
+        ValueError: If a string other than the copies is longer than 65535
+            bytes, or the strings take more than 4 GiB.
+    """
+    heap = bytearray()
+    authors = {}
+    records = bytearray()
+    keys = []
+
+    def store(data, limit=0xFFFF):
+        if len(data) > limit:
+            raise ValueError(f"String too long for a snapshot: {data[:40]!r}...")
+        offset = len(heap)
+        heap.extend(data)
+        return offset
+
+    for number, book in enumerate(books):
+        isbn, title, author = book.isbn.encode(), book.title.encode(), book.author.encode()
+        author_offset = authors.get(author)
+        if author_offset is None:
+            author_offset = authors[author] = store(author)
+        copies = encode_copies(book) if book.copies is not None else b''
+        copies_offset = store(copies, 0xFFFFFFFF) if copies else 0
+        records += RECORD.pack(store(isbn), store(title), author_offset, len(isbn), len(title), len(author),
+                               book.available, copies_offset, len(copies))
+        keys.append((isbn, number))
+    if len(heap) > 0xFFFFFFFF:
+        raise ValueError("Catalog too large for a snapshot.")
+    keys.sort()
+    f.write(HEADER.pack(MAGIC, len(keys)))
+    f.write(records)
+    f.write(struct.pack(f'<{len(keys)}I', *(number for _, number in keys)))
+    f.write(heap)
+
+
+class BookSnapshot:
+    """Read-only view of a binary snapshot written by write_snapshot, mapped into memory."""
+
+    def __init__(self, path):
+        """
+        Map a snapshot file.
+
+        Only the header is read; records are decoded on access. Snapshots in
+        the previous format, without copies, are also accepted.
+
+        Args:
+            path (Path): The snapshot file.
+
+        Raises:
+            ValueError: If the file is not a book snapshot.
+        """
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER.size:
+            raise ValueError(f"{path} is not a book snapshot.")
+        magic, self.count = HEADER.unpack_from(self.map)
+        if magic not in (MAGIC, MAGIC_V1):
+            raise ValueError(f"{path} is not a book snapshot.")
+        self.record = RECORD if magic == MAGIC else RECORD_V1
+        self.index_start = HEADER.size + self.count * self.record.size
+        self.heap_start = self.index_start + self.count * SLOT.size
+        if sys.byteorder == 'little':
+            self.slots = memoryview(self.map)[self.index_start:self.heap_start].cast('I')
+        else:
+            self.slots = [SLOT.unpack_from(self.map, self.index_start + i * SLOT.size)[0]
+                          for i in range(self.count)]
+
+    def _string(self, offset, length):
+        """Return the raw bytes of a heap string."""
+        start = self.heap_start + offset
+        return self.map[start:start + length]
+
+    def isbn(self, number):
+        """
+        Return the ISBN of a record.
+
+        Args:
+            number (int): Record number, in catalog order.
+
+        Returns:
+            str: The ISBN.
+        """
+        isbn_offset, isbn_length = ISBN_FIELDS.unpack_from(self.map, HEADER.size + number * self.record.size)
+        return self._string(isbn_offset, isbn_length).decode()
+
+    def book(self, number):
+        """
+        Build the Book object of a record.
+
+        Args:
+            number (int): Record number, in catalog order.
+
+        Returns:
+            Book: A new Book object.
+        """
+        fields = self.record.unpack_from(self.map, HEADER.size + number * self.record.size)
+        isbn_offset, title_offset, author_offset, isbn_length, title_length, author_length, available = fields[:7]
+        barcodes, checked_out = None, ()
+        if len(fields) > 7 and fields[8]:
+            barcodes, checked_out = decode_copies(self._string(fields[7], fields[8]))
+        return Book(self._string(title_offset, title_length).decode(),
+                    self._string(author_offset, author_length).decode(),
+                    self._string(isbn_offset, isbn_length).decode(), bool(available), barcodes, checked_out)
+
+    def find(self, isbn):
+        """
+        Binary search the ISBN index.
+
+        Args:
+            isbn (str): The ISBN to look up.
+
+        Returns:
+            int: The record number, or None if the ISBN is not in the snapshot.
+        """
+        key = isbn.encode()
+        data, slots, unpack = self.map, self.slots, ISBN_FIELDS.unpack_from
+        records, heap, size = HEADER.size, self.heap_start, self.record.size
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            number = slots[middle]
+            isbn_offset, isbn_length = unpack(data, records + number * size)
+            start = heap + isbn_offset
+            found = data[start:start + isbn_length]
+            if found == key:
+                return number
+            if found < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def close(self):
+        """
+        Unmap the file.
+        """
+        if isinstance(self.slots, memoryview):
+            self.slots.release()
+        self.map.close()
+
+
+class MappedBooks(MutableMapping):
+    """
+    Catalog dict keyed by ISBN, backed by a BookSnapshot.
+
+    Book objects are built from the snapshot the first time they are looked
+    up and kept from then on, so changes to them stick; they get the mapping's
+    observer, see Book. Books added or deleted after the snapshot was taken
+    are tracked separately. Iteration follows catalog order, like a dict.
+    """
+
+    def __init__(self, snapshot):
+        """
+        Initialize the MappedBooks class.
+
+        Args:
+            snapshot (BookSnapshot): The mapped snapshot.
+        """
+        self.snapshot = snapshot
+        self.observer = None
+        self.loaded = {}
+        self.deleted = set()
+        self.added = {}
+
+    def _number(self, isbn):
+        """Return the record number of a live snapshot book, or None."""
+        if isbn in self.deleted:
+            return None
+        return self.snapshot.find(isbn)
+
+    def __getitem__(self, isbn):
+        book = self.added.get(isbn)
+        if book is None:
+            book = self.loaded.get(isbn)
+        if book is None:
+            number = self._number(isbn)
+            if number is None:
+                raise KeyError(isbn)
+            book = self.loaded[isbn] = self.snapshot.book(number)
+            book.observer = self.observer
+        return book
+
+    def peek(self, isbn):
+        """
+        Look up a book without keeping it loaded.
+
+        Args:
+            isbn (str): The ISBN.
+
+        Returns:
+            Book: The loaded book, a temporary one built from the snapshot, or
+                None if not found.
+        """
+        book = self.added.get(isbn)
+        if book is None:
+            book = self.loaded.get(isbn)
+        if book is None:
+            number = self._number(isbn)
+            if number is not None:
+                book = self.snapshot.book(number)
+        return book
+
+    def copy(self):
+        """
+        Return a shallow copy sharing the snapshot.
+
+        Returns:
+            MappedBooks: The copy.
+        """
+        books = MappedBooks(self.snapshot)
+        books.observer = self.observer
+        books.loaded = dict(self.loaded)
+        books.deleted = set(self.deleted)
+        books.added = dict(self.added)
+        return books
+
+    def __contains__(self, isbn):
+        return isbn in self.added or isbn in self.loaded or self._number(isbn) is not None
+
+    def __setitem__(self, isbn, book):
+        if isbn in self.added or self._number(isbn) is None:
+            self.added[isbn] = book
+        else:
+            self.loaded[isbn] = book
+
+    def __delitem__(self, isbn):
+        if isbn in self.added:
+            del self.added[isbn]
+        elif self._number(isbn) is not None:
+            self.deleted.add(isbn)
+            self.loaded.pop(isbn, None)
+        else:
+            raise KeyError(isbn)
+
+    def __iter__(self):
+        snapshot, deleted = self.snapshot, self.deleted
+        for number in range(snapshot.count):
+            isbn = snapshot.isbn(number)
+            if isbn not in deleted:
+                yield isbn
+        yield from self.added
+
+    def __len__(self):
+        return self.snapshot.count - len(self.deleted) + len(self.added)
+
+    def values(self):
+        """
+        Iterate over the books in catalog order.
+
+        Books that were never looked up are built for the iteration only and
+        not kept, so a full pass (e.g. saving) does not load the whole catalog.
+
+        Yields:
+            Book: Each book.
+        """
+        snapshot, deleted, loaded = self.snapshot, self.deleted, self.loaded
+        for number in range(snapshot.count):
+            isbn = snapshot.isbn(number)
+            if isbn in deleted:
+                continue
+            book = loaded.get(isbn)
+            yield book if book is not None else snapshot.book(number)
+        yield from self.added.values()
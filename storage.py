@@ -1,66 +1,300 @@
+import contextlib
+import functools
 import json
+import os
+import queue
+import sqlite3
+import threading
+import time
 from pathlib import Path
+from holds import HoldQueues
+from ledger import CheckoutLedger, timestamp
+from metrics import METRICS
 from models import Book, User
+from snapshot import BookSnapshot, MappedBooks, write_snapshot
+
+CHUNK_SIZE = 1 << 16
+
+# 'none': never fsync; 'batch': group commit every sync_every operations or
+# sync_interval seconds; 'always': every operation is durable before returning.
+DURABILITY_LEVELS = ('none', 'batch', 'always')
+
+
+def iter_json_array(path, progress=None, chunk_size=CHUNK_SIZE):
+    """
+    Parse a JSON array file element by element without reading it whole.
+
+    Args:
+        path (Path): File containing a JSON array.
+        progress (callable, optional): Called as progress(name, done, total) with
+            the number of characters read so far and the file size. Defaults to None.
+        chunk_size (int, optional): Number of characters read at a time.
+
+    Yields:
+        object: The decoded array elements, in order.
+
+    Raises:
+        json.JSONDecodeError: If the file is not a well-formed JSON array.
+    """
+    decoder = json.JSONDecoder()
+    total = path.stat().st_size
+    done = 0
+    with path.open('r') as f:
+        buffer = ''
+        pos = 0
+        eof = False
+        state = 'start'
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                pos += 1
+            if pos == len(buffer):
+                need_more = True
+            elif state == 'start':
+                if buffer[pos] != '[':
+                    raise json.JSONDecodeError("Expecting '['", buffer, pos)
+                pos += 1
+                state = 'first'
+                continue
+            elif state in ('first', 'next') and buffer[pos] == ']':
+                if progress:
+                    progress(path.name, total, total)
+                return
+            elif state == 'next':
+                if buffer[pos] != ',':
+                    raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+                pos += 1
+                state = 'value'
+                continue
+            else:
+                try:
+                    obj, end = decoder.raw_decode(buffer, pos)
+                    # A value ending exactly at the buffer end may be cut short.
+                    need_more = end == len(buffer) and not eof
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    need_more = True
+                if not need_more:
+                    yield obj
+                    pos = end
+                    state = 'next'
+                    continue
+            if eof:
+                raise json.JSONDecodeError("Unterminated array", buffer, pos)
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            done += len(chunk)
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            if progress and chunk and done < total:
+                progress(path.name, done, total)
+
+
+def dump_json_array(records, f):
+    """
+    Write records as a JSON array one element at a time.
+
+    The output is the same as json.dump(list(records), f).
+
+    Args:
+        records (iterable): JSON-serializable records.
+        f (file): Text file opened for writing.
+    """
+    f.write('[')
+    for i, record in enumerate(records):
+        if i:
+            f.write(', ')
+        f.write(json.dumps(record))
+    f.write(']')
+
+
+def is_newer(path, other):
+    """
+    Tell whether a file was written after another one.
+
+    Args:
+        path (Path): The file to check.
+        other (Path): The file to compare with.
+
+    Returns:
+        bool: True if path exists and other does not, or was modified earlier.
+    """
+    if not path.exists():
+        return False
+    return not other.exists() or path.stat().st_mtime_ns > other.stat().st_mtime_ns
+
 
 class Storage:
-    def __init__(self, books_file, users_file, checkouts_file):
+    def __init__(self, books_file, users_file, checkouts_file, journal_file=None, durability='batch',
+                 sync_every=32, sync_interval=0.05, snapshot_file=None, holds_file=None):
         """
-        Initialize the Storage class with file paths for books, users, and checkouts.
+        Initialize the Storage class with file paths for books, users, checkouts and holds.
 
         Args:
             books_file (str): File path for storing books data.
             users_file (str): File path for storing users data.
             checkouts_file (str): File path for storing checkouts data.
+            journal_file (str, optional): File path for the append-only journal.
+                When set, each operation is appended to the journal instead of
+                rewriting the data files. Defaults to None.
+            durability (str, optional): One of DURABILITY_LEVELS. Defaults to 'batch'.
+            sync_every (int, optional): With 'batch' durability, maximum number of
+                operations committed together. Defaults to 32.
+            sync_interval (float, optional): With 'batch' durability, maximum number
+                of seconds between two commits. Defaults to 0.05.
+            snapshot_file (str, optional): File path of a binary book snapshot.
+                When set, books are saved there instead of the books file, and
+                loaded from it once it exists, unless the books file was
+                written later. Defaults to None.
+            holds_file (str, optional): File path for storing holds data.
+                Defaults to the checkouts file with a '.holds.json' suffix.
+
+        Raises:
+            ValueError: If the durability level is unknown.
         """
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"Unknown durability level '{durability}'.")
         self.books_file = Path(books_file)
         self.users_file = Path(users_file)
         self.checkouts_file = Path(checkouts_file)
+        self.holds_file = Path(holds_file) if holds_file else self.checkouts_file.with_suffix('.holds.json')
+        self.journal_file = Path(journal_file) if journal_file else None
+        self.snapshot_file = Path(snapshot_file) if snapshot_file else None
+        self.durability = durability
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self._journal = None
+        self._unsynced = 0
+        self._last_commit = 0.0
+        self._deferred = 0
+        self.journal_length = 0
 
-    def load_books(self):
+    def commit_due(self, pending):
         """
-        Load books data from the books file.
+        Decide whether pending operations should be committed now.
+
+        Args:
+            pending (int): Number of operations not committed yet.
 
         Returns:
-            list: List of Book objects loaded from the file.
+            bool: True if a commit is due under the durability level.
         """
-        try:
-            if self.books_file.exists():
-                with self.books_file.open('r') as f:
-                    book_dicts = json.load(f)
-                    return [Book(**book) for book in book_dicts]
-        except (json.JSONDecodeError, FileNotFoundError) as e:
-            print(f"Error loading books: {e}")
+        if self.durability == 'always':
+            return True
+        return pending >= self.sync_every or time.monotonic() - self._last_commit >= self.sync_interval
+
+    def _write_atomic(self, path, write, binary=False):
+        """
+        Replace a data file.
+
+        The data is written to a temporary file which is renamed over the
+        target, so a crash leaves either the old or the new file, never a
+        truncated one.
+
+        Args:
+            path (Path): The file to replace.
+            write (callable): Called with the open temporary file to write the data.
+            binary (bool, optional): Open the temporary file in binary mode. Defaults to False.
+        """
+        temp = path.with_name(path.name + '.tmp')
+        with temp.open('wb' if binary else 'w') as f:
+            write(f)
+            f.flush()
+            if self.durability != 'none':
+                os.fsync(f.fileno())
+        if METRICS.enabled:
+            METRICS.increment('library_storage_bytes_written_total', (('file', path.name),), temp.stat().st_size)
+        os.replace(temp, path)
+        if self.durability != 'none':
+            directory = os.open(path.parent, os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+        self._last_commit = time.monotonic()
+
+    @METRICS.timed('library_storage_seconds', 'load_books')
+    def load_books(self, progress=None):
+        """
+        Load books data from the snapshot, or else from the books file.
+
+        The snapshot is only mapped into memory, so loading it takes the same
+        time whatever the catalog size. Records of the books file are parsed
+        and turned into Book objects one at a time. A books file written after
+        the snapshot, e.g. while the snapshot was turned off, is loaded
+        instead, and the next compaction writes its books to the snapshot.
+
+        Args:
+            progress (callable, optional): Progress callback, see iter_json_array.
+
+        Returns:
+            MappedBooks or list: The snapshot catalog, or a list of Book objects
+                loaded from the books file.
+
+        Raises:
+            json.JSONDecodeError: If the file is corrupt. Loading an empty catalog
+                instead would erase it on the next save.
+        """
+        if self.snapshot_file and is_newer(self.snapshot_file, self.books_file):
+            books = MappedBooks(BookSnapshot(self.snapshot_file))
+            if progress:
+                progress(self.snapshot_file.name, 1, 1)
+            return books
+        if self.books_file.exists():
+            try:
+                return [Book(**book) for book in iter_json_array(self.books_file, progress)]
+            except json.JSONDecodeError as e:
+                print(f"Error loading books: {e}")
+                raise
         return []
 
+    @METRICS.timed('library_storage_seconds', 'save_books')
     def save_books(self, books):
         """
-        Save books data to the books file.
+        Save books data to the snapshot if there is one, or else to the books file.
 
         Args:
             books (list): List of Book objects to be saved.
         """
-        book_dicts = [vars(book) for book in books]
-        with self.books_file.open('w') as f:
-            json.dump(book_dicts, f)
+        if self.snapshot_file:
+            self._write_atomic(self.snapshot_file, functools.partial(write_snapshot, books), binary=True)
+        else:
+            self._write_atomic(self.books_file,
+                               functools.partial(dump_json_array, (book.to_dict() for book in books)))
 
-    def load_users(self):
+    @METRICS.timed('library_storage_seconds', 'load_users')
+    def load_users(self, books, progress=None):
         """
         Load users data from the users file.
 
+        Checked out books are stored as ISBNs and resolved against the catalog,
+        so users share the catalog's Book objects. Entries written by older
+        versions, which embedded a full copy of each book, are also accepted.
+
+        Args:
+            books (dict): Catalog Book objects keyed by ISBN.
+            progress (callable, optional): Progress callback, see iter_json_array.
+
         Returns:
             list: List of User objects loaded from the file.
         """
         if self.users_file.exists():
-            with self.users_file.open('r') as f:
-                user_dicts = json.load(f)
-                users = []
-                for user_dict in user_dicts:
-                    user = User(user_dict['name'], user_dict['user_id'])
-                    user.checked_out_books = [Book(**book) for book in user_dict['checked_out_books']]
-                    users.append(user)
-                return users
+            users = []
+            for user_dict in iter_json_array(self.users_file, progress):
+                user = User(user_dict['name'], user_dict['user_id'])
+                for isbn in user_dict['checked_out_books']:
+                    if isinstance(isbn, dict):
+                        isbn = isbn['isbn']
+                    book = books.get(isbn)
+                    if book is None:
+                        print(f"Ignoring checkout of unknown ISBN '{isbn}' by user '{user.user_id}'.")
+                        continue
+                    user.checked_out_books.add(book)
+                users.append(user)
+            return users
         return []
 
+    @METRICS.timed('library_storage_seconds', 'save_users')
     def save_users(self, users):
         """
         Save users data to the users file.
@@ -68,27 +302,628 @@ class Storage:
         Args:
             users (list): List of User objects to be saved.
         """
-        with self.users_file.open('w') as f:
-            json.dump([user.to_dict() for user in users], f)
+        self._write_atomic(self.users_file, functools.partial(dump_json_array, (user.to_dict() for user in users)))
 
-    def load_checkouts(self):
+    @METRICS.timed('library_storage_seconds', 'load_checkouts')
+    def load_checkouts(self, progress=None):
         """
         Load checkouts data from the checkouts file.
 
+        Args:
+            progress (callable, optional): Progress callback, see iter_json_array.
+
         Returns:
-            list: List of checkouts data loaded from the file.
+            CheckoutLedger: Ledger of the checkouts loaded from the file.
         """
         if self.checkouts_file.exists():
-            with self.checkouts_file.open('r') as f:
-                return json.load(f)
-        return []
+            return CheckoutLedger(iter_json_array(self.checkouts_file, progress))
+        return CheckoutLedger()
 
+    @METRICS.timed('library_storage_seconds', 'save_checkouts')
     def save_checkouts(self, checkouts):
         """
         Save checkouts data to the checkouts file.
 
         Args:
-            checkouts (list): List of checkouts data to be saved.
+            checkouts (CheckoutLedger): Ledger of the checkouts to be saved.
+        """
+        self._write_atomic(self.checkouts_file, functools.partial(dump_json_array, checkouts))
+
+    @METRICS.timed('library_storage_seconds', 'load_holds')
+    def load_holds(self, progress=None):
+        """
+        Load holds data from the holds file.
+
+        Args:
+            progress (callable, optional): Progress callback, see iter_json_array.
+
+        Returns:
+            HoldQueues: Hold queues loaded from the file.
+        """
+        if self.holds_file.exists():
+            return HoldQueues(iter_json_array(self.holds_file, progress))
+        return HoldQueues()
+
+    @METRICS.timed('library_storage_seconds', 'save_holds')
+    def save_holds(self, holds):
+        """
+        Save holds data to the holds file.
+
+        Args:
+            holds (HoldQueues): Hold queues to be saved, in queue order.
+        """
+        self._write_atomic(self.holds_file, functools.partial(dump_json_array, holds))
+
+    @property
+    def journaled(self):
+        """bool: Whether operations are recorded in the journal."""
+        return self.journal_file is not None
+
+    @property
+    def pending(self):
+        """int: Number of journal records appended but not synced yet."""
+        return self._unsynced
+
+    @METRICS.timed('library_storage_seconds', 'load_journal')
+    def load_journal(self):
+        """
+        Load the records appended to the journal since the last compaction.
+
+        A partially written last line (e.g. after a crash) is ignored.
+
+        Returns:
+            list: List of journal records, oldest first.
+        """
+        records = []
+        if self.journal_file and self.journal_file.exists():
+            with self.journal_file.open('r') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        print("Ignoring truncated journal record.")
+                        break
+        self.journal_length = len(records)
+        return records
+
+    @METRICS.timed('library_storage_seconds', 'append')
+    def append(self, op, **fields):
+        """
+        Append one operation record to the journal.
+
+        Each record is flushed to the OS as it is appended, so it survives a
+        crash of the process; it is synced to disk according to the
+        durability level.
+
+        Args:
+            op (str): Name of the operation, e.g. 'add_book' or 'checkout'.
+            **fields: Arguments of the operation.
+        """
+        if self._journal is None:
+            self._journal = self.journal_file.open('a')
+        record = dict(op=op, **fields)
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        self._journal.write(line)
+        self._journal.flush()
+        METRICS.increment('library_storage_bytes_written_total', (('file', self.journal_file.name),), len(line))
+        self.journal_length += 1
+        self._unsynced += 1
+        if not self._deferred and self.commit_due(self._unsynced):
+            self.sync()
+
+    @contextlib.contextmanager
+    def deferred(self):
+        """
+        Hold back journal syncs until the block ends, then sync once.
+
+        Blocks can be nested; the outermost one syncs.
+        """
+        self._deferred += 1
+        try:
+            yield
+        finally:
+            self._deferred -= 1
+            if not self._deferred:
+                self.sync()
+
+    @METRICS.timed('library_storage_seconds', 'sync')
+    def sync(self):
+        """
+        Flush pending journal records to disk.
+        """
+        if self._journal is not None and self._unsynced:
+            self._journal.flush()
+            if self.durability != 'none':
+                os.fsync(self._journal.fileno())
+            self._unsynced = 0
+            self._last_commit = time.monotonic()
+
+    def clear_journal(self):
+        """
+        Truncate the journal once its records are part of the snapshot files.
+        """
+        if self.journal_file is None:
+            return
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        self._unsynced = 0
+        self.journal_length = 0
+        self.journal_file.open('w').close()
+
+    def close(self):
+        """
+        Sync and close the journal.
+        """
+        self.sync()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+
+class SQLiteStorage:
+    """
+    Storage backend keeping books, users, checkouts and holds in a SQLite database.
+
+    It has the same interface as Storage. Every operation passed to append()
+    is applied as one small transaction, so nothing is ever rewritten in full.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS books (
+            isbn TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            author TEXT NOT NULL,
+            available INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            name TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS checkouts (
+            user_id TEXT NOT NULL,
+            isbn TEXT NOT NULL,
+            checkout_time TEXT NOT NULL,
+            PRIMARY KEY (user_id, isbn)
+        );
+        CREATE INDEX IF NOT EXISTS checkouts_isbn ON checkouts (isbn);
+        CREATE TABLE IF NOT EXISTS copies (
+            isbn TEXT NOT NULL,
+            barcode TEXT NOT NULL,
+            available INTEGER NOT NULL,
+            PRIMARY KEY (isbn, barcode)
+        );
+        CREATE TABLE IF NOT EXISTS holds (
+            user_id TEXT NOT NULL,
+            isbn TEXT NOT NULL,
+            placed INTEGER NOT NULL,
+            barcode TEXT,
+            expires INTEGER,
+            PRIMARY KEY (user_id, isbn)
+        );
+    """
+
+    # Statements applied by append(), one list per operation.
+    OPERATIONS = {
+        'add_book': [("INSERT INTO books (isbn, title, author, available) VALUES (?, ?, ?, 1)",
+                      ('isbn', 'title', 'author'))],
+        'update_book': [("UPDATE books SET title = COALESCE(?, title), author = COALESCE(?, author) "
+                         "WHERE isbn = ?", ('title', 'author', 'isbn'))],
+        'delete_book': [("DELETE FROM books WHERE isbn = ?", ('isbn',)),
+                        ("DELETE FROM copies WHERE isbn = ?", ('isbn',)),
+                        ("DELETE FROM holds WHERE isbn = ?", ('isbn',))],
+        'add_user': [("INSERT INTO users (user_id, name) VALUES (?, ?)", ('user_id', 'name'))],
+        'update_user': [("UPDATE users SET name = COALESCE(?, name) WHERE user_id = ?", ('name', 'user_id'))],
+        'delete_user': [("DELETE FROM users WHERE user_id = ?", ('user_id',)),
+                        ("DELETE FROM holds WHERE user_id = ?", ('user_id',))],
+        'checkout': [("INSERT INTO checkouts (user_id, isbn, checkout_time, due, barcode) VALUES (?, ?, ?, ?, ?)",
+                      ('user_id', 'isbn', 'checkout_time', 'due', 'barcode')),
+                     ("UPDATE copies SET available = 0 WHERE isbn = ? AND barcode = ?", ('isbn', 'barcode')),
+                     ("UPDATE books SET available = EXISTS (SELECT 1 FROM copies WHERE copies.isbn = books.isbn "
+                      "AND copies.available = 1) WHERE isbn = ?", ('isbn',)),
+                     ("DELETE FROM holds WHERE user_id = ? AND isbn = ?", ('user_id', 'isbn'))],
+        'checkin': [("DELETE FROM checkouts WHERE user_id = ? AND isbn = ?", ('user_id', 'isbn')),
+                    ("UPDATE copies SET available = 1 WHERE isbn = ? AND barcode = ?", ('isbn', 'barcode')),
+                    ("UPDATE books SET available = 1 WHERE isbn = ?", ('isbn',))],
+        # The implicit copy of a book becomes the copy whose barcode is the ISBN.
+        'add_copies': [("INSERT OR IGNORE INTO copies (isbn, barcode, available) "
+                        "SELECT isbn, isbn, available FROM books WHERE isbn = ?", ('isbn',)),
+                       ("INSERT OR IGNORE INTO copies (isbn, barcode, available) VALUES (?, ?, 1)",
+                        ('isbn', '*barcodes')),
+                       ("UPDATE books SET available = 1 WHERE isbn = ?", ('isbn',))],
+        'place_hold': [("INSERT INTO holds (user_id, isbn, placed) VALUES (?, ?, ?)",
+                        ('user_id', 'isbn', 'placed'))],
+        'cancel_hold': [("DELETE FROM holds WHERE user_id = ? AND isbn = ?", ('user_id', 'isbn'))],
+        # A copy set aside for a hold is off the shelf, as if checked out.
+        'hold_ready': [("UPDATE holds SET barcode = ?, expires = ? WHERE user_id = ? AND isbn = ?",
+                        ('barcode', 'expires', 'user_id', 'isbn')),
+                       ("UPDATE copies SET available = 0 WHERE isbn = ? AND barcode = ?", ('isbn', 'barcode')),
+                       ("UPDATE books SET available = EXISTS (SELECT 1 FROM copies WHERE copies.isbn = books.isbn "
+                        "AND copies.available = 1) WHERE isbn = ?", ('isbn',))],
+        'hold_release': [("UPDATE copies SET available = 1 WHERE isbn = ? AND barcode = ?", ('isbn', 'barcode')),
+                         ("UPDATE books SET available = 1 WHERE isbn = ?", ('isbn',))],
+    }
+
+    # PRAGMA synchronous setting for each durability level.
+    SYNCHRONOUS = {'none': 'OFF', 'batch': 'NORMAL', 'always': 'FULL'}
+
+    journaled = True
+    journal_length = 0
+    # Every operation is committed by append().
+    pending = 0
+
+    def __init__(self, database, durability='batch'):
+        """
+        Initialize the SQLiteStorage class.
+
+        Args:
+            database (str): Path to the SQLite database file.
+            durability (str, optional): One of DURABILITY_LEVELS. With 'batch',
+                WAL commits are synced at checkpoints rather than per
+                transaction. Defaults to 'batch'.
+
+        Raises:
+            ValueError: If the durability level is unknown.
+        """
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"Unknown durability level '{durability}'.")
+        self.database = Path(database)
+        self._deferred = 0
+        # Only one thread uses the connection at a time, but with a
+        # BackgroundWriter it is not the thread that opened it.
+        self.connection = sqlite3.connect(self.database, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(f"PRAGMA synchronous={self.SYNCHRONOUS[durability]}")
+        self.connection.executescript(self.SCHEMA)
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(checkouts)")]
+        for column, column_type in (('barcode', 'TEXT'), ('due', 'INTEGER')):
+            if column not in columns:
+                self.connection.execute(f"ALTER TABLE checkouts ADD COLUMN {column} {column_type}")
+
+    def _rows(self, table, query, progress):
+        """
+        Iterate over the rows of a query, reporting progress by row count.
+
+        Args:
+            table (str): Name of the table, used for progress reports.
+            query (str): SELECT statement.
+            progress (callable): Progress callback, or None.
+
+        Yields:
+            tuple: The rows of the query.
+        """
+        total = self.connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for done, row in enumerate(self.connection.execute(query), 1):
+            if progress and done % CHUNK_SIZE == 0:
+                progress(table, done, total)
+            yield row
+        if progress:
+            progress(table, total, total)
+
+    @METRICS.timed('library_storage_seconds', 'load_books')
+    def load_books(self, progress=None):
+        """
+        Load books from the database.
+
+        Args:
+            progress (callable, optional): Called as progress(name, done, total).
+
+        Returns:
+            list: List of Book objects.
+        """
+        copies = {}
+        for isbn, barcode, available in self.connection.execute(
+                "SELECT isbn, barcode, available FROM copies ORDER BY rowid"):
+            barcodes, checked_out = copies.setdefault(isbn, ([], []))
+            barcodes.append(barcode)
+            if not available:
+                checked_out.append(barcode)
+        query = "SELECT title, author, isbn, available FROM books ORDER BY rowid"
+        return [Book(title, author, isbn, bool(available), *copies.get(isbn, (None, ())))
+                for title, author, isbn, available in self._rows('books', query, progress)]
+
+    @METRICS.timed('library_storage_seconds', 'save_books')
+    def save_books(self, books):
+        """
+        Replace all books in the database.
+
+        Args:
+            books (list): List of Book objects to be saved.
+        """
+        with self.connection:
+            self.connection.execute("DELETE FROM books")
+            self.connection.execute("DELETE FROM copies")
+            copies = []
+
+            def rows():
+                for book in books:
+                    if book.copies is not None:
+                        copies.append(book)
+                    yield book.isbn, book.title, book.author, int(book.available)
+
+            self.connection.executemany("INSERT INTO books (isbn, title, author, available) VALUES (?, ?, ?, ?)",
+                                        rows())
+            self.connection.executemany(
+                "INSERT INTO copies (isbn, barcode, available) VALUES (?, ?, ?)",
+                ((book.isbn, barcode, int(free)) for book in copies for barcode, free in book.copies.items()))
+
+    @METRICS.timed('library_storage_seconds', 'load_users')
+    def load_users(self, books, progress=None):
+        """
+        Load users from the database, with their checkouts resolved against the catalog.
+
+        Args:
+            books (dict): Catalog Book objects keyed by ISBN.
+            progress (callable, optional): Called as progress(name, done, total).
+
+        Returns:
+            list: List of User objects.
+        """
+        users = {}
+        for name, user_id in self._rows('users', "SELECT name, user_id FROM users ORDER BY rowid", progress):
+            users[user_id] = User(name, user_id)
+        for user_id, isbn in self.connection.execute("SELECT user_id, isbn FROM checkouts"):
+            user = users.get(user_id)
+            book = books.get(isbn)
+            if user and book:
+                user.checked_out_books.add(book)
+        return list(users.values())
+
+    @METRICS.timed('library_storage_seconds', 'save_users')
+    def save_users(self, users):
+        """
+        Replace all users in the database.
+
+        Args:
+            users (list): List of User objects to be saved.
+        """
+        with self.connection:
+            self.connection.execute("DELETE FROM users")
+            self.connection.executemany("INSERT INTO users (user_id, name) VALUES (?, ?)",
+                                        ((user.user_id, user.name) for user in users))
+
+    @METRICS.timed('library_storage_seconds', 'load_checkouts')
+    def load_checkouts(self, progress=None):
+        """
+        Load the active checkouts from the database.
+
+        Args:
+            progress (callable, optional): Called as progress(name, done, total).
+
+        Returns:
+            CheckoutLedger: Ledger of the checkouts.
+        """
+        query = "SELECT user_id, isbn, checkout_time, barcode, due FROM checkouts ORDER BY rowid"
+        ledger = CheckoutLedger()
+        for user_id, isbn, checkout_time, barcode, due in self._rows('checkouts', query, progress):
+            # The column has text affinity, so epoch seconds come back as digits.
+            checkout_time = int(checkout_time) if checkout_time.isdigit() else timestamp(checkout_time)
+            ledger.open(user_id, isbn, checkout_time, barcode, due)
+        return ledger
+
+    @METRICS.timed('library_storage_seconds', 'save_checkouts')
+    def save_checkouts(self, checkouts):
+        """
+        Replace all checkouts in the database.
+
+        Args:
+            checkouts (CheckoutLedger): Ledger of the checkouts to be saved.
+        """
+        with self.connection:
+            self.connection.execute("DELETE FROM checkouts")
+            self.connection.executemany(
+                "INSERT INTO checkouts (user_id, isbn, checkout_time, due, barcode) VALUES (?, ?, ?, ?, ?)",
+                ((entry['user_id'], entry['isbn'], entry['checkout_time'], entry['due'], entry.get('barcode'))
+                 for entry in checkouts))
+
+    @METRICS.timed('library_storage_seconds', 'load_holds')
+    def load_holds(self, progress=None):
         """
-        with self.checkouts_file.open('w') as f:
-            json.dump(checkouts, f)
+        Load the holds from the database, in the order they were placed.
+
+        Args:
+            progress (callable, optional): Called as progress(name, done, total).
+
+        Returns:
+            HoldQueues: Hold queues of the holds.
+        """
+        query = "SELECT user_id, isbn, placed, barcode, expires FROM holds ORDER BY rowid"
+        holds = HoldQueues()
+        for user_id, isbn, placed, barcode, expires in self._rows('holds', query, progress):
+            hold = {'user_id': user_id, 'isbn': isbn, 'placed': placed}
+            if expires is not None:
+                hold.update(barcode=barcode, expires=expires)
+            holds.add(hold)
+        return holds
+
+    @METRICS.timed('library_storage_seconds', 'save_holds')
+    def save_holds(self, holds):
+        """
+        Replace all holds in the database.
+
+        Args:
+            holds (HoldQueues): Hold queues to be saved, in queue order.
+        """
+        with self.connection:
+            self.connection.execute("DELETE FROM holds")
+            self.connection.executemany(
+                "INSERT INTO holds (user_id, isbn, placed, barcode, expires) VALUES (?, ?, ?, ?, ?)",
+                ((hold['user_id'], hold['isbn'], hold['placed'], hold.get('barcode'), hold.get('expires'))
+                 for hold in holds))
+
+    @METRICS.timed('library_storage_seconds', 'load_journal')
+    def load_journal(self):
+        """
+        Return the pending journal records; the database has none.
+
+        Returns:
+            list: An empty list.
+        """
+        return []
+
+    @METRICS.timed('library_storage_seconds', 'append')
+    def append(self, op, **fields):
+        """
+        Apply one operation to the database in a single transaction.
+
+        Inside deferred() the operation is a savepoint of the block's
+        transaction instead, so it is still applied entirely or not at all.
+
+        Args:
+            op (str): Name of the operation, e.g. 'add_book' or 'checkout'.
+            **fields: Arguments of the operation.
+        """
+        if not self._deferred:
+            with self.connection:
+                self._execute(op, fields)
+            return
+        if not self.connection.in_transaction:
+            self.connection.execute("BEGIN")
+        self.connection.execute("SAVEPOINT operation")
+        try:
+            self._execute(op, fields)
+        except Exception:
+            self.connection.execute("ROLLBACK TO operation")
+            raise
+        finally:
+            self.connection.execute("RELEASE operation")
+
+    def _execute(self, op, fields):
+        """
+        Execute the statements of an operation.
+
+        A parameter named '*field' stands for each item of a list field in
+        turn, and its statement is executed once per item.
+
+        Args:
+            op (str): Name of the operation.
+            fields (dict): Arguments of the operation.
+        """
+        for statement, params in self.OPERATIONS[op]:
+            repeated = next((param for param in params if param.startswith('*')), None)
+            if repeated is None:
+                self.connection.execute(statement, [fields.get(param) or None for param in params])
+                continue
+            self.connection.executemany(statement, ([item if param == repeated else fields.get(param) or None
+                                                     for param in params]
+                                                    for item in fields[repeated[1:]]))
+
+    @contextlib.contextmanager
+    def deferred(self):
+        """
+        Apply the operations of the block in one transaction, committed when it ends.
+
+        Blocks can be nested; the outermost one commits.
+        """
+        self._deferred += 1
+        try:
+            yield
+        finally:
+            self._deferred -= 1
+            if not self._deferred and self.connection.in_transaction:
+                self.connection.commit()
+
+    @METRICS.timed('library_storage_seconds', 'sync')
+    def sync(self):
+        """
+        Nothing to do: every operation is committed by append().
+        """
+
+    def clear_journal(self):
+        """
+        Nothing to do: the database has no separate journal.
+        """
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        self.connection.close()
+
+
+class BackgroundWriter:
+    """Single thread applying queued writes in submission order."""
+
+    def __init__(self, write, idle=None):
+        """
+        Initialize the BackgroundWriter class and start its thread.
+
+        Args:
+            write (callable): Called with the arguments of each submitted write.
+            idle (callable, optional): Called whenever the queue has been drained,
+                so a burst of writes can be committed together. Defaults to None.
+        """
+        self.write = write
+        self.idle = idle
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='library-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, *args):
+        """
+        Queue a write.
+
+        Args:
+            *args: Arguments passed to write().
+        """
+        self.queue.put(args)
+
+    def flush(self):
+        """
+        Wait until every queued write has been applied.
+        """
+        self.queue.join()
+
+    def stop(self):
+        """
+        Apply the remaining writes and stop the thread.
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        """
+        Apply queued writes until stop() is called.
+        """
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self.write(*item)
+                if self.idle and self.queue.empty():
+                    self.idle()
+            except Exception as e:
+                print(f"Error persisting data: {e}")
+            finally:
+                self.queue.task_done()
+
+
+def open_storage(backend, books_file, users_file, checkouts_file, journal_file=None, database=None,
+                 durability='batch', snapshot_file=None, holds_file=None):
+    """
+    Create the storage backend selected by configuration.
+
+    Args:
+        backend (str): 'json' for the JSON files, 'sqlite' for a SQLite database.
+        books_file (str): File path for storing books data (json backend).
+        users_file (str): File path for storing users data (json backend).
+        checkouts_file (str): File path for storing checkouts data (json backend).
+        journal_file (str, optional): File path for the journal (json backend).
+        database (str, optional): File path of the database (sqlite backend).
+        durability (str, optional): One of DURABILITY_LEVELS. Defaults to 'batch'.
+        snapshot_file (str, optional): File path of the binary book snapshot (json backend).
+        holds_file (str, optional): File path for storing holds data (json backend).
+
+    Returns:
+        Storage or SQLiteStorage: The storage backend.
+
+    Raises:
+        ValueError: If the backend is unknown.
+    """
+    if backend == 'json':
+        return Storage(books_file, users_file, checkouts_file, journal_file, durability,
+                       snapshot_file=snapshot_file, holds_file=holds_file)
+    if backend == 'sqlite':
+        return SQLiteStorage(database or 'library.db', durability)
+    raise ValueError(f"Unknown storage backend '{backend}'.")
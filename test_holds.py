@@ -0,0 +1,153 @@
+import time
+import pytest
+from check import LibraryManagementSystem
+from ledger import DAY
+
+BACKENDS = ['json', 'journal', 'sqlite']
+
+
+def make_library(directory, backend):
+    """
+    Open a library whose files all live in a directory.
+
+    Args:
+        directory (Path): Directory of the data files.
+        backend (str): 'json', 'journal' (json with a journal) or 'sqlite'.
+
+    Returns:
+        LibraryManagementSystem: The library, printing nothing.
+    """
+    library = LibraryManagementSystem(directory / "books.json", directory / "users.json",
+                                      directory / "checkouts.json",
+                                      journal_file=directory / "journal.jsonl" if backend == 'journal' else None,
+                                      backend='sqlite' if backend == 'sqlite' else 'json',
+                                      database=directory / "library.db", durability='none',
+                                      holds_file=directory / "holds.json")
+    library.report = lambda message: None
+    return library
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    return request.param
+
+
+@pytest.fixture
+def library(tmp_path, backend):
+    """A library with one book lent to 'a', and users 'b' and 'c' waiting for it in that order."""
+    library = make_library(tmp_path, backend)
+    library.add_book("Dune", "Herbert", "1")
+    for user_id in "abc":
+        library.add_user(f"User {user_id}", user_id)
+    assert library.checkout_book("a", "1")
+    assert library.place_hold("b", "1")
+    assert library.place_hold("c", "1")
+    yield library
+    library.close()
+
+
+def is_ready(library, user_id, isbn="1"):
+    """Tell whether a user's hold on a book is ready for pickup."""
+    hold = library.holds.get(user_id, isbn)
+    return hold is not None and 'expires' in hold
+
+
+def test_place_hold_refuses_available_books_and_duplicates(library):
+    library.add_book("Emma", "Austen", "2")
+    assert not library.place_hold("b", "2")
+    assert not library.place_hold("b", "1")
+    assert library.holds.position("c", "1") == 2
+
+
+def test_check_in_hands_the_book_to_holders_in_order(library):
+    book = library.book_manager.get_book_by_isbn("1")
+    assert library.checkin_book("a", "1")
+    assert is_ready(library, "b") and not is_ready(library, "c")
+    assert not book.available
+    assert not library.checkout_book("c", "1")
+
+    assert library.checkout_book("b", "1")
+    assert library.holds.get("b", "1") is None
+    assert library.checkin_book("b", "1")
+    assert is_ready(library, "c")
+    assert library.checkout_book("c", "1")
+    assert library.checkin_book("c", "1")
+    assert book.available
+    assert len(library.holds) == 0
+
+
+def test_expired_hold_passes_the_copy_on(library):
+    library.checkin_book("a", "1")
+    expires = library.holds.get("b", "1")['expires']
+    assert library.expire_holds(expires - 1) == 0
+    assert library.expire_holds(expires) == 1
+    assert library.holds.get("b", "1") is None
+    assert is_ready(library, "c")
+
+    later = library.holds.get("c", "1")['expires']
+    assert library.expire_holds(later) == 1
+    assert library.book_manager.get_book_by_isbn("1").available
+
+
+def test_cancelling_a_waiting_hold_keeps_the_queue(library):
+    assert library.cancel_hold("b", "1")
+    assert not library.cancel_hold("b", "1")
+    library.checkin_book("a", "1")
+    assert is_ready(library, "c")
+
+
+def test_cancelling_a_ready_hold_passes_the_copy_on(library):
+    library.checkin_book("a", "1")
+    assert library.cancel_hold("b", "1")
+    assert is_ready(library, "c")
+    assert library.cancel_hold("c", "1")
+    assert library.book_manager.get_book_by_isbn("1").available
+
+
+def test_delete_user_releases_a_ready_copy(library):
+    library.checkin_book("a", "1")
+    assert library.delete_user("b")
+    assert is_ready(library, "c")
+    assert library.delete_user("c")
+    assert library.book_manager.get_book_by_isbn("1").available
+    assert len(library.holds) == 0
+
+
+def test_holds_survive_a_restart(tmp_path, backend, library):
+    library.checkin_book("a", "1")
+    library.place_hold("a", "1")
+    expected = sorted(map(sorted, (hold.items() for hold in library.holds)))
+    library.close()
+
+    reopened = make_library(tmp_path, backend)
+    try:
+        assert sorted(map(sorted, (hold.items() for hold in reopened.holds))) == expected
+        assert is_ready(reopened, "b")
+        assert [reopened.holds.position(user_id, "1") for user_id in "ca"] == [1, 2]
+        assert not reopened.book_manager.get_book_by_isbn("1").available
+
+        # The queue carries on where it left off, expiry included.
+        assert reopened.checkout_book("b", "1")
+        reopened.checkin_book("b", "1")
+        assert is_ready(reopened, "c")
+        assert reopened.expire_holds(int(time.time()) + reopened.pickup_days * DAY + 1) == 1
+        assert is_ready(reopened, "a")
+        assert reopened.expire_holds(reopened.holds.get("a", "1")['expires']) == 1
+        assert reopened.book_manager.get_book_by_isbn("1").available
+    finally:
+        reopened.close()
+
+
+def test_holds_survive_a_restart_after_compaction(tmp_path, backend, library):
+    library.checkin_book("a", "1")
+    library.compact()
+    library.cancel_hold("b", "1")
+    library.close()
+
+    reopened = make_library(tmp_path, backend)
+    try:
+        assert reopened.holds.get("b", "1") is None
+        assert is_ready(reopened, "c")
+        assert not reopened.book_manager.get_book_by_isbn("1").available
+    finally:
+        reopened.close()
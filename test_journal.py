@@ -0,0 +1,133 @@
+import pytest
+from check import LibraryManagementSystem
+
+
+def make_library(directory, snapshot_file=None):
+    """
+    Open a json library with a journal, whose files all live in a directory.
+
+    Args:
+        directory (Path): Directory of the data files.
+        snapshot_file (str, optional): Name of a binary book snapshot in it. Defaults to None.
+
+    Returns:
+        LibraryManagementSystem: The library, printing nothing.
+    """
+    library = LibraryManagementSystem(directory / "books.json", directory / "users.json",
+                                      directory / "checkouts.json", journal_file=directory / "journal.jsonl",
+                                      durability='none', holds_file=directory / "holds.json",
+                                      snapshot_file=directory / snapshot_file if snapshot_file else None)
+    library.report = lambda message: None
+    return library
+
+
+def first_half(library):
+    """Operations of every kind but holds, leaving a loan on a book with copies open."""
+    for i in range(6):
+        library.add_book(f"Title {i}", f"Author {i}", f"b{i}")
+        library.add_user(f"User {i}", f"u{i}")
+    library.add_copies("b1", ["c1", "c2", "c3"])
+    library.checkout_book("u0", "b0")
+    library.checkout_book("u1", "b1")
+    library.checkout_book("u2", "b1")
+    library.checkin_book("u1", "b1")
+    library.update_book("b2", title="Renamed")
+    library.update_user("u2", "Renamed")
+    library.delete_book("b5")
+    library.delete_user("u5")
+
+
+def second_half(library):
+    """Holds, hand-offs and deletions on top of first_half, leaving a waiting and a ready hold."""
+    library.place_hold("u3", "b0")
+    library.place_hold("u4", "b0")
+    library.checkin_book("u0", "b0")
+    library.cancel_hold("u3", "b0")
+    library.checkout_book("u4", "b0")
+    library.checkout_book("u3", "b1")
+    library.add_book("Late", "Author", "b9")
+    library.delete_book("b3")
+    library.add_copies("b1", ["c4"])
+    library.place_hold("u0", "b0")
+    library.checkout_book("u1", "b4")
+    library.place_hold("u0", "b4")
+    library.checkin_book("u1", "b4")
+
+
+def state(library):
+    """Return the whole library as plain, comparable values."""
+    books = sorted(map(sorted, (book.to_dict().items() for book in library.book_manager.books.values())))
+    users = sorted((user.user_id, user.name, sorted(book.isbn for book in user.checked_out_books))
+                   for user in library.user_manager.users.values())
+    loans = sorted((entry['user_id'], entry['isbn'], entry.get('barcode'))
+                   for entry in library.checkouts.entries.values())
+    holds = sorted((hold['user_id'], hold['isbn'], hold.get('barcode'), 'expires' in hold) for hold in library.holds)
+    return books, users, loans, holds
+
+
+@pytest.fixture(params=[None, "books.snapshot"], ids=["json", "mapped"])
+def snapshot_file(request):
+    return request.param
+
+
+def test_replay_restores_the_state(tmp_path, snapshot_file):
+    library = make_library(tmp_path, snapshot_file)
+    first_half(library)
+    second_half(library)
+    expected = state(library)
+    library.close()
+
+    reopened = make_library(tmp_path, snapshot_file)
+    assert state(reopened) == expected
+    reopened.close()
+
+
+def test_replay_over_a_compaction_that_did_not_truncate_the_journal(tmp_path, snapshot_file):
+    library = make_library(tmp_path, snapshot_file)
+    first_half(library)
+    second_half(library)
+    expected = state(library)
+    journal = (tmp_path / "journal.jsonl").read_bytes()
+    library.compact()
+    library.close()
+    # A crash between saving the data files and truncating the journal.
+    (tmp_path / "journal.jsonl").write_bytes(journal)
+
+    reopened = make_library(tmp_path, snapshot_file)
+    assert state(reopened) == expected
+    reopened.compact()
+    reopened.close()
+    compacted = make_library(tmp_path, snapshot_file)
+    assert state(compacted) == expected
+    compacted.close()
+
+
+def test_replay_over_data_files_holding_part_of_the_journal(tmp_path, snapshot_file):
+    library = make_library(tmp_path, snapshot_file)
+    first_half(library)
+    first_records = (tmp_path / "journal.jsonl").read_bytes()
+    library.compact()
+    second_half(library)
+    expected = state(library)
+    library.close()
+    # The data files hold the first half; the journal both halves.
+    second_records = (tmp_path / "journal.jsonl").read_bytes()
+    (tmp_path / "journal.jsonl").write_bytes(first_records + second_records)
+
+    reopened = make_library(tmp_path, snapshot_file)
+    assert state(reopened) == expected
+    reopened.close()
+
+
+def test_replaying_the_journal_twice_changes_nothing(tmp_path, snapshot_file):
+    library = make_library(tmp_path, snapshot_file)
+    first_half(library)
+    second_half(library)
+    expected = state(library)
+    library.close()
+    journal = (tmp_path / "journal.jsonl").read_bytes()
+    (tmp_path / "journal.jsonl").write_bytes(journal + journal)
+
+    reopened = make_library(tmp_path, snapshot_file)
+    assert state(reopened) == expected
+    reopened.close()
@@ -0,0 +1,111 @@
+import random
+import pytest
+from book import BookManager
+from paging import KeyOrder, paginate
+from user import UserManager
+
+
+def walk(query, page_size, key):
+    """Collect every result of a paged query, following the cursor from page to page."""
+    results, cursor = [], None
+    while True:
+        page = list(query(limit=page_size, cursor=cursor))
+        if not page:
+            return results
+        results.extend(page)
+        cursor = key(page[-1])
+
+
+def test_paginate_resumes_after_the_cursor():
+    keys = [f"k{i}" for i in range(10)]
+    assert list(paginate(keys, limit=3)) == ["k0", "k1", "k2"]
+    assert list(paginate(keys, limit=3, cursor="k2")) == ["k3", "k4", "k5"]
+    assert list(paginate(keys, limit=3, offset=1, cursor="k2")) == ["k4", "k5", "k6"]
+    assert list(paginate(keys, cursor="k9")) == []
+    with pytest.raises(ValueError):
+        paginate(keys, cursor="missing")
+
+
+def test_key_order_matches_a_list_through_adds_and_removes():
+    rng = random.Random(0)
+    order, reference = KeyOrder(["a", "b"]), ["a", "b"]
+    for step in range(3000):
+        if reference and rng.random() < 0.45:
+            key = rng.choice(reference)
+            reference.remove(key)
+            order.remove(key)
+        else:
+            key = f"k{step}"
+            reference.append(key)
+            order.add(key)
+        if reference:
+            cursor = rng.choice(reference)
+            assert list(order.after(cursor)) == reference[reference.index(cursor) + 1:]
+    order.remove("not there")
+    assert len(order.keys) <= 2 * len(reference) + 1
+
+
+def test_key_order_rejects_removed_cursors():
+    order = KeyOrder(["a", "b", "c"])
+    order.remove("b")
+    with pytest.raises(ValueError):
+        order.after("b")
+    assert list(order.after("a")) == ["c"]
+
+
+def test_key_order_iterator_survives_compaction():
+    order = KeyOrder(f"k{i}" for i in range(10))
+    keys = order.after("k0")
+    assert next(keys) == "k1"
+    for i in range(2, 9):
+        order.remove(f"k{i}")
+    # The list was compacted under the iterator.
+    assert len(order.keys) < 10
+    assert list(keys) == ["k9"]
+
+
+def test_book_pages_cover_the_catalog_while_it_changes():
+    manager = BookManager(indexed=True)
+    manager.bulk_add_books([(f"Title {i}", f"Author {i % 7}", f"b{i}") for i in range(100)])
+    pages, cursor = [], None
+    while True:
+        page = list(manager.list_books(limit=7, cursor=cursor))
+        if not page:
+            break
+        pages.extend(book.isbn for book in page)
+        cursor = page[-1].isbn
+        # Deleting books already listed, and adding new ones, must not derail the walk.
+        manager.delete_book(pages[len(pages) // 2])
+        if len(pages) < 100:
+            manager.add_book("New", "Author", f"n{len(pages)}")
+    added = [isbn for isbn in manager.books if isbn.startswith("n")]
+    assert len(added) == 14
+    assert pages == [f"b{i}" for i in range(100)] + added
+
+
+def test_book_cursor_of_a_deleted_book_is_rejected():
+    manager = BookManager()
+    manager.bulk_add_books([(f"Title {i}", "Author", f"b{i}") for i in range(5)])
+    page = list(manager.list_books(limit=2))
+    manager.delete_book(page[-1].isbn)
+    with pytest.raises(ValueError):
+        manager.list_books(limit=2, cursor=page[-1].isbn)
+
+
+def test_search_pages_match_the_full_results():
+    manager = BookManager(indexed=True, cache_size=16)
+    manager.bulk_add_books([(f"Title {i}", f"Author {i % 7}", f"b{i}") for i in range(200)])
+    expected = [book.isbn for book in manager.search_books(author="author 3")]
+    assert walk(lambda **page: manager.search_books(author="author 3", **page), 4,
+                lambda book: book.isbn) == [manager.books[isbn] for isbn in expected]
+
+
+def test_user_pages_cover_every_user():
+    manager = UserManager()
+    for i in range(50):
+        manager.add_user(f"User {i}", f"u{i}")
+    manager.delete_user("u10")
+    users = walk(manager.search_users, 6, lambda user: user.user_id)
+    assert [user.user_id for user in users] == [user_id for user_id in manager.users]
+    with pytest.raises(ValueError):
+        manager.search_users(limit=6, cursor="u10")
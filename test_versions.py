@@ -0,0 +1,108 @@
+import pytest
+from check import LibraryManagementSystem
+from snapshot import MappedBooks
+
+
+def make_library(directory, snapshot_file=None):
+    """
+    Open a json library whose files all live in a directory.
+
+    Args:
+        directory (Path): Directory of the data files.
+        snapshot_file (str, optional): Name of a binary book snapshot in it. Defaults to None.
+
+    Returns:
+        LibraryManagementSystem: The library, printing nothing.
+    """
+    library = LibraryManagementSystem(directory / "books.json", directory / "users.json",
+                                      directory / "checkouts.json", journal_file=directory / "journal.jsonl",
+                                      durability='none', holds_file=directory / "holds.json",
+                                      snapshot_file=directory / snapshot_file if snapshot_file else None)
+    library.report = lambda message: None
+    return library
+
+
+@pytest.fixture(params=[None, "books.snapshot"], ids=["dict", "mapped"])
+def library(request, tmp_path):
+    """A library with a few books, users and one loan; books come from a mapped snapshot in the 'mapped' case."""
+    library = make_library(tmp_path, request.param)
+    for i in range(5):
+        library.add_book(f"Title {i}", f"Author {i}", f"b{i}")
+        library.add_user(f"User {i}", f"u{i}")
+    library.add_copies("b4", ["c1", "c2"])
+    library.checkout_book("u0", "b0")
+    library.compact()
+    library.close()
+    library = make_library(tmp_path, request.param)
+    assert isinstance(library.book_manager.books, MappedBooks) == bool(request.param)
+    yield library
+    library.close()
+
+
+def state(snapshot):
+    """Return everything a read snapshot shows, as plain values."""
+    return ([book.to_dict() for book in snapshot.books], list(snapshot.users),
+            sorted(snapshot.checkouts), len(snapshot.books), len(snapshot.users))
+
+
+def test_snapshot_ignores_later_changes(library):
+    snapshot = library.read_snapshot()
+    before = state(snapshot)
+    first = snapshot.books.get("b1")
+
+    library.update_book("b1", title="Renamed")
+    library.checkout_book("u1", "b2")
+    library.checkin_book("u0", "b0")
+    library.checkout_book("u2", "b4")
+    library.add_copies("b4", ["c3"])
+    library.add_book("New", "Author", "b9")
+    library.delete_book("b3")
+    library.update_user("u1", "Renamed")
+    library.add_user("New", "u9")
+    library.delete_user("u4")
+
+    assert state(snapshot) == before
+    assert snapshot.books.get("b1") == first
+    assert snapshot.books.get("b9") is None
+    assert snapshot.books.get("b3").title == "Title 3"
+
+    current = library.read_snapshot()
+    assert current.books.get("b1").title == "Renamed"
+    assert not current.books.get("b2").available
+    assert current.books.get("b0").available
+    assert current.books.get("b3") is None
+    assert [user.user_id for user in current.users] == ["u0", "u1", "u2", "u3", "u9"]
+    assert sorted(current.checkouts) == [("u1", "b2"), ("u2", "b4")]
+
+
+def test_snapshots_taken_at_different_times_are_independent(library):
+    first = library.read_snapshot()
+    library.update_book("b1", title="Second")
+    second = library.read_snapshot()
+    library.update_book("b1", title="Third")
+    library.delete_book("b1")
+
+    assert first.books.get("b1").title == "Title 1"
+    assert second.books.get("b1").title == "Second"
+    assert library.read_snapshot().books.get("b1") is None
+
+
+def test_snapshot_does_not_see_changes_between_its_pages(library):
+    snapshot = library.read_snapshot()
+    books = iter(snapshot.books)
+    assert next(books).isbn == "b0"
+    library.delete_book("b2")
+    library.update_book("b1", title="Renamed")
+    library.add_book("New", "Author", "b9")
+    assert [book.isbn for book in books] == ["b1", "b2", "b3", "b4"]
+    assert snapshot.books.get("b1").title == "Title 1"
+
+
+def test_export_reads_a_snapshot(library, tmp_path):
+    library.update_book("b1", title="Renamed")
+    library.export_books(tmp_path / "export.json")
+    exported = LibraryManagementSystem(tmp_path / "export.json", tmp_path / "no_users.json",
+                                       tmp_path / "no_checkouts.json")
+    assert exported.book_manager.get_book_by_isbn("b1").title == "Renamed"
+    assert exported.book_manager.get_book_by_isbn("b4").copies == library.book_manager.get_book_by_isbn("b4").copies
+    exported.close()
@@ -1,11 +1,82 @@
+import heapq
+import weakref
+from fuzzy import MAX_DISTANCE, FuzzyIndex
 from models import User
+from paging import KeyOrder, paginate
+from versions import user_view
 
 class UserManager:
     def __init__(self):
         """
         Initialize the UserManager class.
+
+        Users are kept in a dict keyed by user ID, in insertion order. The
+        FuzzyIndex of typo-tolerant searches is built on the first such search.
+        """
+        self.users = {}
+        self.readers = weakref.WeakSet()
+        self.shared = False
+        self.fuzzy = None
+        self.order = None
+
+    def load(self, users):
+        """
+        Replace the user list with the given users.
+
+        Args:
+            users (iterable): User objects to index.
+
+        Raises:
+            ValueError: If two users share the same user ID.
         """
-        self.users = []
+        self.users = {}
+        self.shared = False
+        self.fuzzy = None
+        self.order = None
+        for user in users:
+            self._insert(user)
+
+    def snapshot(self):
+        """
+        Take a read snapshot of the users, in constant time.
+
+        The container is shared with the snapshot until the next insertion or
+        deletion, which copies it first.
+
+        Returns:
+            FrozenView: UserRecords as of now, in registration order.
+        """
+        self.shared = True
+        view = user_view(self.users)
+        self.readers.add(view)
+        return view
+
+    def _own(self):
+        """
+        Copy the user container if a read snapshot shares it.
+        """
+        if self.shared:
+            self.users = dict(self.users)
+            self.shared = False
+
+    def _insert(self, user):
+        """
+        Index a user by their user ID.
+
+        Args:
+            user (User): The user to index.
+
+        Raises:
+            ValueError: If a user with the same ID already exists.
+        """
+        if user.user_id in self.users:
+            raise ValueError(f"A user with ID '{user.user_id}' already exists.")
+        self._own()
+        self.users[user.user_id] = user
+        if self.fuzzy is not None:
+            self.fuzzy.add(user.user_id, (user.name,))
+        if self.order is not None:
+            self.order.add(user.user_id)
 
     def add_user(self, name, user_id):
         """
@@ -14,9 +85,30 @@ class UserManager:
         Args:
             name (str): The name of the user.
             user_id (int): The ID of the user.
+
+        Raises:
+            ValueError: If a user with the same ID already exists.
+        """
+        self._insert(User(name, user_id))
+
+    def bulk_add_users(self, records):
+        """
+        Add many users at once.
+
+        All user IDs are checked before any user is added, so either every
+        user is added or none is.
+
+        Args:
+            records (list): (name, user_id) tuples.
+
+        Raises:
+            ValueError: If a user ID is repeated or already in the user list.
         """
-        user = User(name, user_id)
-        self.users.append(user)
+        user_ids = {user_id for _, user_id in records}
+        if len(user_ids) != len(records) or not user_ids.isdisjoint(self.users):
+            raise ValueError("Bulk add contains duplicate or existing user IDs.")
+        for name, user_id in records:
+            self._insert(User(name, user_id))
 
     def update_user(self, user_id, name=None):
         """
@@ -32,7 +124,12 @@ class UserManager:
                 if not isinstance(name, str):
                     print("Name must be a string.")
                     return
+                for view in self.readers:
+                    view.keep(user_id, user)
                 user.name = name
+                if self.fuzzy is not None:
+                    self.fuzzy.remove(user_id)
+                    self.fuzzy.add(user_id, (name,))
 
     def delete_user(self, user_id):
         """
@@ -41,34 +138,152 @@ class UserManager:
         Args:
             user_id (int): The ID of the user to delete.
         """
-        user = self.get_user_by_id(user_id)
-        if user:
-            self.users.remove(user)
+        if user_id in self.users:
+            self._own()
+            del self.users[user_id]
+            if self.fuzzy is not None:
+                self.fuzzy.remove(user_id)
+            if self.order is not None:
+                self.order.remove(user_id)
+
+    def fuzzy_index(self):
+        """
+        Return the index of name words, building it on first use.
+
+        Returns:
+            FuzzyIndex: The index.
+        """
+        if self.fuzzy is None:
+            fuzzy = FuzzyIndex(('name',))
+            for user in self.users.values():
+                fuzzy.add(user.user_id, (user.name,))
+            self.fuzzy = fuzzy
+        return self.fuzzy
 
-    def list_users(self):
+    def key_order(self):
         """
-        Print the details of all users in the user list.
+        Return the registration order of the user IDs, building it on first use.
+
+        Returns:
+            KeyOrder: User IDs in registration order, for seeking list cursors.
+        """
+        if self.order is None:
+            self.order = KeyOrder(self.users)
+        return self.order
+
+    def list_users(self, limit=None, offset=0, cursor=None):
+        """
+        Lazily list the users in registration order.
+
+        Args:
+            limit (int, optional): Maximum number of users. Defaults to None (all).
+            offset (int, optional): Number of users to skip. Defaults to 0.
+            cursor (str, optional): ID of the last user of the previous page; sought
+                through key_order(). Defaults to None.
+
+        Returns:
+            iterator: The users of the page.
+
+        Raises:
+            ValueError: If the cursor user does not exist.
+        """
+        user_ids = self.users if cursor is None else self.key_order().after(cursor)
+        return map(self.users.__getitem__, paginate(user_ids, limit, offset))
+
+    def search_users(self, name=None, user_id=None, limit=None, offset=0, cursor=None, fuzzy=0):
+        """
+        Lazily search for users based on name and/or user ID.
+
+        Substring searches return users in registration order, fuzzy ones
+        as ranked by fuzzy_matches.
+
+        Args:
+            name (str, optional): The name to search for. Defaults to None.
+            user_id (int, optional): The user ID to search for. Defaults to None.
+            limit (int, optional): Maximum number of results. Defaults to None (all).
+            offset (int, optional): Number of results to skip. Defaults to 0.
+            cursor (str, optional): ID of the last result of the previous page. Defaults to None.
+            fuzzy (int, optional): Match every word of the name with up to this
+                many typos, instead of as a substring; see fuzzy_matches.
+                Defaults to 0 (substring search).
+
+        Returns:
+            iterator: The users matching the search criteria.
+
+        Raises:
+            ValueError: If the cursor is not among the results; see paging.paginate.
+        """
+        if not (name or user_id):
+            return self.list_users(limit, offset, cursor)
+        if fuzzy and name:
+            stop = None if limit is None or cursor is not None else offset + limit
+            user_ids = (key[-1] for key in self.fuzzy_matches(name, fuzzy, user_id, stop))
+            return map(self.users.__getitem__, paginate(user_ids, limit, offset, cursor))
+        if user_id:
+            user = self.users.get(user_id)
+            candidates = [user] if user else []
+        else:
+            candidates = self.users.values()
+        name = name.lower() if name else None
+        user_ids = (user.user_id for user in candidates if not name or name in user.name.lower())
+        return map(self.users.__getitem__, paginate(user_ids, limit, offset, cursor))
+
+    def fuzzy_matches(self, name, max_distance=MAX_DISTANCE, user_id=None, stop=None):
+        """
+        Find the users whose name contains every query word, give or take a few typos.
+
+        Results are ranked by the total edit distance, then by name and user ID.
+
+        Args:
+            name (str): Words of the name.
+            max_distance (int, optional): Largest edit distance per word; see
+                FuzzyIndex.similar. Defaults to MAX_DISTANCE.
+            user_id (str, optional): Only this user. Defaults to None.
+            stop (int, optional): Number of best results needed. Defaults to None (all).
+
+        Returns:
+            list: Sort keys (distance, lowercased name, user ID) of the matches, best first.
+        """
+        matches = self._fuzzy_candidates(name, max_distance, user_id)
+        users = self.users
+
+        def rank(key):
+            return matches[key], users[key].name.lower(), key
+
+        if stop is not None:
+            return heapq.nsmallest(stop, map(rank, matches))
+        return sorted(map(rank, matches))
+
+    def _fuzzy_candidates(self, name, max_distance, user_id):
+        """
+        Find the users matching a fuzzy query, unordered.
+
+        Returns:
+            dict: Total edit distance of each matching user ID.
         """
-        for user in self.users:
-            print(user)
+        matches = self.fuzzy_index().matches((name,), max_distance)
+        if user_id:
+            matches = {user_id: matches[user_id]} if user_id in matches else {}
+        return matches
 
-    def search_users(self, name=None, user_id=None):
+    def count_users(self, name=None, user_id=None, fuzzy=0):
         """
-        Search for users based on name and/or user ID.
+        Count the users matching the search criteria without building the results.
 
         Args:
             name (str, optional): The name to search for. Defaults to None.
             user_id (int, optional): The user ID to search for. Defaults to None.
+            fuzzy (int, optional): Largest edit distance per word, see
+                search_users. Defaults to 0 (substring search).
 
         Returns:
-            list: A list of users matching the search criteria.
+            int: The number of matching users.
         """
-        results = []
-        for user in self.users:
-            if (not name or name.lower() in user.name.lower()) and \
-               (not user_id or user_id == user.user_id):
-                results.append(user)
-        return results
+        if not (name or user_id):
+            return len(self.users)
+        if fuzzy and name:
+            return len(self._fuzzy_candidates(name, fuzzy, user_id))
+        return sum(1 for _ in self.search_users(name, user_id))
 
     def get_user_by_id(self, user_id):
         """
@@ -80,7 +295,4 @@ class UserManager:
         Returns:
             User: The user object with the specified user ID, or None if not found.
         """
-        for user in self.users:
-            if user.user_id == user_id:
-                return user
-        return None
+        return self.users.get(user_id)
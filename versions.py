@@ -0,0 +1,181 @@
+import operator
+from collections import namedtuple
+
+
+class BookRecord(namedtuple('BookRecord', 'title author isbn available copies checked_out_copies')):
+    """Immutable copy of a book's fields; copies is None for a book without copies."""
+
+    __slots__ = ()
+
+    @classmethod
+    def capture(cls, book):
+        """
+        Copy the fields of a book.
+
+        Args:
+            book (Book): The book.
+
+        Returns:
+            BookRecord: The copy.
+        """
+        if book.copies is None:
+            return cls(book.title, book.author, book.isbn, book.available, None, None)
+        return cls(book.title, book.author, book.isbn, book.available, tuple(book.copies),
+                   tuple(book.checked_out_copies()))
+
+    def to_dict(self):
+        """
+        Convert the record to a dictionary in the format of the books file, see Book.to_dict.
+
+        Returns:
+            dict: A dictionary representation of the record.
+        """
+        data = {'title': self.title, 'author': self.author, 'isbn': self.isbn, 'available': self.available}
+        if self.copies is not None:
+            data['copies'] = list(self.copies)
+            data['checked_out_copies'] = list(self.checked_out_copies)
+        return data
+
+
+class UserRecord(namedtuple('UserRecord', 'name user_id')):
+    """Immutable copy of a user's fields; loans are in the checkouts of the snapshot."""
+
+    __slots__ = ()
+
+    @classmethod
+    def capture(cls, user):
+        """
+        Copy the fields of a user.
+
+        Args:
+            user (User): The user.
+
+        Returns:
+            UserRecord: The copy.
+        """
+        return cls(user.name, user.user_id)
+
+
+class FrozenView:
+    """
+    Records of a manager as they were when the view was taken.
+
+    The view shares the manager's container, which the manager copies before
+    its next insertion or deletion. Objects changed in place afterwards are
+    saved to the view first by keep(), so the view never sees the change.
+    """
+
+    def __init__(self, container, capture, key):
+        """
+        Initialize the FrozenView class.
+
+        Args:
+            container (dict): Live objects by key; no longer changed by the manager.
+            capture (callable): Builds the immutable record of an object.
+            key (callable): Returns the key of a record.
+        """
+        self.container = container
+        self.capture = capture
+        self.key = key
+        self.preimages = {}
+
+    def keep(self, key, obj):
+        """
+        Save the current record of an object that is about to change in place.
+
+        Args:
+            key (str): Key of the object.
+            obj (object): The live object.
+        """
+        if key in self.preimages:
+            return
+        peek = getattr(self.container, 'peek', self.container.get)
+        if peek(key) is obj:
+            self.preimages[key] = self.capture(obj)
+
+    def get(self, key):
+        """
+        Return the record of a key.
+
+        Args:
+            key (str): ISBN or user ID.
+
+        Returns:
+            namedtuple: The record, or None if the key was not present.
+        """
+        obj = getattr(self.container, 'peek', self.container.get)(key)
+        if obj is None:
+            return None
+        record = self.capture(obj)
+        return self.preimages.get(key, record)
+
+    def __len__(self):
+        """Return the number of records."""
+        return len(self.container)
+
+    def __iter__(self):
+        """Iterate over the records in the container's order."""
+        capture, key, preimages = self.capture, self.key, self.preimages
+        for obj in self.container.values():
+            # Fields are read before looking for a preimage: a writer saves the
+            # preimage before changing anything, so a torn read is never used.
+            record = capture(obj)
+            yield preimages.get(key(record), record)
+
+
+class ReadSnapshot:
+    """
+    Consistent view of books, users and checkouts, read without holding any lock.
+
+    Taking one costs the same whatever the catalog size. It is reclaimed when
+    the last reference to it is dropped.
+    """
+
+    def __init__(self, books, users, checkouts):
+        """
+        Initialize the ReadSnapshot class.
+
+        Args:
+            books (FrozenView): Book records.
+            users (FrozenView): User records.
+            checkouts (dict): Checkout entries keyed by (user_id, isbn); entries
+                are never changed in place.
+        """
+        self.books = books
+        self.users = users
+        self.checkouts = checkouts
+
+    def loans(self):
+        """
+        Iterate over the checkout entries, oldest first.
+
+        Yields:
+            dict: Checkout entries with 'user_id', 'isbn', 'checkout_time' and 'due' keys.
+        """
+        return iter(self.checkouts.values())
+
+
+def book_view(books):
+    """
+    Create a FrozenView of a book container.
+
+    Args:
+        books (dict): Book objects keyed by ISBN.
+
+    Returns:
+        FrozenView: The view.
+    """
+    return FrozenView(books, BookRecord.capture, operator.attrgetter('isbn'))
+
+
+def user_view(users):
+    """
+    Create a FrozenView of a user container.
+
+    Args:
+        users (dict): User objects keyed by user ID.
+
+    Returns:
+        FrozenView: The view.
+    """
+    return FrozenView(users, UserRecord.capture, operator.attrgetter('user_id'))